@@ -8,7 +8,8 @@ from .models import (
     PostCategory,
     Tag,
     PostTag,
-    PostView
+    PostView,
+    PostLike,
 )
 # Register your models here.
 
@@ -21,3 +22,4 @@ admin.site.register(PostCategory)
 admin.site.register(Tag)
 admin.site.register(PostTag)
 admin.site.register(PostView)
+admin.site.register(PostLike)
@@ -0,0 +1,178 @@
+"""Async read endpoints for posts, comment threads and tags.
+
+Same representations as the DRF viewsets, built with Django's async ORM so
+that under ASGI a request waiting on the database doesn't hold a thread.
+Independent queries (a page and its total count) are awaited together;
+with ASYNC_READS['PARALLEL_QUERIES'] each of them runs on its own thread and
+database connection, so they also overlap in the database.
+"""
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse
+from rest_framework.exceptions import APIException, MethodNotAllowed, NotFound
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .counters import post_counters
+from .models import Comment, Post, Tag
+from .renderers import ORJSONRenderer
+from .serializers import (
+    CommentSerializer, PostListSerializer, PostSerializer, TagSerializer, rendered_fields,
+)
+from .utility import build_comment_tree
+from .views import parse_thread_depth
+
+DEFAULTS = {
+    # Needs one connection per concurrent query; off inside a test transaction
+    'PARALLEL_QUERIES': False,
+}
+
+POST_ORDERING_FIELDS = ('created_at', 'comments_count')
+
+
+def async_read_settings():
+    return {**DEFAULTS, **getattr(settings, 'ASYNC_READS', {})}
+
+
+def _in_own_connection(call):
+    def run():
+        try:
+            return call()
+        finally:
+            # Honours CONN_MAX_AGE, so pooled threads keep reusing their connection
+            close_old_connections()
+    return run
+
+
+async def gather_queries(*calls):
+    """Await independent ORM calls together, results in argument order."""
+    if async_read_settings()['PARALLEL_QUERIES']:
+        return await asyncio.gather(
+            *(sync_to_async(_in_own_connection(call), thread_sensitive=False)() for call in calls)
+        )
+    # Thread-sensitive calls share the request's connection and run one by one
+    return await asyncio.gather(*(sync_to_async(call)() for call in calls))
+
+
+def read_endpoint(view):
+    """GET-only, DRF Request in, rendered JSON (or the DRF error body) out."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            if request.method not in ('GET', 'HEAD'):
+                raise MethodNotAllowed(request.method)
+            data = await view(Request(request), *args, **kwargs)
+            status = 200
+        except APIException as exc:
+            data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            status = exc.status_code
+        return HttpResponse(ORJSONRenderer().render(data), status=status, content_type='application/json')
+    return wrapper
+
+
+def page_number(request):
+    try:
+        number = int(request.query_params.get('page', 1))
+    except ValueError:
+        raise NotFound('Invalid page.')
+    if number < 1:
+        raise NotFound('Invalid page.')
+    return number
+
+
+def page_size(request, default, query_param=None, maximum=None):
+    if query_param and query_param in request.query_params:
+        try:
+            size = int(request.query_params[query_param])
+        except ValueError:
+            return default
+        if size > 0:
+            return min(size, maximum) if maximum else size
+    return default
+
+
+def paginated(request, number, size, count, results):
+    """The PageNumberPagination response body."""
+    if number > 1 and (number - 1) * size >= count:
+        raise NotFound('Invalid page.')
+    url = request.build_absolute_uri()
+    previous = None
+    if number == 2:
+        previous = remove_query_param(url, 'page')
+    elif number > 2:
+        previous = replace_query_param(url, 'page', number - 1)
+    return {
+        'count': count,
+        'next': replace_query_param(url, 'page', number + 1) if number * size < count else None,
+        'previous': previous,
+        'results': results,
+    }
+
+
+async def paginate_queryset(request, queryset, size):
+    number = page_number(request)
+    offset = (number - 1) * size
+    count, items = await gather_queries(queryset.count, lambda: list(queryset[offset:offset + size]))
+    return number, count, items
+
+
+def post_ordering(request):
+    fields = [
+        field.strip() for field in request.query_params.get('ordering', '').split(',')
+        if field.strip().lstrip('-') in POST_ORDERING_FIELDS
+    ]
+    return fields or ['-created_at']
+
+
+@read_endpoint
+async def post_list(request):
+    serializer = PostListSerializer(context={'request': request})
+    queryset = Post.objects.for_serialization(fields=rendered_fields(serializer)).order_by(*post_ordering(request))
+    size = api_settings.PAGE_SIZE
+    number, count, posts = await paginate_queryset(request, queryset, size)
+    results = PostListSerializer(posts, many=True, context={'request': request}).data
+    return paginated(request, number, size, count, results)
+
+
+@read_endpoint
+async def post_detail(request, pk):
+    serializer = PostSerializer(context={'request': request})
+    queryset = Post.objects.for_serialization(fields=rendered_fields(serializer))
+    try:
+        post = await queryset.aget(pk=pk)
+    except Post.DoesNotExist:
+        raise NotFound('No Post matches the given query.')
+    # May flush the buffer, which writes to the database
+    await sync_to_async(post_counters.increment_view)(post.pk)
+    return PostSerializer(post, context={'request': request}).data
+
+
+@read_endpoint
+async def comment_thread(request, post_pk):
+    depth = parse_thread_depth(request)
+    comments = [
+        comment async for comment in
+        Comment.objects.filter(post_id=post_pk, status=Comment.Status.APPROVED)
+        .select_related('user').order_by('created_at')
+    ]
+    # Paginated by top-level threads, like CommentViewSet
+    roots, children = build_comment_tree(comments)
+    number, size = page_number(request), api_settings.PAGE_SIZE
+    page = roots[(number - 1) * size:number * size]
+
+    context = {'request': request, 'comment_children': children, 'depth': depth}
+    results = CommentSerializer(page, many=True, context=context).data
+    return paginated(request, number, size, len(roots), results)
+
+
+@read_endpoint
+async def tag_list(request):
+    # SmallResultsSetPagination
+    size = page_size(request, 3, query_param='page_size', maximum=20)
+    number, count, tags = await paginate_queryset(request, Tag.objects.all(), size)
+    return paginated(request, number, size, count, TagSerializer(tags, many=True).data)
@@ -0,0 +1,166 @@
+"""JWT authentication that builds request.user from the token claims.
+
+Access tokens issued by MyTokenObtainPairSerializer carry the user's id,
+user_name, role and is_staff, so ClaimsJWTAuthentication authenticates
+without touching the database. Anything else (email, FK assignment, tokens
+without the claims) goes through a short-lived cached User lookup.
+
+Because the claims are trusted until the token expires, revocation goes
+through an in-process denylist: single tokens (logout) by jti, and every
+token of a user issued before a given moment (deactivation, role change).
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from .metrics import cache_requests
+from .models import User
+
+DEFAULTS = {
+    'CLAIMS_USER': True,  # False always loads the User (cached)
+    'USER_CACHE_ALIAS': 'default',
+    'USER_CACHE_TIMEOUT': 60,
+    'DENYLIST_MAX_SIZE': 10000,
+}
+
+# Claims a token needs for request.user to be built without a lookup
+USER_CLAIMS = ('user_name', 'role', 'is_staff')
+
+
+def token_auth_settings():
+    return {**DEFAULTS, **getattr(settings, 'TOKEN_AUTH', {})}
+
+
+def _user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def get_cached_user(user_id):
+    """The User with ``user_id``, from the cache when possible, else None."""
+    config = token_auth_settings()
+    cache = caches[config['USER_CACHE_ALIAS']]
+    key = _user_cache_key(user_id)
+    user = cache.get(key)
+    cache_requests.inc('user', 'miss' if user is None else 'hit')
+    if user is None:
+        user = User.objects.filter(pk=user_id).first()
+        if user is not None:
+            cache.set(key, user, config['USER_CACHE_TIMEOUT'])
+    return user
+
+
+def forget_cached_user(user_id):
+    caches[token_auth_settings()['USER_CACHE_ALIAS']].delete(_user_cache_key(user_id))
+
+
+class ClaimsUser(TokenUser):
+    """request.user backed by the token claims.
+
+    Attributes that aren't claims are read from the cached User instance,
+    which is also what ``instance`` returns for FK assignment.
+    """
+
+    @cached_property
+    def user_name(self):
+        return self.token['user_name']
+
+    @cached_property
+    def username(self):
+        return self.user_name
+
+    @cached_property
+    def role(self):
+        return self.token['role']
+
+    @cached_property
+    def instance(self):
+        user = get_cached_user(self.id)
+        if user is None:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        return user
+
+    def __getattr__(self, attr):
+        # TokenUser falls back to raw claims; fall back to the model instead
+        if attr.startswith('_') or attr == 'token':
+            raise AttributeError(attr)
+        return getattr(self.instance, attr)
+
+    def __str__(self):
+        return self.user_name
+
+
+def model_user(user):
+    """The User instance for ``request.user``, e.g. to assign to a foreign key."""
+    return user.instance if isinstance(user, ClaimsUser) else user
+
+
+class TokenDenylist:
+    """Revoked tokens, kept only until they would have expired anyway."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = {}  # jti -> exp
+        self.users = {}  # str(user id) -> tokens issued up to this second are revoked
+
+    def revoke_token(self, token):
+        with self.lock:
+            self.prune()
+            self.tokens[token[api_settings.JTI_CLAIM]] = token['exp']
+
+    def revoke_user(self, user_id):
+        with self.lock:
+            self.prune()
+            # Tokens carry the id as a string, and iat in whole seconds: one
+            # issued in the same second may predate the revocation
+            self.users[str(user_id)] = int(time.time())
+
+    def is_revoked(self, token):
+        revoked_at = self.users.get(str(token.get(api_settings.USER_ID_CLAIM)))
+        if revoked_at is not None and token.get('iat', 0) <= revoked_at:
+            return True
+        return token.get(api_settings.JTI_CLAIM) in self.tokens
+
+    def prune(self):
+        now = time.time()
+        lifetime = max(api_settings.ACCESS_TOKEN_LIFETIME, api_settings.REFRESH_TOKEN_LIFETIME).total_seconds()
+        self.tokens = {jti: exp for jti, exp in self.tokens.items() if exp > now}
+        self.users = {user_id: at for user_id, at in self.users.items() if at + lifetime > now}
+
+        overflow = len(self.tokens) - token_auth_settings()['DENYLIST_MAX_SIZE']
+        if overflow > 0:
+            # Drop the tokens closest to expiry first
+            for jti in sorted(self.tokens, key=self.tokens.get)[:overflow]:
+                del self.tokens[jti]
+
+    def clear(self):
+        with self.lock:
+            self.tokens.clear()
+            self.users.clear()
+
+
+denylist = TokenDenylist()
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        if denylist.is_revoked(validated_token):
+            raise InvalidToken('Token has been revoked')
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        if token_auth_settings()['CLAIMS_USER'] and all(claim in validated_token for claim in USER_CLAIMS):
+            return ClaimsUser(validated_token)
+
+        user = get_cached_user(validated_token[api_settings.USER_ID_CLAIM])
+        if user is None:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return user
@@ -0,0 +1,145 @@
+"""Helpers for the benchmark/load-test management commands.
+
+Requests are handed straight to the WSGI/ASGI applications, so the
+numbers include Django's whole request cycle (middleware, connection
+handling, rendering) but no HTTP server or network.
+"""
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+from io import BytesIO
+
+import django
+from django.db import connection
+
+
+def wsgi_request(application, path, method='GET', body=b'', headers=None):
+    """Send a request through a WSGI application, returns (ms, status).
+
+    ``headers`` are CGI-style names, e.g. {'CONTENT_TYPE': ..., 'HTTP_AUTHORIZATION': ...}.
+    """
+    route, _, query = path.partition('?')
+    environ = {
+        'REQUEST_METHOD': method, 'PATH_INFO': route, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+        'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http',
+        'wsgi.input': BytesIO(body), 'wsgi.errors': BytesIO(), 'wsgi.multithread': True,
+        'wsgi.multiprocess': False, 'wsgi.run_once': False,
+        'CONTENT_LENGTH': str(len(body)), **(headers or {}),
+    }
+    status = []
+    started = time.perf_counter()
+    body = application(environ, lambda code, headers: status.append(int(code.split()[0])))
+    b''.join(body)
+    body.close()
+    return (time.perf_counter() - started) * 1000, status[0]
+
+
+async def asgi_request(application, path):
+    """GET ``path`` through an ASGI application, returns (ms, status)."""
+    route, _, query = path.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': route, 'raw_path': route.encode(), 'query_string': query.encode(),
+        'root_path': '', 'headers': [(b'host', b'localhost')],
+        'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+    }
+    status = []
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # The client never disconnects; Django cancels this once it has responded
+        await asyncio.Future()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    started = time.perf_counter()
+    await application(scope, receive, send)
+    return (time.perf_counter() - started) * 1000, status[0]
+
+
+def summarize(elapsed, results):
+    """Throughput and latency of a run of (ms, status) results."""
+    timings = sorted(timing for timing, _ in results)
+
+    def percentile(p):
+        return timings[min(len(timings) - 1, int(len(timings) * p))]
+
+    return {
+        'requests': len(timings),
+        'rps': len(timings) / elapsed if elapsed else 0,
+        'mean_ms': statistics.mean(timings),
+        'p50_ms': statistics.median(timings),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'errors': sum(1 for _, status in results if status >= 400),
+    }
+
+
+def format_summary(label, summary):
+    return (
+        f"{label:>12}: {summary['rps']:8.1f} req/s, mean {summary['mean_ms']:.2f} ms, "
+        f"p50 {summary['p50_ms']:.2f} ms, p95 {summary['p95_ms']:.2f} ms, p99 {summary['p99_ms']:.2f} ms, "
+        f"errors {summary['errors']}"
+    )
+
+
+class QueryCounter:
+    """Counts the queries run on ``connection`` while installed with execute_wrapper()."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    """What a result file needs to be compared with another one."""
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def write_results(path, results):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(results, indent=2, sort_keys=True) + '\n')
+
+
+def compare_summaries(previous, current, label):
+    """One line with the change in throughput and p50/p95 latency since ``previous``."""
+    def change(key):
+        before, after = previous.get(key), current.get(key)
+        if not before or after is None:
+            return 'n/a'
+        return f'{(after - before) / before * 100:+.1f}%'
+
+    return (
+        f"{label:>16}: rps {change('rps')}, p50 {change('p50_ms')}, p95 {change('p95_ms')}, "
+        f"queries {previous.get('queries_mean', 0):.1f} -> {current.get('queries_mean', 0):.1f}"
+    )
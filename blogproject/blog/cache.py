@@ -0,0 +1,121 @@
+"""Versioned response cache for anonymous reads.
+
+Every cached response is stored under the current version of its resource
+("posts", "tags"). Writes don't delete keys, they bump the version once the
+transaction commits, so all stale entries become unreachable at once and
+expire on their own.
+"""
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from rest_framework.response import Response
+
+from .metrics import cache_requests
+
+DEFAULTS = {
+    'ENABLED': True,
+    'ALIAS': 'default',  # any Django cache backend
+    'TIMEOUT': 300,
+    'KEY_PREFIX': 'response',
+}
+
+# Validators set by ConditionalGetMixin, cached with the data so hits need no query
+CACHED_HEADERS = ('ETag',)
+
+
+def cache_settings():
+    return {**DEFAULTS, **getattr(settings, 'RESPONSE_CACHE', {})}
+
+
+def get_cache():
+    return caches[cache_settings()['ALIAS']]
+
+
+def _version_key(resource):
+    return f"{cache_settings()['KEY_PREFIX']}:version:{resource}"
+
+
+def get_version(resource):
+    cache = get_cache()
+    key = _version_key(resource)
+    version = cache.get(key)
+    if version is None:
+        # Time based, so a version key evicted from the cache never comes back
+        # with a number that old entries were stored under
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(*resources):
+    cache = get_cache()
+    for resource in resources:
+        key = _version_key(resource)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def invalidate(*resources):
+    """Bump the resources' versions after the current transaction commits."""
+    transaction.on_commit(lambda: bump_version(*resources))
+
+
+class CachedReadMixin:
+    """Serves list/retrieve for anonymous users from the response cache.
+
+    ``cache_resource`` names the version the entries depend on. The key covers
+    the path, every query parameter (page, ordering, tag, category, ...) and
+    the negotiated format. Listed before ConditionalGetMixin, so entries keep
+    the validators it sets and a conditional hit is answered from the cache.
+    """
+    cache_resource = 'posts'
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedReadMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(CachedReadMixin, self).retrieve(request, *args, **kwargs)
+        )
+
+    def cached_response(self, request, build):
+        config = cache_settings()
+        if not config['ENABLED'] or request.user.is_authenticated:
+            return build()
+
+        key = self.response_cache_key(request, config)
+        cache = get_cache()
+        cached = cache.get(key)
+        if cached is not None:
+            cache_requests.inc('response', 'hit')
+            data, status, headers = cached
+            not_modified = get_conditional_response(request, etag=headers.get('ETag'))
+            if not_modified is not None:
+                return not_modified
+            return Response(data, status=status, headers=headers)
+        cache_requests.inc('response', 'miss')
+
+        response = build()
+        if response.status_code == 200:
+            headers = {name: response[name] for name in CACHED_HEADERS if name in response}
+            cache.set(key, (response.data, response.status_code, headers), config['TIMEOUT'])
+        return response
+
+    def response_cache_key(self, request, config):
+        params = urlencode(sorted(request.query_params.lists()), doseq=True)
+        # Hashed so long query strings stay within backend key limits
+        url = hashlib.sha1(f'{request.get_host()}{request.path}?{params}'.encode()).hexdigest()
+        return ':'.join([
+            config['KEY_PREFIX'],
+            self.cache_resource,
+            str(get_version(self.cache_resource)),
+            request.accepted_renderer.format,
+            url,
+        ])
@@ -0,0 +1,104 @@
+"""Conditional GET (ETag) for read endpoints.
+
+Validators are derived from a small aggregate query (timestamps and
+counters), so a matching If-None-Match gets its 304 before any object is
+serialized. There is no Last-Modified: deletes, counter changes and
+comments approved after newer ones don't move any timestamp, and a client
+revalidating by date alone would get a stale 304.
+"""
+import hashlib
+from urllib.parse import urlencode
+
+from django.db.models import Count, Max, Q
+from django.utils.cache import get_conditional_response, quote_etag
+
+from .cache import get_version
+from .models import Comment, Post
+
+
+def make_etag(request, *parts):
+    # The representation also depends on the query string and the format
+    params = urlencode(sorted(request.query_params.lists()), doseq=True)
+    raw = '|'.join(str(part) for part in (request.path, params, request.accepted_renderer.format, *parts))
+    return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+
+class ConditionalGetMixin:
+    """Adds an ETag to list/retrieve and answers 304 early.
+
+    Views override ``get_list_validators()`` and ``get_object_validators()``,
+    each returning the parts the ETag is derived from. ``None`` skips the
+    conditional handling, e.g. so that a missing object gets the regular 404.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, self.get_list_validators(),
+            lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, self.get_object_validators(),
+            lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs),
+        )
+
+    def get_list_validators(self):
+        return None
+
+    def get_object_validators(self):
+        return None
+
+    def conditional_response(self, request, validators, build):
+        if validators is None:
+            return build()
+        etag = make_etag(request, *validators)
+
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+        response = build()
+        if response.status_code == 200:
+            response['ETag'] = etag
+        return response
+
+
+def post_list_validators(queryset):
+    """Validators for a list of posts.
+
+    The newest edit and highest id are index lookups. Deletes and comment
+    counter changes don't show up in either, so the 'posts' cache version,
+    bumped on every such write, is part of the ETag as well. No COUNT(*).
+    """
+    stats = queryset.order_by().aggregate(updated=Max('updated_at'), last_id=Max('id'))
+    return stats['updated'], stats['last_id'], get_version('posts')
+
+
+def post_validators(pk):
+    """Validators for one post.
+
+    Like for lists, the 'posts' version covers changes to what the post
+    embeds (tags, categories, its author) that leave the row alone.
+    view_count moves with every counter flush; a flush doesn't bump the
+    version, so a cached response keeps its view_count and its ETag until
+    it expires.
+    """
+    try:
+        posts = Post.objects.filter(pk=pk)
+    except ValueError:
+        return None
+    stats = (
+        posts
+        .annotate(latest_comment=Max('comments__created_at', filter=Q(comments__status=Comment.Status.APPROVED)))
+        .values_list('updated_at', 'comments_count', 'view_count', 'latest_comment')
+        .first()
+    )
+    # None for a missing post, which then gets the regular 404
+    return None if stats is None else (*stats, get_version('posts'))
+
+
+def comment_list_validators(queryset):
+    # Edits only move updated_at; approvals and removals change the count
+    stats = queryset.order_by().aggregate(updated=Max('updated_at'), count=Count('id'), last_id=Max('id'))
+    return stats['updated'], stats['count'], stats['last_id']
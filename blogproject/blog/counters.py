@@ -0,0 +1,140 @@
+import atexit
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .models import Post, PostView
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'FLUSH_INTERVAL': 10,  # seconds, None disables the background flush
+    'MAX_PENDING': 1000,  # flush early once this many posts have pending increments
+}
+
+
+def counter_settings():
+    return {**DEFAULTS, **getattr(settings, 'POST_COUNTERS', {})}
+
+
+def _delta_case(field, deltas):
+    return Case(
+        *[When(**{field: post_id}, then=Value(n)) for post_id, n in deltas.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+class PostCounterBuffer:
+    """Buffers view/like increments in process and writes them in batches.
+
+    Hot posts would otherwise take a row lock per request. Increments are only
+    dropped from the buffer once the flush transaction commits; a failed flush
+    merges them back, so every increment is written at least once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = Counter()
+        self._likes = Counter()
+        self._timer = None
+        # The database the increments are for, see flush_at_exit()
+        self._database = None
+
+    def increment_view(self, post_id, n=1):
+        self._increment(self._views, post_id, n)
+
+    def increment_like(self, post_id, n=1):
+        self._increment(self._likes, post_id, n)
+
+    def pending(self):
+        with self._lock:
+            return dict(self._views), dict(self._likes)
+
+    def _increment(self, counter, post_id, n):
+        config = counter_settings()
+        if not config['ENABLED']:
+            return
+        with self._lock:
+            counter[post_id] += n
+            self._database = connection.settings_dict['NAME']
+            size = len(self._views) + len(self._likes)
+            self._ensure_timer(config['FLUSH_INTERVAL'])
+        if size >= config['MAX_PENDING']:
+            self.flush()
+
+    def _ensure_timer(self, interval):
+        if interval and self._timer is None:
+            self._timer = threading.Timer(interval, self._flush_periodically)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_periodically(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        finally:
+            # Every timer is a new thread with its own connection
+            close_old_connections()
+
+    def flush_at_exit(self):
+        """Flush what's left, unless it was counted against another database.
+
+        After a test run the connection points back at the real database
+        and the test database the increments belong to is gone.
+        """
+        if self._database is not None and self._database != connection.settings_dict['NAME']:
+            return
+        self.flush()
+
+    def clear(self):
+        """Drop the pending increments without writing them."""
+        with self._lock:
+            self._views.clear()
+            self._likes.clear()
+
+    def flush(self):
+        with self._lock:
+            views, self._views = self._views, Counter()
+            likes, self._likes = self._likes, Counter()
+        if not views and not likes:
+            return 0
+
+        try:
+            with transaction.atomic():
+                self._write(views, likes)
+        except DatabaseError:
+            logger.exception('Flushing post counters failed, keeping %d posts buffered', len(set(views) | set(likes)))
+            with self._lock:
+                self._views.update(views)
+                self._likes.update(likes)
+            return 0
+        return len(set(views) | set(likes))
+
+    def _write(self, views, likes):
+        if views:
+            Post.objects.filter(pk__in=views).update(view_count=F('view_count') + _delta_case('pk', views))
+
+        post_ids = set(views) | set(likes)
+        missing = post_ids - set(PostView.objects.filter(post_id__in=post_ids).values_list('post_id', flat=True))
+        if missing:
+            # Posts deleted since the increment was buffered are skipped
+            live = Post.objects.filter(pk__in=missing).values_list('pk', flat=True)
+            PostView.objects.bulk_create(PostView(post_id=post_id) for post_id in live)
+
+        update = {}
+        if views:
+            update['view_count'] = F('view_count') + _delta_case('post_id', views)
+        if likes:
+            update['like_count'] = F('like_count') + _delta_case('post_id', likes)
+        PostView.objects.filter(post_id__in=post_ids).update(**update)
+
+
+post_counters = PostCounterBuffer()
+atexit.register(post_counters.flush_at_exit)
@@ -0,0 +1,172 @@
+"""Upload-time image sanitizing and background variant generation.
+
+Uploads are re-encoded before the request finishes, every frame of animated
+ones: EXIF is dropped (after applying its orientation), oversized images
+are scaled down and files over the byte, frame or pixel caps are rejected. Thumbnails in WebP/AVIF are then generated by a
+worker pool once the upload has been committed, and their storage names are
+recorded on the row next to the name of the image they were made from.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps, ImageSequence, UnidentifiedImageError
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'MAX_UPLOAD_BYTES': 10 * 1024 * 1024,
+    'MAX_DIMENSION': 2560,  # longest side of the stored original
+    'MAX_FRAMES': 100,  # of animated uploads, each decoded in memory
+    'SIZES': {'thumb': 320, 'medium': 960},  # bounding box of each variant
+    'FORMATS': ['webp', 'avif'],
+    'QUALITY': 80,
+    'WORKERS': 2,  # 0 generates variants inline, e.g. in tests
+}
+
+# Pillow releases the GIL while resizing and encoding, so threads are enough
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def image_settings():
+    return {**DEFAULTS, **getattr(settings, 'IMAGE_VARIANTS', {})}
+
+
+def sanitize_image(upload):
+    """Validate and re-encode an uploaded image without its metadata."""
+    config = image_settings()
+    if upload.size > config['MAX_UPLOAD_BYTES']:
+        raise serializers.ValidationError(
+            f"Image is larger than {config['MAX_UPLOAD_BYTES'] // (1024 * 1024)} MB."
+        )
+
+    upload.seek(0)
+    try:
+        with Image.open(upload) as original:
+            if getattr(original, 'n_frames', 1) > config['MAX_FRAMES']:
+                raise serializers.ValidationError(f"Image has more than {config['MAX_FRAMES']} frames.")
+            fmt = original.format
+            icc_profile = original.info.get('icc_profile')
+            frames, durations = [], []
+            for frame in ImageSequence.Iterator(original):
+                durations.append(frame.info.get('duration', 0))
+                image = ImageOps.exif_transpose(frame)
+                image.thumbnail((config['MAX_DIMENSION'], config['MAX_DIMENSION']))
+                if fmt == 'JPEG' and image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                frames.append(image)
+
+            options = {'quality': config['QUALITY'], 'icc_profile': icc_profile, 'exif': b''}
+            if len(frames) > 1:
+                options.update(
+                    save_all=True, append_images=frames[1:], duration=durations, loop=original.info.get('loop', 0),
+                )
+            output = BytesIO()
+            frames[0].save(output, format=fmt, **options)
+    except Image.DecompressionBombError:
+        raise serializers.ValidationError('Image has too many pixels.')
+    except (UnidentifiedImageError, OSError):
+        # Truncated or corrupt data that only fails once decoded
+        raise serializers.ValidationError('Image is corrupt or not a supported format.')
+    return ContentFile(output.getvalue(), name=upload.name)
+
+
+def variant_name(source, size, fmt):
+    path = PurePosixPath(source)
+    return str(path.parent / 'variants' / f'{path.stem}-{size}.{fmt}')
+
+
+def generate_variants(source):
+    """Write every size/format variant of ``source`` to storage.
+
+    Storages never overwrite a name, so variants that already exist (e.g.
+    of the shared default avatar) are up to date and are kept.
+    """
+    config = image_settings()
+    variants = {
+        size: {fmt: variant_name(source, size, fmt) for fmt in config['FORMATS']}
+        for size in config['SIZES']
+    }
+    missing = {
+        (size, fmt) for size, formats in variants.items()
+        for fmt, name in formats.items() if not default_storage.exists(name)
+    }
+    if missing:
+        with default_storage.open(source) as stored, Image.open(stored) as original:
+            original.load()
+            if original.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                original = original.convert('RGBA')
+            for size, box in config['SIZES'].items():
+                image = original.copy()
+                image.thumbnail((box, box))
+                for fmt in config['FORMATS']:
+                    if (size, fmt) in missing:
+                        output = BytesIO()
+                        image.save(output, format=fmt.upper(), quality=config['QUALITY'])
+                        name = variants[size][fmt]
+                        variants[size][fmt] = default_storage.save(name, ContentFile(output.getvalue()))
+    return {'source': source, 'variants': variants}
+
+
+def process_variants(model, pk, field, variants_field, on_done=None):
+    source = model.objects.filter(pk=pk).values_list(field, flat=True).first()
+    if not source or not default_storage.exists(source):
+        return
+    try:
+        result = generate_variants(source)
+    except Exception:
+        logger.exception('Generating variants of %s failed', source)
+        return
+    # Only if the image wasn't replaced in the meantime
+    updated = model.objects.filter(pk=pk, **{field: source}).update(**{variants_field: result})
+    if updated and on_done is not None:
+        on_done()
+
+
+def needs_variants(image, variants):
+    return bool(image) and (variants or {}).get('source') != image.name
+
+
+def schedule_variants(model, pk, field, variants_field, on_done=None):
+    """Generate the variants after the current transaction commits."""
+    transaction.on_commit(lambda: _submit(process_variants, model, pk, field, variants_field, on_done))
+
+
+def _submit(job, *args):
+    global _executor
+    workers = image_settings()['WORKERS']
+    if not workers:
+        return job(*args)
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(workers, thread_name_prefix='image-variants')
+    _executor.submit(_run_in_worker, job, *args)
+
+
+def _run_in_worker(job, *args):
+    close_old_connections()
+    try:
+        job(*args)
+    finally:
+        close_old_connections()
+
+
+def variant_urls(variants, image, request=None):
+    """``{size: {format: url}}`` for the variants of the current ``image``."""
+    if not image or (variants or {}).get('source') != image.name:
+        return None
+    urls = {}
+    for size, formats in variants['variants'].items():
+        urls[size] = {}
+        for fmt, name in formats.items():
+            url = default_storage.url(name)
+            urls[size][fmt] = request.build_absolute_uri(url) if request is not None else url
+    return urls
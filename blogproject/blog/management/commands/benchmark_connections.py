@@ -0,0 +1,74 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+
+from blog.benchmarking import format_summary, summarize, wsgi_request
+from blogproject.database import CONNECTION_MODES, connection_settings
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare request latency of the cheap tag list under each DB_CONNECTION_MODE "
+        "(new connection per request, persistent connections, psycopg 3 pool) against the "
+        "configured database. SQLite works as a stand-in for none/persistent."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help='Requests per mode.')
+        parser.add_argument('--threads', type=int, default=8, help='WSGI worker threads.')
+        parser.add_argument('--modes', nargs='+', choices=CONNECTION_MODES, default=list(CONNECTION_MODES))
+        parser.add_argument('--path', default='/api/tags/')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.stderr.write('An in-memory SQLite database can not be reconnected to.')
+            return
+
+        opened = []
+        connection_created.connect(lambda **kwargs: opened.append(1), weak=False, dispatch_uid='benchmark')
+        original = dict(connection.settings_dict)
+        application = get_wsgi_application()
+        try:
+            # Responses must come from the database every time
+            with override_settings(ALLOWED_HOSTS=['*'], RESPONSE_CACHE={'ENABLED': False}):
+                for mode in options['modes']:
+                    if not self.configure(mode, original):
+                        continue
+                    wsgi_request(application, options['path'])  # warm up
+                    opened.clear()
+
+                    started = time.perf_counter()
+                    with ThreadPoolExecutor(options['threads']) as pool:
+                        results = list(pool.map(
+                            partial(wsgi_request, application), [options['path']] * options['requests']
+                        ))
+                    summary = summarize(time.perf_counter() - started, results)
+                    self.stdout.write(f'{format_summary(mode, summary)}, {len(opened)} connections opened')
+        finally:
+            connection_created.disconnect(dispatch_uid='benchmark')
+            self.configure('none', original)
+            connection.settings_dict.update(original)
+
+    def configure(self, mode, original):
+        try:
+            config = connection_settings(mode)
+        except ImproperlyConfigured as exc:
+            self.stderr.write(f'{mode}: skipped, {exc}')
+            return False
+        if mode == 'pool' and connection.vendor != 'postgresql':
+            self.stderr.write('pool: skipped, pooling is only available on PostgreSQL')
+            return False
+
+        connections.close_all()
+        if hasattr(connection, 'close_pool'):
+            connection.close_pool()
+        connection.settings_dict.update(config)
+        connection.settings_dict['OPTIONS'] = {**original.get('OPTIONS', {}), **config.get('OPTIONS', {})}
+        return True
@@ -0,0 +1,110 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Value
+from django.db.models.functions import Lower
+
+from blog.models import Category, Comment, Post, PostCategory, User
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a large throwaway dataset and report query plans and latency of the hot "
+        "post/comment/category queries with and without the access-path indexes. "
+        "Everything runs in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=20000)
+        parser.add_argument('--comments-per-post', type=int, default=5)
+        parser.add_argument('--categories', type=int, default=200)
+        parser.add_argument('--repeat', type=int, default=50, help='Runs per query.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.seed(options)
+            self.analyze()
+            after = self.measure(options['repeat'])
+
+            # Plain DROP INDEX: SQLite's schema editor refuses to run inside a transaction
+            with connection.cursor() as cursor:
+                for model in (Post, Comment, Category):
+                    for index in model._meta.indexes:
+                        cursor.execute(f'DROP INDEX IF EXISTS {connection.ops.quote_name(index.name)}')
+            self.analyze()
+            before = self.measure(options['repeat'])
+
+            for name in after:
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                for label, (timings, plan) in (('without indexes', before[name]), ('with indexes', after[name])):
+                    self.stdout.write(
+                        f'  {label}: median {statistics.median(timings):.3f} ms, max {max(timings):.3f} ms'
+                    )
+                    self.stdout.write('    ' + plan.replace('\n', '\n    '))
+
+            transaction.set_rollback(True)
+
+    def seed(self, options):
+        self.stdout.write('Seeding...')
+        user = User.objects.create_user(email='bench@example.com', user_name='bench-indexes', password='bench-pass')
+        categories = Category.objects.bulk_create(
+            Category(name=f'Category {i}') for i in range(options['categories'])
+        )
+
+        posts = Post.objects.bulk_create(
+            (
+                Post(
+                    user=user, title=f'Post {i}', slug=f'bench-index-post-{i}', body='body',
+                    status=random.choice(Post.Status.values),
+                )
+                for i in range(options['posts'])
+            ),
+            batch_size=2000,
+        )
+        PostCategory.objects.bulk_create(
+            (PostCategory(post=post, category=random.choice(categories)) for post in posts), batch_size=2000
+        )
+        Comment.objects.bulk_create(
+            (
+                Comment(
+                    post=post, user=user, comment_body='comment',
+                    status=random.choice(Comment.Status.values),
+                )
+                for post in posts for _ in range(options['comments_per_post'])
+            ),
+            batch_size=2000,
+        )
+        self.post_ids = [post.pk for post in posts]
+        self.category_names = [category.name.upper() for category in categories]
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def queries(self):
+        yield 'published posts, newest first', lambda: (
+            Post.objects.filter(status=Post.Status.PUBLISHED).order_by('-created_at', '-id')[:6]
+        )
+        yield 'approved comments of a post', lambda: (
+            Comment.objects.filter(post_id=random.choice(self.post_ids), status=Comment.Status.APPROVED)
+            .order_by('created_at', 'id')
+        )
+        yield 'category by name, case-insensitive', lambda: (
+            Category.objects.alias(name_lower=Lower('name'))
+            .filter(name_lower=Lower(Value(random.choice(self.category_names))))
+        )
+
+    def measure(self, repeat):
+        results = {}
+        for name, build in self.queries():
+            timings = []
+            for _ in range(repeat):
+                queryset = build()
+                started = time.perf_counter()
+                list(queryset)
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = (timings, build().explain())
+        return results
@@ -0,0 +1,70 @@
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+
+from blog.benchmarking import format_summary, summarize, wsgi_request
+from blog.metrics import MetricsMiddleware, metrics_registry
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure what MetricsMiddleware adds to a request: the recording alone, timed around a "
+        "no-op response, and whole requests to a cheap endpoint through the WSGI application with "
+        "metrics off, on, and on with a shared multi-process directory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=100000, help='Recordings timed.')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per configuration.')
+        parser.add_argument('--path', default='/api/tags/')
+
+    def handle(self, *args, **options):
+        self.measure_recording(options['iterations'])
+        with tempfile.TemporaryDirectory() as directory:
+            configurations = {
+                'off': {'ENABLED': False},
+                'on': {'ENABLED': True},
+                'multiprocess': {'ENABLED': True, 'DIRECTORY': directory},
+            }
+            # Responses must come from the database every time
+            with override_settings(ALLOWED_HOSTS=['*'], RESPONSE_CACHE={'ENABLED': False}):
+                application = get_wsgi_application()
+                summaries = {}
+                for label, config in configurations.items():
+                    with override_settings(METRICS=config):
+                        for _ in range(50):
+                            wsgi_request(application, options['path'])  # warm up
+                        started = time.perf_counter()
+                        results = [wsgi_request(application, options['path']) for _ in range(options['requests'])]
+                        summaries[label] = summarize(time.perf_counter() - started, results)
+                    self.stdout.write(format_summary(label, summaries[label]))
+
+        for label in ('on', 'multiprocess'):
+            overhead = (summaries[label]['mean_ms'] - summaries['off']['mean_ms']) * 1000
+            self.stdout.write(f'{label:>12}: {overhead:+.1f} µs per request against off')
+        metrics_registry.reset()
+
+    def measure_recording(self, iterations):
+        request = RequestFactory().get('/api/tags/')
+        request.resolver_match = None
+        response = HttpResponse()
+        middleware = MetricsMiddleware(lambda request: response)
+
+        with override_settings(METRICS={'ENABLED': False}):
+            baseline = self.time_calls(middleware, request, iterations)
+        with override_settings(METRICS={'ENABLED': True}):
+            recorded = self.time_calls(middleware, request, iterations)
+        self.stdout.write(
+            f'   recording: {(recorded - baseline) / iterations * 1e6:.2f} µs per request '
+            f'({iterations} requests, middleware around a no-op view)'
+        )
+
+    def time_calls(self, middleware, request, iterations):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            middleware(request)
+        return time.perf_counter() - started
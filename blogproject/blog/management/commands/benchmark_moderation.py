@@ -0,0 +1,68 @@
+import random
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from blog.benchmarking import QueryCounter
+from blog.models import Comment, Post, User
+from blog.moderation import DEFAULTS, moderate, moderation_settings
+from blog.seeding import sentence
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure moderation worker throughput: classify a backlog of pending comments in batches "
+        "of each given size and report comments per second and queries per comment. Runs "
+        "against seeded data (seed_blog) and rolls everything back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--comments', type=int, default=2000)
+        parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 10, 100, 500])
+        parser.add_argument('--spam-share', type=float, default=0.2)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        user_ids = list(User.objects.values_list('pk', flat=True)[:200])
+        post_ids = list(Post.objects.values_list('pk', flat=True)[:1000])
+        if not (user_ids and post_ids):
+            raise CommandError('There is no seeded data, run seed_blog first.')
+
+        rng = random.Random(options['seed'])
+        keywords = DEFAULTS['KEYWORDS']
+        bodies = [
+            f'{sentence(rng)} {rng.choice(keywords)} {rng.choice(keywords)} '
+            + ' '.join(f'https://example.com/offer/{i}' for i in range(3))
+            if rng.random() < options['spam_share'] else sentence(rng)
+            for _ in range(options['comments'])
+        ]
+        authors = [rng.choice(user_ids) for _ in bodies]
+        posts = [rng.choice(post_ids) for _ in bodies]
+
+        with transaction.atomic():
+            for batch_size in options['batch_sizes']:
+                comments = Comment.objects.bulk_create(
+                    Comment(post_id=post_id, user_id=user_id, comment_body=body, status=Comment.Status.PENDING)
+                    for body, user_id, post_id in zip(bodies, authors, posts)
+                )
+                pks = [comment.pk for comment in comments]
+                # Cold user histories for every run
+                config = {**moderation_settings(), 'KEY_PREFIX': f'moderation-benchmark-{uuid.uuid4().hex}'}
+
+                counter, totals = QueryCounter(), {}
+                started = time.perf_counter()
+                with connection.execute_wrapper(counter):
+                    for start in range(0, len(pks), batch_size):
+                        for status, count in moderate(pks[start:start + batch_size], config).items():
+                            totals[status] = totals.get(status, 0) + count
+                elapsed = time.perf_counter() - started
+
+                self.stdout.write(
+                    f'batch {batch_size:>4}: {len(pks) / elapsed:8.0f} comments/s, '
+                    f'{counter.count / len(pks):.2f} queries per comment, '
+                    f'{totals.get(Comment.Status.APPROVED, 0)} approved, {totals.get(Comment.Status.SPAM, 0)} spam'
+                )
+                Comment.objects.filter(pk__in=pks).delete()
+            transaction.set_rollback(True)
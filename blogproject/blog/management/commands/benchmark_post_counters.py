@@ -0,0 +1,56 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from blog.counters import counter_settings, post_counters
+from blog.models import Post, User
+
+
+class Command(BaseCommand):
+    help = "Compare post retrieve latency with write-behind view counting on and off."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+
+    def handle(self, *args, **options):
+        # Fixture rows and flushed counters are rolled back at the end
+        with transaction.atomic():
+            user = User.objects.create_user(
+                email='bench@example.com', user_name='bench-counters', password='bench-pass'
+            )
+            post = Post.objects.create(user=user, title='Counter benchmark', body='# Heading\n\n' + 'text ' * 2000)
+            url = f'/api/posts/{post.pk}/'
+
+            for enabled in (False, True):
+                config = {**counter_settings(), 'ENABLED': enabled, 'FLUSH_INTERVAL': None}
+                # Cached responses would skip retrieve, and with it the counting
+                with override_settings(POST_COUNTERS=config, RESPONSE_CACHE={'ENABLED': False}, ALLOWED_HOSTS=['*']):
+                    timings = self.run_requests(url, options['requests'])
+                    started = time.perf_counter()
+                    post_counters.flush()
+                    flush_ms = (time.perf_counter() - started) * 1000
+                self.report('counting on ' if enabled else 'counting off', timings, flush_ms)
+
+            transaction.set_rollback(True)
+
+    def run_requests(self, url, count):
+        client = APIClient()
+        client.get(url)  # warm up
+        timings = []
+        for _ in range(count):
+            started = time.perf_counter()
+            client.get(url)
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    def report(self, label, timings, flush_ms):
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        self.stdout.write(
+            f'{label}: mean {statistics.mean(timings):.3f} ms, p50 {statistics.median(timings):.3f} ms, '
+            f'p95 {p95:.3f} ms, flush {flush_ms:.3f} ms'
+        )
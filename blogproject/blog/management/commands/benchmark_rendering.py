@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.test import APIRequestFactory
+
+from blog.middleware import available_encodings, compress, compression_settings
+from blog.models import Post
+from blog.renderers import ORJSONRenderer, orjson
+from blog.serializers import PostSerializer
+
+RENDERERS = {'json': JSONRenderer, 'orjson': ORJSONRenderer}
+
+
+class Command(BaseCommand):
+    help = (
+        "Serialize a page of posts (the detail representation, bodies included) with PostSerializer, "
+        "then render it with each JSON renderer and compress it with each encoding. Reports ops/sec "
+        "and the bytes that would go on the wire."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=api_settings.PAGE_SIZE, help='Posts on the page.')
+        parser.add_argument('--seconds', type=float, default=1.0, help='Time spent on each configuration.')
+
+    def handle(self, *args, **options):
+        request = Request(APIRequestFactory().get('/api/posts/', {'include': 'body_html'}))
+        posts = list(Post.objects.for_serialization(body_html=True).order_by('-created_at')[:options['posts']])
+        if not posts:
+            raise CommandError('There are no posts to serialize, import some first.')
+        if orjson is None:
+            self.stderr.write('orjson is not installed, the orjson renderer falls back to json.')
+
+        def serialize():
+            return PostSerializer(posts, many=True, context={'request': request}).data
+
+        # Image URLs are built from the request's host
+        with override_settings(ALLOWED_HOSTS=['*']):
+            data = serialize()
+            self.report('serialize', *self.measure(serialize, options['seconds']), None)
+
+        config = compression_settings()
+        for name, renderer_class in RENDERERS.items():
+            renderer = renderer_class()
+            for encoding in ['identity', *available_encodings(config)]:
+                def render():
+                    return compress(renderer.render(data), encoding, config)
+                self.report(f'{name}+{encoding}', *self.measure(render, options['seconds']), len(render()))
+
+    def measure(self, call, seconds):
+        runs = 0
+        started = time.perf_counter()
+        deadline = started + seconds
+        while time.perf_counter() < deadline:
+            call()
+            runs += 1
+        return runs, time.perf_counter() - started
+
+    def report(self, label, runs, elapsed, size):
+        line = f'{label:>16}: {runs / elapsed:10.1f} ops/s, {elapsed / runs * 1000:.3f} ms/op'
+        if size is not None:
+            line += f', {size} bytes'
+        self.stdout.write(line)
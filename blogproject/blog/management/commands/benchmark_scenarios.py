@@ -0,0 +1,192 @@
+import json
+import random
+import secrets
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import request_finished, request_started
+from django.core.wsgi import get_wsgi_application
+from django.db import close_old_connections, connection, transaction
+from django.test import override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+
+from blog.benchmarking import (
+    QueryCounter, compare_summaries, environment, format_summary, summarize, write_results, wsgi_request,
+)
+from blog.models import Category, Comment, Post, Tag, User
+from blog.seeding import SEED_PASSWORD, SEED_USER_PREFIX, markdown_body, tag_names, words
+from blog.serializers import MyTokenObtainPairSerializer
+
+SCENARIOS = (
+    'post-list', 'post-detail', 'comment-thread', 'by-tag', 'by-category', 'register', 'login', 'post-create',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Run scenario benchmarks (post list, detail, comment thread, by tag/category, register, "
+        "login, post create) through the WSGI application against data from seed_blog. Reports "
+        "latency percentiles, throughput and queries per request, and writes them as JSON so runs "
+        "can be compared. Writes are rolled back at the end unless --keep-writes is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per scenario.')
+        parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per scenario.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--cache', action='store_true', help='Leave the response cache on.')
+        parser.add_argument('--keep-writes', action='store_true', help='Commit what the write scenarios create.')
+        parser.add_argument(
+            '--output', type=Path,
+            help='Result file, defaults to benchmark_results/<timestamp>.json in the project directory.',
+        )
+        parser.add_argument('--compare', type=Path, help='An earlier result file to print the changes against.')
+
+    def handle(self, *args, **options):
+        self.load_fixtures()
+        overrides = {
+            'ALLOWED_HOSTS': ['*'],
+            # Background threads use their own connections, which can't see (or wait on) the run's transaction
+            'POST_COUNTERS': {'FLUSH_INTERVAL': None},
+            'IMAGE_VARIANTS': {'WORKERS': 0},
+            # The scenarios measure the endpoints, not the limits in front of them
+            'RATE_LIMITS': {'ENABLED': False},
+        }
+        if not options['cache']:
+            overrides['RESPONSE_CACHE'] = {'ENABLED': False}
+
+        application = get_wsgi_application()
+        # Requests share this thread's connection and transaction, like the test client's do
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            with override_settings(**overrides), transaction.atomic():
+                summaries = {}
+                for scenario in options['scenarios']:
+                    summaries[scenario] = self.run(application, scenario, options)
+                    self.stdout.write(self.format(scenario, summaries[scenario]))
+                if not options['keep_writes']:
+                    transaction.set_rollback(True)
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+
+        results = {
+            'environment': environment(),
+            'data': self.data,
+            'options': {key: options[key] for key in ('requests', 'warmup', 'seed', 'cache')},
+            'scenarios': summaries,
+        }
+        output = Path(options['output'] or Path(settings.BASE_DIR) / 'benchmark_results' / (
+            results['environment']['timestamp'].replace(':', '') + '.json'
+        ))
+        write_results(output, results)
+        self.stderr.write(f'Results written to {output}')
+        if options['compare']:
+            self.compare(json.loads(Path(options['compare']).read_text()), results)
+
+    def load_fixtures(self):
+        published = Post.objects.filter(status=Post.Status.PUBLISHED)
+        self.post_ids = list(published.values_list('pk', flat=True))
+        self.commented_ids = list(published.filter(comments_count__gt=0).values_list('pk', flat=True))
+        self.tag_slugs = list(Tag.objects.filter(post_tags__isnull=False).distinct().values_list('slug', flat=True))
+        self.category_names = list(
+            Category.objects.filter(post_categories__isnull=False).distinct().values_list('name', flat=True)
+        )
+        self.user_names = list(
+            User.objects.filter(user_name__startswith=SEED_USER_PREFIX).values_list('user_name', flat=True)
+        )
+        if not (self.post_ids and self.commented_ids and self.user_names):
+            raise CommandError('There is no seeded data, run seed_blog first.')
+
+        author = User.objects.get(user_name=self.user_names[0])
+        self.access_token = str(MyTokenObtainPairSerializer.get_token(author).access_token)
+        self.pages = max(1, len(self.post_ids) // settings.REST_FRAMEWORK['PAGE_SIZE'])
+        self.data = {
+            'users': User.objects.count(),
+            'posts': Post.objects.count(),
+            'comments': Comment.objects.count(),
+            'tags': Tag.objects.count(),
+            'categories': Category.objects.count(),
+        }
+
+    def run(self, application, scenario, options):
+        # The same request sequence for every run with the same seed and data
+        rng = random.Random(f"{options['seed']}:{scenario}")
+        build = getattr(self, 'scenario_' + scenario.replace('-', '_'))
+        for _ in range(options['warmup']):
+            wsgi_request(application, *build(rng))
+
+        results, queries = [], []
+        started = time.perf_counter()
+        for _ in range(options['requests']):
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                results.append(wsgi_request(application, *build(rng)))
+            queries.append(counter.count)
+        summary = summarize(time.perf_counter() - started, results)
+        summary['queries_mean'] = sum(queries) / len(queries)
+        summary['queries_max'] = max(queries)
+        return summary
+
+    def format(self, scenario, summary):
+        return f"{format_summary(scenario, summary)}, {summary['queries_mean']:.1f} queries"
+
+    def compare(self, previous, current):
+        before = previous['environment']
+        self.stdout.write(f"Changes since {before['timestamp']} ({before['revision'] or 'unknown revision'}):")
+        for scenario, summary in current['scenarios'].items():
+            if scenario in previous['scenarios']:
+                self.stdout.write(compare_summaries(previous['scenarios'][scenario], summary, scenario))
+
+    def json_request(self, path, payload):
+        return path, 'POST', json.dumps(payload).encode(), {'CONTENT_TYPE': 'application/json'}
+
+    def form_request(self, path, payload, token):
+        # PostViewSet only parses forms, for image uploads
+        return path, 'POST', encode_multipart(BOUNDARY, payload), {
+            'CONTENT_TYPE': MULTIPART_CONTENT, 'HTTP_AUTHORIZATION': f'Bearer {token}',
+        }
+
+    def scenario_post_list(self, rng):
+        return (f'/api/posts/?page={rng.randint(1, min(self.pages, 20))}',)
+
+    def scenario_post_detail(self, rng):
+        return (f'/api/posts/{rng.choice(self.post_ids)}/',)
+
+    def scenario_comment_thread(self, rng):
+        return (f'/api/posts/{rng.choice(self.commented_ids)}/comments/',)
+
+    def scenario_by_tag(self, rng):
+        if not self.tag_slugs:
+            raise CommandError('No post has a tag, seed with --tags.')
+        return (f'/api/posts/by-slug/?tag={rng.choice(self.tag_slugs)}',)
+
+    def scenario_by_category(self, rng):
+        if not self.category_names:
+            raise CommandError('No post has a category, seed with --categories.')
+        return (f'/api/posts/by-category/?category={rng.choice(self.category_names)}',)
+
+    def scenario_register(self, rng):
+        user_name = f'bench-{secrets.token_hex(8)}'
+        return self.json_request('/api/register/', {
+            'user_name': user_name,
+            'email': f'{user_name}@example.com',
+            'password': SEED_PASSWORD,
+            'password2': SEED_PASSWORD,
+        })
+
+    def scenario_login(self, rng):
+        return self.json_request('/api/login/', {'user_name': rng.choice(self.user_names), 'password': SEED_PASSWORD})
+
+    def scenario_post_create(self, rng):
+        return self.form_request('/api/posts/', {
+            'title': words(rng, 3, 8).capitalize(),
+            'body': markdown_body(rng, 4),
+            'status': Post.Status.PUBLISHED,
+            'tag_names': rng.sample(tag_names(20), 2),
+            'category_names_input': rng.sample(self.category_names, 1) if self.category_names else [],
+        }, self.access_token)
@@ -0,0 +1,73 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+
+from blog.models import Comment, Post, PostCategory, PostTag
+from blog.transfer import FORMATS, RecordWriter, detect_format, open_stream
+
+
+class Command(BaseCommand):
+    help = "Stream posts with their tags, categories and comments to JSON Lines or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Output file, '-' for stdout.")
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension, else jsonl.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Posts fetched per query.')
+
+    def handle(self, *args, **options):
+        fmt = detect_format(options['path'], options['format'])
+        # iterator() with prefetching keeps only one batch in memory
+        posts = (
+            Post.objects.select_related('user')
+            .defer('body_html', 'toc')
+            .prefetch_related(
+                Prefetch('post_tags', queryset=PostTag.objects.select_related('tag')),
+                Prefetch('post_categories', queryset=PostCategory.objects.select_related('category')),
+                Prefetch('comments', queryset=Comment.objects.select_related('user').order_by('pk')),
+            )
+            .order_by('pk')
+            .iterator(chunk_size=options['batch_size'])
+        )
+
+        started = time.perf_counter()
+        count = 0
+        with open_stream(options['path'], 'w') as stream:
+            writer = RecordWriter(stream, fmt)
+            for post in posts:
+                writer.write(self.to_record(post))
+                count += 1
+                if count % options['batch_size'] == 0:
+                    self.report(count, started)
+
+        self.report(count, started, done=True)
+
+    def to_record(self, post):
+        return {
+            'title': post.title,
+            'slug': post.slug,
+            'body': post.body,
+            'status': post.status,
+            'author': post.user.user_name,
+            'created_at': post.created_at.isoformat(),
+            'tags': [post_tag.tag.name for post_tag in post.post_tags.all()],
+            'categories': [post_category.category.name for post_category in post.post_categories.all()],
+            'comments': [
+                {
+                    'id': comment.pk,
+                    'parent_id': comment.parent_comment_id,
+                    'author': comment.user.user_name,
+                    'body': comment.comment_body,
+                    'status': comment.status,
+                    'created_at': comment.created_at.isoformat(),
+                }
+                for comment in post.comments.all()
+            ],
+        }
+
+    def report(self, count, started, done=False):
+        elapsed = time.perf_counter() - started
+        rate = count / elapsed if elapsed else 0
+        message = f'{"Exported" if done else "..."} {count} posts in {elapsed:.1f}s ({rate:.0f} posts/s)'
+        # Progress goes to stderr so '-' can stream records to stdout
+        self.stderr.write(self.style.SUCCESS(message) if done else message)
@@ -0,0 +1,180 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from blog.cache import bump_version
+from blog.models import Comment, Post, PostCategory, PostTag, User, body_digest
+from blog.serializers import resolve_categories, resolve_tags
+from blog.transfer import FORMATS, detect_format, open_stream, read_records
+from blog.utility import allocate_unique_slugs
+from blogproject.utils import render_markdown_with_toc, summarize_html
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream posts with their tags, categories and comments from JSON Lines or CSV "
+        "(the export_posts format) into the database in bulk."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, '-' for stdin.")
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension, else jsonl.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Posts inserted per transaction.')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Processes rendering markdown; 0 renders in this process.',
+        )
+        parser.add_argument('--default-author', help='user_name used when a record author does not exist.')
+
+    def handle(self, *args, **options):
+        self.default_author = None
+        if options['default_author']:
+            self.default_author = User.objects.filter(user_name=options['default_author']).first()
+            if self.default_author is None:
+                raise CommandError(f"User {options['default_author']!r} does not exist.")
+
+        fmt = detect_format(options['path'], options['format'])
+        workers = options['workers']
+        pool = (
+            ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+            if workers > 1 else nullcontext()
+        )
+
+        with open_stream(options['path'], 'r') as stream, pool:
+            chunksize = max(1, options['batch_size'] // (workers * 4)) if workers > 1 else 1
+            render = partial(pool.map, chunksize=chunksize) if workers > 1 else map
+            self.import_records(read_records(stream, fmt), options['batch_size'], render)
+
+        # bulk_create sends no signals
+        bump_version('posts', 'tags')
+
+    def import_records(self, records, batch_size, render):
+        started = time.perf_counter()
+        count = 0
+        while batch := list(islice(records, batch_size)):
+            self.import_batch(batch, render)
+            count += len(batch)
+            self.report(count, started)
+        self.report(count, started, done=True)
+
+    def import_batch(self, records, render):
+        # Markdown rendering is the expensive part and runs in the worker pool
+        rendered = list(render(render_markdown_with_toc, [record['body'] for record in records]))
+        users = self.resolve_authors(records)
+
+        with transaction.atomic():
+            slugs = allocate_unique_slugs(Post, [record.get('slug') or record['title'] for record in records])
+            posts = []
+            for record, slug, (body_html, toc) in zip(records, slugs, rendered):
+                comments = record.get('comments') or []
+                excerpt, reading_time = summarize_html(body_html)
+                posts.append(Post(
+                    user=users[record.get('author')],
+                    title=record['title'],
+                    slug=slug,
+                    body=record['body'],
+                    body_html=body_html,
+                    toc=toc,
+                    excerpt=excerpt,
+                    reading_time=reading_time,
+                    body_hash=body_digest(record['body']),
+                    status=record.get('status') or Post.Status.DRAFT,
+                    comments_count=sum(
+                        1 for comment in comments
+                        if (comment.get('status') or Comment.Status.APPROVED) == Comment.Status.APPROVED
+                    ),
+                ))
+            Post.objects.bulk_create(posts)
+            self.restore_created_at(Post, posts, records)
+            Post.objects.filter(pk__in=[post.pk for post in posts]).update_search_vectors()
+
+            self.attach_tags_and_categories(posts, records)
+            self.create_comments(posts, records, users)
+
+    def resolve_authors(self, records):
+        names = {record.get('author') for record in records}
+        names.update(comment.get('author') for record in records for comment in record.get('comments') or [])
+        users = {user.user_name: user for user in User.objects.filter(user_name__in=names - {None})}
+
+        for name in names - users.keys():
+            if self.default_author is None:
+                raise CommandError(f'Author {name!r} does not exist, pass --default-author.')
+            users[name] = self.default_author
+        return users
+
+    def restore_created_at(self, model, objects, records):
+        # bulk_create always stamps auto_now_add fields with the current time
+        dated = []
+        for obj, record in zip(objects, records):
+            if record.get('created_at'):
+                obj.created_at = parse_datetime(record['created_at'])
+                dated.append(obj)
+        model.objects.bulk_update(dated, ['created_at'])
+
+    def attach_tags_and_categories(self, posts, records):
+        tags = resolve_tags(list({name: None for record in records for name in record.get('tags') or []}))
+        categories = resolve_categories(
+            list({name: None for record in records for name in record.get('categories') or []})
+        )
+        PostTag.objects.bulk_create(
+            [
+                PostTag(post=post, tag=tags[name])
+                for post, record in zip(posts, records) for name in record.get('tags') or []
+            ],
+            ignore_conflicts=True,
+        )
+        PostCategory.objects.bulk_create(
+            [
+                PostCategory(post=post, category=categories[name])
+                for post, record in zip(posts, records) for name in record.get('categories') or []
+            ],
+            ignore_conflicts=True,
+        )
+
+    def create_comments(self, posts, records, users):
+        # Insert one nesting level at a time so replies can point at saved parents
+        pending = [
+            (post, comment) for post, record in zip(posts, records) for comment in record.get('comments') or []
+        ]
+        known_ids = {(post.pk, comment.get('id')) for post, comment in pending}
+        saved = {}
+        while pending:
+            level, waiting = [], []
+            for post, comment in pending:
+                parent_key = (post.pk, comment.get('parent_id'))
+                if comment.get('parent_id') is None or parent_key not in known_ids:
+                    level.append((post, comment, None))
+                elif parent_key in saved:
+                    level.append((post, comment, saved[parent_key]))
+                else:
+                    waiting.append((post, comment))
+            if not level:
+                raise CommandError('Comment replies form a cycle.')
+
+            objects = Comment.objects.bulk_create([
+                Comment(
+                    post=post,
+                    user=users[comment.get('author')],
+                    parent_comment=parent,
+                    comment_body=comment['body'],
+                    status=comment.get('status') or Comment.Status.APPROVED,
+                )
+                for post, comment, parent in level
+            ])
+            self.restore_created_at(Comment, objects, [comment for _, comment, _ in level])
+            saved.update(((post.pk, comment.get('id')), obj) for (post, comment, _), obj in zip(level, objects))
+            pending = waiting
+
+    def report(self, count, started, done=False):
+        elapsed = time.perf_counter() - started
+        rate = count / elapsed if elapsed else 0
+        message = f'{"Imported" if done else "..."} {count} posts in {elapsed:.1f}s ({rate:.0f} posts/s)'
+        self.stderr.write(self.style.SUCCESS(message) if done else message)
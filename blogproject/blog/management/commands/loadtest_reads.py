@@ -0,0 +1,83 @@
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.test import override_settings
+
+from blog.benchmarking import asgi_request, format_summary, summarize, wsgi_request
+from blog.models import Post
+
+MODES = ('wsgi', 'asgi-sync', 'asgi-async')
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the same read mix (post list, post detail, comment thread, tag list) through the "
+        "WSGI application from a thread pool and through the ASGI application with many concurrent "
+        "requests, against the posts already in the database, and compare throughput and latency. "
+        "Requests are handed to the applications in-process, so no HTTP server is involved."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per mode.')
+        parser.add_argument('--concurrency', type=int, default=200, help='Requests in flight under ASGI.')
+        parser.add_argument('--threads', type=int, default=16, help='WSGI worker threads.')
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+        parser.add_argument('--cache', action='store_true', help='Leave the response cache on.')
+
+    def handle(self, *args, **options):
+        post_ids = list(Post.objects.values_list('pk', flat=True)[:1000])
+        if not post_ids:
+            raise CommandError('There are no posts to read, import some first.')
+        rng = random.Random(0)
+        # One fixed request mix, replayed by every mode
+        requests = [self.pick(rng, post_ids) for _ in range(options['requests'])]
+
+        overrides = {'ALLOWED_HOSTS': ['*']}
+        if not options['cache']:
+            overrides['RESPONSE_CACHE'] = {'ENABLED': False}
+        with override_settings(**overrides):
+            for mode in options['modes']:
+                if mode == 'wsgi':
+                    elapsed, results = self.run_wsgi(requests, options['threads'])
+                else:
+                    paths = [self.async_path(path) if mode == 'asgi-async' else path for path in requests]
+                    elapsed, results = asyncio.run(self.run_asgi(paths, options['concurrency']))
+                self.stdout.write(format_summary(mode, summarize(elapsed, results)))
+
+    def pick(self, rng, post_ids):
+        post_id = rng.choice(post_ids)
+        return rng.choice([
+            '/api/posts/',
+            f'/api/posts/?page={rng.randint(1, 5)}',
+            f'/api/posts/{post_id}/',
+            f'/api/posts/{post_id}/comments/',
+            '/api/tags/',
+        ])
+
+    def async_path(self, path):
+        return path.replace('/api/', '/api/async/', 1)
+
+    def run_wsgi(self, paths, threads):
+        application = get_wsgi_application()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            results = list(pool.map(partial(wsgi_request, application), paths))
+        return time.perf_counter() - started, results
+
+    async def run_asgi(self, paths, concurrency):
+        application = get_asgi_application()
+        slots = asyncio.Semaphore(concurrency)
+
+        async def call(path):
+            async with slots:
+                return await asgi_request(application, path)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(call(path) for path in paths))
+        return time.perf_counter() - started, results
@@ -0,0 +1,35 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from blog.models import Comment
+from blog.moderation import moderate, moderation_settings
+
+
+class Command(BaseCommand):
+    help = (
+        "Classify every PENDING comment, e.g. those still queued in a process that stopped "
+        "or created while moderation workers were down."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Comments classified per batch, MODERATION setting by default.')
+
+    def handle(self, *args, **options):
+        config = moderation_settings()
+        batch_size = options['batch_size'] or config['BATCH_SIZE']
+        totals = Counter()
+        last_pk = 0
+        while True:
+            pks = list(
+                Comment.objects.filter(status=Comment.Status.PENDING, pk__gt=last_pk)
+                .order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            last_pk = pks[-1]
+            totals.update(moderate(pks, config))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Approved {totals[Comment.Status.APPROVED]} comments, marked {totals[Comment.Status.SPAM]} as spam.'
+        ))
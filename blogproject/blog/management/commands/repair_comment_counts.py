@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from blog.cache import bump_version
+from blog.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute Post.comments_count from approved comments and fix drifted rows, e.g. after "
+        "a QuerySet.update() of comment status or post."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Posts checked per UPDATE.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted posts.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        approved = (
+            Comment.objects.filter(post=OuterRef('pk'), status=Comment.Status.APPROVED)
+            .order_by()
+            .values('post')
+            .annotate(count=Count('*'))
+            .values('count')
+        )
+        actual = Coalesce(Subquery(approved), 0)
+
+        checked = repaired = 0
+        last_pk = 0
+        while True:
+            pks = list(
+                Post.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            last_pk = pks[-1]
+            checked += len(pks)
+
+            drifted = Post.objects.filter(pk__in=pks).annotate(actual=actual).exclude(comments_count=F('actual'))
+            if options['dry_run']:
+                repaired += drifted.count()
+                continue
+            with transaction.atomic():
+                repaired += Post.objects.filter(pk__in=drifted.values('pk')).update(comments_count=actual)
+
+        if repaired and not options['dry_run']:
+            bump_version('posts')
+        verb = 'Found' if options['dry_run'] else 'Repaired'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {repaired} drifted of {checked} posts.'))
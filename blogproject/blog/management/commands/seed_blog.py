@@ -0,0 +1,71 @@
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import CommandError
+from django.db import transaction
+
+from blog.cache import bump_version
+from blog.models import User
+from blog.seeding import (
+    SEED_PASSWORD, SEED_USER_PREFIX, category_names, post_records, seed_user_name, tag_names,
+)
+
+from .import_posts import Command as ImportCommand
+
+
+class Command(ImportCommand):
+    help = (
+        "Generate reproducible blog data: users, posts with realistic markdown, nested comments, "
+        "tags and categories, inserted through the import_posts bulk path. Seeded users are named "
+        f"{SEED_USER_PREFIX}N and share the password {SEED_PASSWORD!r}."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--posts', type=int, default=1000)
+        parser.add_argument('--comments', type=int, default=8, help='Average comments per post.')
+        parser.add_argument('--depth', type=int, default=3, help='Deepest reply nesting.')
+        parser.add_argument('--sections', type=int, default=4, help='Average headed sections per post.')
+        parser.add_argument('--tags', type=int, default=40)
+        parser.add_argument('--categories', type=int, default=8)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=500, help='Posts inserted per transaction.')
+        parser.add_argument('--clear', action='store_true', help='Delete previously seeded data first.')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('--users must be at least 1.')
+        if options['clear']:
+            self.clear()
+        elif User.objects.filter(user_name__startswith=SEED_USER_PREFIX).exists():
+            raise CommandError('The database already holds seeded data, pass --clear to replace it.')
+
+        rng = random.Random(options['seed'])
+        authors = self.create_users(options['users'])
+        self.default_author = None
+        records = post_records(
+            rng, options['posts'], authors, tag_names(options['tags']), category_names(options['categories']),
+            comments=options['comments'], sections=options['sections'], max_depth=options['depth'],
+        )
+        self.import_records(records, options['batch_size'], map)
+        bump_version('posts', 'tags')
+
+    def create_users(self, count):
+        # Hashing is deliberately slow, every seeded user gets the same hash
+        password = make_password(SEED_PASSWORD)
+        users = [
+            User(
+                user_name=seed_user_name(index),
+                email=f'{seed_user_name(index)}@example.com',
+                password=password,
+                role=User.Role.AUTHOR,
+            )
+            for index in range(count)
+        ]
+        User.objects.bulk_create(users)
+        return [user.user_name for user in users]
+
+    @transaction.atomic
+    def clear(self):
+        # Posts and comments go with their authors; tags and categories are reused
+        User.objects.filter(user_name__startswith=SEED_USER_PREFIX).delete()
@@ -0,0 +1,430 @@
+"""Prometheus metrics, served in the text exposition format at /metrics.
+
+Request latency and status per route name, ORM queries per request, cache
+hits and misses, issued auth tokens, rate limit rejections and the comment
+moderation queue. Recording is an in-memory update
+under a lock; nothing is formatted or written on the request path.
+
+Each process keeps its own values. With METRICS['DIRECTORY'] set (a
+directory shared by all gunicorn workers of one deployment, emptied when
+it starts), every process also writes its values there from a timer
+thread, FLUSH_INTERVAL seconds after it records something, and when it
+exits, and /metrics adds up the files
+of all processes, whichever worker serves the scrape. A scrape folds the
+files of stopped workers into one file of their totals, so counters never
+go backwards and recycled workers don't pile up files; their gauges are
+dropped, a stopped worker's last queue depth is not waiting anymore.
+Folding takes a file lock and is skipped where fcntl is not available.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DEFAULTS = {
+    'ENABLED': True,
+    'DIRECTORY': '',  # shared between worker processes, empty for a single process
+    'FLUSH_INTERVAL': 5,  # seconds from recording to writing this process's values to DIRECTORY
+    'TOKEN': '',  # bearer token /metrics requires, empty for none
+}
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Successful responses of these routes issued tokens
+TOKEN_ROUTES = {
+    'token_obtain_pair': 'obtain',
+    'custom_token_obtain': 'obtain',
+    'token_refresh': 'refresh',
+    'custom_token_refresh': 'refresh',
+}
+
+# Totals of the stopped processes, matched by the per-process file pattern
+STOPPED_FILE = 'metrics-stopped.json'
+LOCK_FILE = 'metrics.lock'
+
+request_queries = ContextVar('request_queries', default=None)
+
+
+def metrics_settings():
+    return {**DEFAULTS, **getattr(settings, 'METRICS', {})}
+
+
+def escape_label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_labels(names, values, extra=''):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+    # Only values of running processes are added up
+    live_only = False
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        (registry or metrics_registry).register(self)
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def state(self):
+        """JSON-able values, label values joined by NUL."""
+        with self._lock:
+            return {'\0'.join(labels): value for labels, value in self._values.items()}
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    @staticmethod
+    def merge(total, value):
+        return (total or 0) + value
+
+    def lines(self, values):
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}'
+
+
+class Gauge(Counter):
+    """A value that goes up and down, summed over running processes.
+
+    With ``function``, the value is read from it whenever the metrics are
+    collected or flushed instead of being set on every change.
+    """
+    type = 'gauge'
+    live_only = True
+
+    def __init__(self, name, documentation, labelnames=(), function=None, registry=None):
+        self.function = function
+        super().__init__(name, documentation, labelnames, registry)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def state(self):
+        if self.function is not None:
+            self.set(self.function())
+        return super().state()
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, *labels):
+        # Per bucket counts (the last one is +Inf), then the sum
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0]
+            state[index] += 1
+            state[-1] += value
+
+    def state(self):
+        with self._lock:
+            return {'\0'.join(labels): list(value) for labels, value in self._values.items()}
+
+    @staticmethod
+    def merge(total, value):
+        return value if total is None else [a + b for a, b in zip(total, value)]
+
+    def lines(self, values):
+        for labels, state in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), state[:-1]):
+                cumulative += count
+                le = 'le="+Inf"' if bound == '+Inf' else f'le="{format_value(float(bound))}"'
+                yield f'{self.name}_bucket{format_labels(self.labelnames, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(float(state[-1]))}'
+            yield f'{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}'
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # running as another user
+    return True
+
+
+def read_state(path):
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None  # a worker's file being replaced or removed
+
+
+def write_state(path, state):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix('.tmp')
+    temporary.write_text(json.dumps(state))
+    os.replace(temporary, path)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self._lock = threading.Lock()
+        self._timer_lock = threading.Lock()
+        self._timer = None
+        self._token = uuid.uuid4().hex
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def reset(self):
+        """Start empty, e.g. in a freshly forked worker."""
+        for metric in self.metrics:
+            metric.reset()
+        self._token = uuid.uuid4().hex
+        with self._timer_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = None
+
+    def state(self):
+        return {metric.name: metric.state() for metric in self.metrics}
+
+    def file_path(self, directory):
+        return Path(directory) / f'metrics-{os.getpid()}-{self._token}.json'
+
+    def flush(self, directory):
+        write_state(self.file_path(directory), self.state())
+
+    def is_live(self, path):
+        """Whether ``path`` is the file of a running process."""
+        if path == self.file_path(path.parent):
+            return True
+        # Older files of this pid are from before a reset() or a reused pid
+        file_pid = path.name.split('-')[1]
+        return file_pid.isdigit() and int(file_pid) != os.getpid() and process_alive(int(file_pid))
+
+    def add_state(self, total, state, live=True):
+        """Add a ``state()`` to ``total``, gauges only if it's from a running process."""
+        for metric in self.metrics:
+            if metric.live_only and not live:
+                continue
+            values = total.setdefault(metric.name, {})
+            for key, value in state.get(metric.name, {}).items():
+                values[key] = metric.merge(values.get(key), value)
+        return total
+
+    def fold_stopped(self, directory):
+        """Add the files of stopped processes to STOPPED_FILE and remove them."""
+        directory = Path(directory)
+        stopped = [
+            path for path in directory.glob('metrics-*.json')
+            if path.name != STOPPED_FILE and not self.is_live(path)
+        ]
+        if not stopped or fcntl is None:
+            return
+        with open(directory / LOCK_FILE, 'w') as lock:
+            # Held until closed, so no file is added twice
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            total = read_state(directory / STOPPED_FILE) or {}
+            folded = []
+            for path in stopped:
+                state = read_state(path)
+                if state is not None:  # else folded by another process meanwhile
+                    self.add_state(total, state, live=False)
+                    folded.append(path)
+            if folded:
+                write_state(directory / STOPPED_FILE, total)
+                for path in folded:
+                    path.unlink(missing_ok=True)
+
+    def schedule_flush(self, config):
+        """Flush to DIRECTORY in FLUSH_INTERVAL seconds, unless a flush is already due."""
+        if not config['DIRECTORY'] or self._timer is not None:
+            return
+        with self._timer_lock:
+            if self._timer is None:
+                self._timer = threading.Timer(config['FLUSH_INTERVAL'], self._flush_later, (config['DIRECTORY'],))
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_later(self, directory):
+        with self._timer_lock:
+            self._timer = None
+        try:
+            with self._lock:
+                self.flush(directory)
+        except OSError:
+            pass  # written again after the next request
+
+    def collect(self, config=None):
+        """Values of every metric, summed over all processes when sharing a directory."""
+        config = config or metrics_settings()
+        if not config['DIRECTORY']:
+            total = self.state()
+        else:
+            with self._lock:
+                self.flush(config['DIRECTORY'])
+            self.fold_stopped(config['DIRECTORY'])
+            total = {}
+            for path in Path(config['DIRECTORY']).glob('metrics-*.json'):
+                state = read_state(path)
+                if state is not None:
+                    self.add_state(total, state, live=self.is_live(path))
+
+        return {
+            metric: {
+                tuple(key.split('\0')) if metric.labelnames else (): value
+                for key, value in total.get(metric.name, {}).items()
+            }
+            for metric in self.metrics
+        }
+
+    def exposition(self, config=None):
+        lines = []
+        for metric, values in self.collect(config).items():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.lines(values))
+        return '\n'.join(lines) + '\n'
+
+
+metrics_registry = Registry()
+os.register_at_fork(after_in_child=metrics_registry.reset)
+
+
+@atexit.register
+def _flush_at_exit():
+    config = metrics_settings()
+    if config['DIRECTORY']:
+        try:
+            metrics_registry.flush(config['DIRECTORY'])
+        except OSError:
+            pass
+
+
+request_latency = Histogram(
+    'http_request_duration_seconds', 'Time to respond, by route name and method.', ('route', 'method'),
+)
+requests_total = Counter(
+    'http_requests_total', 'Responses by route name, method and status code.', ('route', 'method', 'status'),
+)
+request_queries_histogram = Histogram(
+    'db_queries_per_request', 'ORM queries run while handling a request, by route name.', ('route',),
+    buckets=QUERY_BUCKETS,
+)
+cache_requests = Counter(
+    'cache_requests_total', 'Cache lookups by cache and result (hit or miss).', ('cache', 'result'),
+)
+tokens_issued = Counter('auth_tokens_issued_total', 'JWTs issued, by kind (obtain or refresh).', ('kind',))
+rate_limited = Counter('rate_limited_requests_total', 'Requests rejected by a rate limit budget.', ('budget',))
+# The queue sets its function, see blog/moderation.py
+moderation_queue_depth = Gauge('moderation_queue_depth', 'Comments waiting for a moderation worker.')
+comments_moderated = Counter('comments_moderated_total', 'Comments classified, by resulting status.', ('status',))
+
+
+def count_queries(execute, sql, params, many, context):
+    """Execute wrapper installed on every connection, see blog/signals.py."""
+    counter = request_queries.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def route_name(request):
+    # Route names, not paths, so ids don't multiply the series
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unresolved'
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        config = metrics_settings()
+        if not config['ENABLED']:
+            return self.get_response(request)
+        started, queries = time.perf_counter(), [0]
+        token = request_queries.set(queries)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_queries.reset(token)
+        self.record(request, response, time.perf_counter() - started, queries[0], config)
+        return response
+
+    async def __acall__(self, request):
+        config = metrics_settings()
+        if not config['ENABLED']:
+            return await self.get_response(request)
+        started, queries = time.perf_counter(), [0]
+        token = request_queries.set(queries)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_queries.reset(token)
+        self.record(request, response, time.perf_counter() - started, queries[0], config)
+        return response
+
+    def record(self, request, response, elapsed, queries, config):
+        route = route_name(request)
+        request_latency.observe(elapsed, route, request.method)
+        requests_total.inc(route, request.method, str(response.status_code))
+        request_queries_histogram.observe(queries, route)
+        if response.status_code == 200 and route in TOKEN_ROUTES:
+            tokens_issued.inc(TOKEN_ROUTES[route])
+        metrics_registry.schedule_flush(config)
+
+
+def metrics_view(request):
+    config = metrics_settings()
+    if config['TOKEN'] and not constant_time_compare(
+        request.headers.get('Authorization', ''), f"Bearer {config['TOKEN']}"
+    ):
+        return HttpResponse(status=401)
+    return HttpResponse(metrics_registry.exposition(config), content_type=CONTENT_TYPE)
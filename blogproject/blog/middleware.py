@@ -0,0 +1,99 @@
+"""Response compression negotiated from Accept-Encoding.
+
+Brotli when the client accepts it and the ``brotli`` package is installed,
+gzip otherwise. Small responses go out as they are: below MIN_SIZE the
+compressed body isn't meaningfully smaller and the CPU is wasted. That also
+keeps token responses, which carry secrets, out of reach of BREACH-style
+attacks.
+"""
+import gzip
+import re
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MIN_SIZE': 1024,  # bytes
+    'ENCODINGS': ('br', 'gzip'),  # server preference, for equal client q-values
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,  # 0-11, above ~6 costs more CPU than it saves in transfer
+    # Not HTML: the browsable API's pages embed the CSRF token
+    'CONTENT_TYPES': ('application/json',),
+}
+
+ACCEPT_ENCODING_RE = re.compile(r'^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*$')
+
+
+def compression_settings():
+    return {**DEFAULTS, **getattr(settings, 'RESPONSE_COMPRESSION', {})}
+
+
+def available_encodings(config=None):
+    config = config or compression_settings()
+    return [encoding for encoding in config['ENCODINGS'] if encoding != 'br' or brotli is not None]
+
+
+def negotiate_encoding(accept_encoding, config=None):
+    """The best encoding the client accepts, or None for identity."""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        match = ACCEPT_ENCODING_RE.match(part)
+        if match:
+            try:
+                accepted[match[1].lower()] = float(match[2] or 1)
+            except ValueError:
+                continue
+    best, best_q = None, 0
+    for encoding in available_encodings(config):
+        q = accepted.get(encoding, accepted.get('*', 0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(content, encoding, config=None):
+    config = config or compression_settings()
+    if encoding == 'br':
+        return brotli.compress(content, mode=brotli.MODE_TEXT, quality=config['BROTLI_QUALITY'])
+    if encoding == 'gzip':
+        return gzip.compress(content, compresslevel=config['GZIP_LEVEL'], mtime=0)
+    return content
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    def process_response(self, request, response):
+        config = compression_settings()
+        if (
+            not config['ENABLED']
+            or response.streaming
+            or response.has_header('Content-Encoding')
+            or not response.get('Content-Type', '').startswith(tuple(config['CONTENT_TYPES']))
+        ):
+            return response
+        if len(response.content) < config['MIN_SIZE']:
+            return response
+
+        # Whatever the outcome for this request, caches must key on it
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), config)
+        if encoding is None:
+            return response
+        compressed = compress(response.content, encoding, config)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # The bytes changed, so a strong validator no longer holds
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
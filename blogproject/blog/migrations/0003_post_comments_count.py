@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:10
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_comments_count(apps, schema_editor):
+    Post = apps.get_model("blog", "Post")
+    Comment = apps.get_model("blog", "Comment")
+    approved = (
+        Comment.objects.filter(post=OuterRef("pk"), status="APPROVED")
+        .order_by()
+        .values("post")
+        .annotate(count=Count("*"))
+        .values("count")
+    )
+    Post.objects.update(comments_count=Coalesce(Subquery(approved), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0002_user_profile_image"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="comments_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_comments_count, migrations.RunPython.noop),
+    ]
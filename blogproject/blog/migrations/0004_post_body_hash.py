@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0003_post_comments_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="body_hash",
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
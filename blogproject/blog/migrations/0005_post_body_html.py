@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0004_post_body_hash"),
+    ]
+
+    # Existing posts are rendered once, sanitized, by 0011_sanitize_body_html
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="body_html",
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
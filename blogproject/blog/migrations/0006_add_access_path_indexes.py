@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:20
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0005_post_body_html"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="category",
+            index=models.Index(
+                django.db.models.functions.text.Lower("name"),
+                name="category_name_lower_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                condition=models.Q(("status", "APPROVED")),
+                fields=["post", "created_at", "id"],
+                name="comment_approved_post_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["-created_at", "-id"], name="post_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                condition=models.Q(("status", "PUBLISHED")),
+                fields=["-created_at", "-id"],
+                name="post_published_created_idx",
+            ),
+        ),
+    ]
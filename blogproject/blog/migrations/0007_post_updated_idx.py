@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0006_add_access_path_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["updated_at"], name="post_updated_idx"),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:26
+
+import blog.models
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+def index_search_vectors(apps, schema_editor):
+    # tsvector only exists on PostgreSQL; elsewhere blog.search builds its own index
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    Post = apps.get_model("blog", "Post")
+    # Title, toc headings and body, weighted A/B/C, as of this migration
+    headings = models.Func(
+        models.F("toc"),
+        template="jsonb_path_query_array(%(expressions)s, '$[*].text')::text",
+        output_field=models.TextField(),
+    )
+    Post.objects.update(
+        search_vector=(
+            django.contrib.postgres.search.SearchVector("title", weight="A", config="english")
+            + django.contrib.postgres.search.SearchVector(headings, weight="B", config="english")
+            + django.contrib.postgres.search.SearchVector("body", weight="C", config="english")
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0007_post_updated_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.RunPython(index_search_vectors, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="post",
+            index=blog.models.SearchVectorIndex(
+                fields=["search_vector"], name="post_search_vector_idx"
+            ),
+        ),
+    ]
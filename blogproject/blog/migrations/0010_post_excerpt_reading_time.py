@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0009_image_variants"),
+    ]
+
+    # Existing posts are summarized by 0011_sanitize_body_html
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="excerpt",
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="reading_time",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,154 @@
+import math
+import re
+from html import escape, unescape
+from html.parser import HTMLParser
+
+import markdown
+import nh3
+from django.db import migrations
+
+# A frozen copy of blogproject.utils.render_markdown_with_toc and
+# summarize_html as of this migration, so that it keeps rendering the same
+# way when those change
+
+HEADING_TAGS = {f"h{level}" for level in range(1, 7)}
+HTML_COMMENT_RE = re.compile(r"<!--.*?-->", re.DOTALL)
+TAG_RE = re.compile(r"<[^>]*>")
+WHITESPACE_RE = re.compile(r"\s+")
+
+HTML_TAGS = {
+    "a", "abbr", "acronym", "area", "article", "aside", "b", "bdi", "bdo", "blockquote",
+    "br", "caption", "center", "cite", "code", "col", "colgroup", "data", "dd", "del",
+    "details", "dfn", "div", "dl", "dt", "em", "figcaption", "figure", "footer", "h1",
+    "h2", "h3", "h4", "h5", "h6", "header", "hgroup", "hr", "i", "img", "ins", "kbd",
+    "li", "map", "mark", "nav", "ol", "p", "pre", "q", "rp", "rt", "rtc", "ruby", "s",
+    "samp", "small", "span", "strike", "strong", "sub", "summary", "sup", "table",
+    "tbody", "td", "th", "thead", "time", "tr", "tt", "u", "ul", "var", "wbr",
+}
+HTML_ATTRIBUTES = {
+    "a": {"href", "hreflang", "title"},
+    "bdo": {"dir"},
+    "blockquote": {"cite"},
+    "col": {"align", "char", "charoff", "span"},
+    "colgroup": {"align", "char", "charoff", "span"},
+    "del": {"cite", "datetime"},
+    "hr": {"align", "size", "width"},
+    "img": {"src", "alt", "title", "width", "height"},
+    "ins": {"cite", "datetime"},
+    "ol": {"start"},
+    "q": {"cite"},
+    "table": {"align", "char", "charoff", "summary"},
+    "tbody": {"align", "char", "charoff"},
+    "td": {"align", "char", "charoff", "colspan", "headers", "rowspan"},
+    "tfoot": {"align", "char", "charoff"},
+    "th": {"align", "char", "charoff", "colspan", "headers", "rowspan", "scope"},
+    "thead": {"align", "char", "charoff"},
+    "tr": {"align", "char", "charoff"},
+    **{f"h{level}": {"id"} for level in range(1, 7)},
+}
+URL_SCHEMES = {"http", "https", "mailto"}
+
+EXCERPT_LENGTH = 280
+WORDS_PER_MINUTE = 200
+
+
+class HeadingParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.headings = []
+        self._open = []
+        self._in_script = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.CDATA_CONTENT_ELEMENTS:
+            self._in_script = True
+        if tag not in HEADING_TAGS:
+            return
+        heading = {
+            "level": int(tag[1]),
+            "strings": [],
+            "position": self.getpos(),
+            "start_tag": self.get_starttag_text(),
+            "has_id": any(name == "id" for name, _ in attrs),
+        }
+        self.headings.append(heading)
+        self._open.append((tag, heading))
+
+    def handle_endtag(self, tag):
+        if tag in self.CDATA_CONTENT_ELEMENTS:
+            self._in_script = False
+        for index in range(len(self._open) - 1, -1, -1):
+            if self._open[index][0] == tag:
+                del self._open[index:]
+                break
+
+    def handle_data(self, data):
+        if not self._in_script:
+            for _, heading in self._open:
+                heading["strings"].append(data)
+
+
+def toc_entry(heading):
+    text = "".join(piece for piece in (string.strip() for string in heading["strings"]) if piece)
+    slug = re.sub(r"[^\w\s-]", "", text).strip().lower().replace(" ", "-")
+    return {"level": heading["level"], "text": text, "slug": slug}
+
+
+def render_markdown_with_toc(markdown_text):
+    html = markdown.markdown(markdown_text)
+    parser = HeadingParser()
+    parser.feed(html)
+    parser.close()
+
+    line_starts = [0] + [match.end() for match in re.finditer("\n", html)]
+    toc, pieces, copied = [], [], 0
+    for heading in parser.headings:
+        entry = toc_entry(heading)
+        toc.append(entry)
+        if heading["has_id"]:
+            continue
+        line, column = heading["position"]
+        start_tag = heading["start_tag"]
+        end = line_starts[line - 1] + column + len(start_tag) - (2 if start_tag.endswith("/>") else 1)
+        pieces += [html[copied:end], f' id="{escape(entry["slug"])}"']
+        copied = end
+    pieces.append(html[copied:])
+    html = nh3.clean(
+        "".join(pieces), tags=HTML_TAGS, attributes=HTML_ATTRIBUTES, url_schemes=URL_SCHEMES
+    )
+    return html, toc
+
+
+def summarize_html(html):
+    text = unescape(TAG_RE.sub(" ", HTML_COMMENT_RE.sub("", html)))
+    text = WHITESPACE_RE.sub(" ", text).strip()
+    minutes = math.ceil(len(text.split()) / WORDS_PER_MINUTE)
+    if len(text) > EXCERPT_LENGTH:
+        text = text[:EXCERPT_LENGTH].rsplit(" ", 1)[0] + "…"
+    return text, minutes
+
+
+def render_existing_posts(apps, schema_editor):
+    # Databases that rendered posts in an earlier 0005 kept raw HTML from the
+    # markdown source; this pass renders (or re-renders) every post, sanitized
+    Post = apps.get_model("blog", "Post")
+    batch = []
+    for post in Post.objects.only("id", "body").iterator(chunk_size=500):
+        post.body_html, post.toc = render_markdown_with_toc(post.body)
+        post.excerpt, post.reading_time = summarize_html(post.body_html)
+        batch.append(post)
+        if len(batch) == 500:
+            Post.objects.bulk_update(batch, ["body_html", "toc", "excerpt", "reading_time"])
+            batch = []
+    Post.objects.bulk_update(batch, ["body_html", "toc", "excerpt", "reading_time"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0010_post_excerpt_reading_time"),
+    ]
+
+    operations = [
+        migrations.RunPython(render_existing_posts, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,48 @@
-from django.db import models
+import hashlib
+from collections import Counter
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import connection, models, transaction
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 from django.utils import timezone
-from blogproject.utils import extract_toc
+from django.db.models.functions import Lower
+from blogproject.utils import render_markdown_with_toc, summarize_html
+from .cache import invalidate
+from .profiling import timed
 from django.utils.text import slugify
-from .utility import generate_unique_slug
+from .utility import save_with_unique_slug
+
+SEARCH_CONFIG = 'english'
+
+
+def body_digest(body):
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def search_vector():
+    # Title, toc headings and body, weighted A/B/C, computed in the database
+    headings = models.Func(
+        models.F('toc'),
+        template="jsonb_path_query_array(%(expressions)s, '$[*].text')::text",
+        output_field=models.TextField(),
+    )
+    return (
+        SearchVector('title', weight='A', config=SEARCH_CONFIG)
+        + SearchVector(headings, weight='B', config=SEARCH_CONFIG)
+        + SearchVector('body', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+class SearchVectorIndex(GinIndex):
+    """GIN on PostgreSQL; other backends, where the column stays empty, get a plain index."""
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor != 'postgresql':
+            return models.Index.create_sql(self, model, schema_editor, using=using, **kwargs)
+        return super().create_sql(model, schema_editor, using=using, **kwargs)
+
 
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, user_name, password=None, **extra_fields):
@@ -38,6 +76,8 @@ class User(AbstractBaseUser, PermissionsMixin):
         blank=True,
         default="profile_images/default-avatar.png"  # fallback
     )
+    # Thumbnails of profile_image, written by blog.images workers
+    profile_image_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
@@ -54,6 +94,48 @@ class User(AbstractBaseUser, PermissionsMixin):
         return self.email
 
 
+# PostSerializer fields that read columns other than their own name
+SERIALIZER_FIELD_COLUMNS = {
+    'image_variants': ('image', 'image_variants'),
+}
+
+
+class PostQuerySet(models.QuerySet):
+    def for_serialization(self, body_html=False, fields=None):
+        # Load everything PostSerializer touches in a fixed number of queries,
+        # independent of page size and tag/category fan-out.
+        if fields is None:
+            queryset = self.defer('search_vector') if body_html else self.defer('body_html', 'search_vector')
+            fields = ('user', 'tags', 'category_names')
+        else:
+            # Only the columns behind the serializer fields that will be rendered
+            concrete = {field.name for field in self.model._meta.concrete_fields}
+            columns = {'id', 'created_at'}  # created_at for keyset cursors
+            for name in fields:
+                columns.update(SERIALIZER_FIELD_COLUMNS.get(name, (name,) if name in concrete else ()))
+            queryset = self.only(*columns)
+
+        if 'user' in fields:
+            queryset = queryset.select_related('user')
+        if 'tags' in fields:
+            queryset = queryset.prefetch_related(
+                models.Prefetch('post_tags', queryset=PostTag.objects.select_related('tag'))
+            )
+        if 'category_names' in fields:
+            queryset = queryset.prefetch_related(
+                models.Prefetch('post_categories', queryset=PostCategory.objects.select_related('category'))
+            )
+        return queryset
+
+    def update_search_vectors(self):
+        # The vector is a PostgreSQL tsvector; other backends search with
+        # blog.search's index, rebuilt when the 'search' version changes
+        if connection.vendor != 'postgresql':
+            invalidate('search')
+            return 0
+        return self.update(search_vector=search_vector())
+
+
 class Post(models.Model):
     class Status(models.TextChoices):
         DRAFT = "DRAFT", _("Draft")
@@ -64,19 +146,108 @@ class Post(models.Model):
     slug = models.SlugField(unique=True, max_length=100)
     body = models.TextField()
     toc = models.JSONField(default=list, blank=True)
+    # Rendered body with heading ids matching the toc slugs
+    body_html = models.TextField(blank=True, editable=False)
+    # Plain-text start of the body and minutes to read it, for list responses
+    excerpt = models.TextField(blank=True, editable=False)
+    reading_time = models.PositiveIntegerField(default=0, editable=False)
+    # sha256 of the body that toc, body_html, excerpt and reading_time were generated from
+    body_hash = models.CharField(max_length=64, blank=True, editable=False)
     image = models.ImageField(upload_to='post_images/', null=True, blank=True)
+    # Thumbnails of image, written by blog.images workers
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     status = models.CharField(max_length=9, choices=Status.choices, default=Status.DRAFT)
     view_count = models.IntegerField(default=0)
+    # Approved comments only, kept in sync by Comment.save and blog.signals;
+    # QuerySet.update() of comment status or post bypasses both, run
+    # manage.py repair_comment_counts after one
+    comments_count = models.PositiveIntegerField(default=0)
+    # Weighted title/toc/body tsvector for blog.search, GIN-indexed on PostgreSQL
+    search_vector = SearchVectorField(null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
-    def save(self, *args, **kwargs):
-        if not self.slug and self.title:
-            self.slug = generate_unique_slug(Post, self.title)
-        self.toc = extract_toc(self.body)
-        super().save(*args, **kwargs)
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Default and keyset ordering
+            models.Index(fields=['-created_at', '-id'], name='post_created_idx'),
+            # Newest edit, for list ETag validators
+            models.Index(fields=['updated_at'], name='post_updated_idx'),
+            # Published listings (partial where the backend supports it)
+            models.Index(
+                fields=['-created_at', '-id'],
+                condition=models.Q(status='PUBLISHED'),
+                name='post_published_created_idx',
+            ),
+            SearchVectorIndex(fields=['search_vector'], name='post_search_vector_idx'),
+        ]
+
+    # Maintained with F() updates elsewhere; a regular save must not write back a stale copy
+    COUNTER_FIELDS = ('comments_count', 'view_count')
+    # Written after each save, by the database or by background workers
+    DB_COMPUTED_FIELDS = ('search_vector', 'image_variants')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        post = super().from_db(db, field_names, values)
+        # The title the stored search vector was computed from, unless deferred
+        post._saved_title = post.__dict__.get('title')
+        return post
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        # Like the body below, the title only counts when it's saved and changed
+        searchable_changed = (
+            (update_fields is None or 'title' in update_fields)
+            and 'title' in self.__dict__
+            and self.title != getattr(self, '_saved_title', None)
+        )
+        if update_fields is None or 'body' in update_fields:
+            # Only re-render when the body actually changed
+            body_hash = body_digest(self.body)
+            if body_hash != self.body_hash:
+                searchable_changed = True
+                # The toc is extracted while rendering
+                with timed('toc'):
+                    self.body_html, self.toc = render_markdown_with_toc(self.body)
+                self.excerpt, self.reading_time = summarize_html(self.body_html)
+                self.body_hash = body_hash
+                if update_fields is not None:
+                    kwargs['update_fields'] = {
+                        *update_fields, 'toc', 'body_html', 'excerpt', 'reading_time', 'body_hash'
+                    }
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            skipped = {*self.COUNTER_FIELDS, *self.DB_COMPUTED_FIELDS, *self.get_deferred_fields()}
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in skipped and field.attname not in skipped
+            ]
+        if not self.slug and self.title:
+            save_with_unique_slug(self, self.title, lambda: super(Post, self).save(*args, **kwargs))
+        else:
+            super().save(*args, **kwargs)
+        if searchable_changed:
+            Post.objects.filter(pk=self.pk).update_search_vectors()
+        if 'title' in self.__dict__:
+            self._saved_title = self.title
+
+    @classmethod
+    def adjust_comments_count(cls, post_id, delta):
+        cls.objects.filter(pk=post_id).update(comments_count=models.F('comments_count') + delta)
+
+    @classmethod
+    def adjust_comments_counts(cls, deltas):
+        """Adjust several posts in one UPDATE, ``deltas`` maps post ids to changes."""
+        if not deltas:
+            return
+        delta = models.Case(
+            *[models.When(pk=post_id, then=models.Value(n)) for post_id, n in deltas.items()],
+            default=models.Value(0),
+            output_field=models.IntegerField(),
+        )
+        cls.objects.filter(pk__in=deltas).update(comments_count=models.F('comments_count') + delta)
 
     def __str__(self):
         return self.title
@@ -100,6 +271,40 @@ class Comment(models.Model):
     comment_body = models.TextField()
     status = models.CharField(max_length=9, choices=Status.choices, default=Status.APPROVED)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Newest edit, for comment list ETag validators
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Approved comments of a post in thread order
+            models.Index(
+                fields=['post', 'created_at', 'id'],
+                condition=models.Q(status='APPROVED'),
+                name='comment_approved_post_idx',
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            if self._state.adding:
+                previous_status = None
+            else:
+                # Lock the row so concurrent status changes can't double count
+                previous_status, previous_post_id = (
+                    Comment.objects.select_for_update()
+                    .filter(pk=self.pk)
+                    .values_list('status', 'post_id')
+                    .first()
+                ) or (None, None)
+            super().save(*args, **kwargs)
+
+            # A comment moved to another post counts there instead
+            deltas = Counter()
+            if previous_status == self.Status.APPROVED:
+                deltas[previous_post_id] -= 1
+            if self.status == self.Status.APPROVED:
+                deltas[self.post_id] += 1
+            Post.adjust_comments_counts({post_id: delta for post_id, delta in deltas.items() if delta})
 
     def __str__(self):
         return f'Comment by {self.user} on {self.post}'
@@ -109,6 +314,12 @@ class Category(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            # Case-insensitive lookups by name
+            models.Index(Lower('name'), name='category_name_lower_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -149,3 +360,18 @@ class PostView(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='post_views')
     view_count = models.IntegerField(default=0)
     like_count = models.IntegerField(default=0)
+
+
+class PostLike(models.Model):
+    """One per user and post; only a new one adds to PostView.like_count."""
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='likes')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='post_likes')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'user'], name='unique_post_like')
+        ]
+
+    def __str__(self):
+        return f'{self.user} likes {self.post}'
@@ -0,0 +1,271 @@
+"""Background spam classification of new comments.
+
+With moderation enabled, comments created or edited through the API are
+stored as PENDING (not listed, not counted) and queued once the transaction
+commits;
+the request doesn't wait for them to be checked. A pool of worker threads
+takes the queued ids in batches, scores each comment on spam keywords,
+links, shouting and repeated characters, adjusted by its author's history
+(approved and spam comment counts, cached per user), and sets the statuses
+with one UPDATE per status, adjusting comments_count of the posts whose
+comments were approved.
+
+The queue lives in process memory: comments queued in a process that
+stops stay PENDING until ``manage.py moderate_comments`` classifies them.
+Its length is served as the moderation_queue_depth metric.
+"""
+import logging
+import re
+import threading
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Q
+
+from .cache import invalidate
+from .metrics import comments_moderated, moderation_queue_depth
+from .models import Comment, Post
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'WORKERS': 2,  # 0 classifies inline once the transaction commits, e.g. in tests
+    'BATCH_SIZE': 100,  # comments classified and updated together
+    'SPAM_THRESHOLD': 1.0,
+    'MAX_LINKS': 2,  # links allowed before each further one counts
+    'KEYWORDS': [
+        'viagra', 'cialis', 'casino', 'poker', 'betting', 'forex', 'payday', 'loan', 'loans',
+        'bitcoin', 'crypto', 'escort', 'xxx', 'porn', 'replica', 'diet pills', 'weight loss',
+        'work from home', 'make money', 'free money', 'click here', 'buy now', 'seo services',
+    ],
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'moderation',
+    'REPUTATION_TIMEOUT': 3600,  # seconds a user's cached history is used before it's recounted
+}
+
+# Score of each signal; SPAM_THRESHOLD and up is spam
+KEYWORD_SCORE = 0.5
+LINK_SCORE = 0.5
+SHOUTING_SCORE = 0.3
+REPEATED_SCORE = 0.3
+SPAM_HISTORY_SCORE = 0.8  # times the share of the author's earlier comments that were spam
+APPROVED_HISTORY_SCORE = -0.1  # per earlier approved comment, up to 3
+
+LINK_RE = re.compile(r'https?://|\bwww\.', re.IGNORECASE)
+REPEATED_RE = re.compile(r'(.)\1{5,}')
+
+
+def moderation_settings():
+    return {**DEFAULTS, **getattr(settings, 'MODERATION', {})}
+
+
+def new_comment_status():
+    """The status a comment created through the API starts with."""
+    return Comment.Status.PENDING if moderation_settings()['ENABLED'] else Comment.Status.APPROVED
+
+
+def edited_comment_status(comment):
+    """The status of ``comment`` once its body is edited through the API."""
+    return Comment.Status.PENDING if moderation_settings()['ENABLED'] else comment.status
+
+
+@lru_cache(maxsize=8)
+def keyword_pattern(keywords):
+    return re.compile(r'\b(?:' + '|'.join(map(re.escape, keywords)) + r')\b', re.IGNORECASE)
+
+
+def spam_score(body, history, config):
+    """Spamminess of a comment body by an author with ``(approved, spam)`` earlier comments."""
+    score = KEYWORD_SCORE * len(keyword_pattern(tuple(config['KEYWORDS'])).findall(body))
+    score += LINK_SCORE * max(0, len(LINK_RE.findall(body)) - config['MAX_LINKS'])
+    letters = [char for char in body if char.isalpha()]
+    if len(letters) >= 20 and sum(char.isupper() for char in letters) > 0.7 * len(letters):
+        score += SHOUTING_SCORE
+    if REPEATED_RE.search(body):
+        score += REPEATED_SCORE
+    approved, spam = history
+    if spam:
+        score += SPAM_HISTORY_SCORE * spam / (approved + spam)
+    return score + APPROVED_HISTORY_SCORE * min(approved, 3)
+
+
+def _history_key(config, user_id):
+    return f"{config['KEY_PREFIX']}:history:{user_id}"
+
+
+def user_histories(user_ids, config):
+    """``{user_id: (approved, spam)}`` comment counts, counted in one query for the users not cached."""
+    cache = caches[config['CACHE_ALIAS']]
+    keys = {_history_key(config, user_id): user_id for user_id in user_ids}
+    histories = {keys[key]: tuple(history) for key, history in cache.get_many(keys).items()}
+
+    missing = set(user_ids) - set(histories)
+    if missing:
+        counted = (
+            Comment.objects.filter(user_id__in=missing)
+            .order_by()
+            .values('user_id')
+            .annotate(
+                approved=Count('pk', filter=Q(status=Comment.Status.APPROVED)),
+                spam=Count('pk', filter=Q(status=Comment.Status.SPAM)),
+            )
+        )
+        loaded = {user_id: (0, 0) for user_id in missing}
+        loaded.update({row['user_id']: (row['approved'], row['spam']) for row in counted})
+        histories.update(loaded)
+    return histories
+
+
+def record_histories(histories, decided, config):
+    """Add the statuses just set to the cached histories.
+
+    Two batches of one user finishing together can lose an update, which
+    only lasts until the entry expires and is recounted.
+    """
+    changes = defaultdict(Counter)
+    for user_id, status in decided:
+        changes[user_id][status] += 1
+    updated = {
+        _history_key(config, user_id): (
+            histories[user_id][0] + counts[Comment.Status.APPROVED],
+            histories[user_id][1] + counts[Comment.Status.SPAM],
+        )
+        for user_id, counts in changes.items()
+    }
+    caches[config['CACHE_ALIAS']].set_many(updated, config['REPUTATION_TIMEOUT'])
+
+
+def apply_decisions(decisions):
+    """Set ``{comment_id: status}`` on the comments still pending, one UPDATE per status.
+
+    Returns ``(user_id, status)`` of every comment changed.
+    """
+    with transaction.atomic():
+        # Locked like Comment.save() does, so a comment changed or deleted
+        # meanwhile is left alone and comments_count is adjusted once
+        rows = list(
+            Comment.objects.select_for_update()
+            .filter(pk__in=decisions, status=Comment.Status.PENDING)
+            .values_list('pk', 'post_id', 'user_id')
+        )
+        by_status = defaultdict(list)
+        for pk, _, _ in rows:
+            by_status[decisions[pk]].append(pk)
+        for status, pks in by_status.items():
+            Comment.objects.filter(pk__in=pks).update(status=status)
+
+        approved = Counter(post_id for pk, post_id, _ in rows if decisions[pk] == Comment.Status.APPROVED)
+        if approved:
+            # Bulk updates skip the save()/post_save bookkeeping
+            Post.adjust_comments_counts(approved)
+            invalidate('posts')
+    return [(user_id, decisions[pk]) for pk, _, user_id in rows]
+
+
+def moderate(comment_ids, config=None):
+    """Classify the comments among ``comment_ids`` that are still pending.
+
+    Returns how many comments were set to each status.
+    """
+    config = config or moderation_settings()
+    comments = list(
+        Comment.objects.filter(pk__in=comment_ids, status=Comment.Status.PENDING)
+        .values_list('pk', 'user_id', 'comment_body')
+    )
+    if not comments:
+        return {}
+
+    histories = user_histories({user_id for _, user_id, _ in comments}, config)
+    decisions = {
+        pk: Comment.Status.SPAM
+        if spam_score(body, histories[user_id], config) >= config['SPAM_THRESHOLD']
+        else Comment.Status.APPROVED
+        for pk, user_id, body in comments
+    }
+    decided = apply_decisions(decisions)
+    record_histories(histories, decided, config)
+
+    totals = Counter(status for _, status in decided)
+    for status, count in totals.items():
+        comments_moderated.inc(status, amount=count)
+    return dict(totals)
+
+
+class ModerationQueue:
+    """Comment ids waiting for classification, worked off by a thread pool.
+
+    Ids queued while a worker is busy wait for its next batch, so batches
+    grow with the load.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = deque()
+        self._executor = None
+        self._running = 0
+
+    def depth(self):
+        with self._lock:
+            return len(self._pending)
+
+    def submit(self, comment_ids):
+        config = moderation_settings()
+        with self._lock:
+            self._pending.extend(comment_ids)
+            start = bool(config['WORKERS']) and self._running < config['WORKERS']
+            if start:
+                self._running += 1
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(config['WORKERS'], thread_name_prefix='moderation')
+        if not config['WORKERS']:
+            self.drain(config)
+        elif start:
+            self._executor.submit(self._work, config)
+
+    def take(self, size):
+        with self._lock:
+            return [self._pending.popleft() for _ in range(min(size, len(self._pending)))]
+
+    def drain(self, config=None):
+        """Classify everything queued in this thread, returns the number of ids taken."""
+        config = config or moderation_settings()
+        taken = 0
+        while batch := self.take(config['BATCH_SIZE']):
+            taken += len(batch)
+            self._moderate(batch, config)
+        return taken
+
+    def _work(self, config):
+        close_old_connections()
+        try:
+            while True:
+                with self._lock:
+                    # Checked under the lock, so ids queued now start another worker
+                    if not self._pending:
+                        self._running -= 1
+                        return
+                    batch = [self._pending.popleft() for _ in range(min(config['BATCH_SIZE'], len(self._pending)))]
+                self._moderate(batch, config)
+        finally:
+            close_old_connections()
+
+    def _moderate(self, batch, config):
+        try:
+            moderate(batch, config)
+        except Exception:
+            # They stay PENDING for moderate_comments
+            logger.exception('Moderating %d comments failed', len(batch))
+
+
+moderation_queue = ModerationQueue()
+moderation_queue_depth.function = moderation_queue.depth
+
+
+def schedule_moderation(comment_id):
+    """Queue the comment once the current transaction commits."""
+    transaction.on_commit(lambda: moderation_queue.submit([comment_id]))
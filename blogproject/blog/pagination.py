@@ -1,6 +1,111 @@
-from rest_framework.pagination import PageNumberPagination
+import binascii
+from base64 import b64decode, b64encode
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 
 class SmallResultsSetPagination(PageNumberPagination):
     page_size = 3  # number of items per page
     page_size_query_param = 'page_size'  # optional: allows client to override with ?page_size=...
     max_page_size = 20  # optional: max limit client can set
+
+
+class KeysetPagination(BasePagination):
+    """Forward-only cursor pagination on (created_at, id).
+
+    Each page is a single indexed range query, so deep pages cost the same as
+    the first one, and no COUNT(*) is run.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            created_at, pk = position
+            after = 'lt' if self.ordering[0].startswith('-') else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'created_at__{after}': created_at}) | Q(created_at=created_at, **{f'id__{after}': pk})
+            )
+
+        items = list(queryset[:self.page_size + 1])
+        self.has_next = len(items) > self.page_size
+        items = items[:self.page_size]
+        self.next_position = (items[-1].created_at, items[-1].pk) if self.has_next else None
+        return items
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param], strict=True, cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            created_at, pk = b64decode(encoded.encode('ascii')).decode('ascii').split('|')
+            created_at = datetime.fromisoformat(created_at)
+            return created_at, int(pk)
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position):
+        created_at, pk = position
+        encoded = b64encode(f'{created_at.isoformat()}|{pk}'.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+
+class OptionalKeysetPagination(BasePagination):
+    """Page numbers by default; keyset pagination once the client opts in
+    with ?pagination=cursor (later pages carry ?cursor=...)."""
+    page_number_class = PageNumberPagination
+    keyset_class = KeysetPagination
+
+    def uses_keyset(self, request):
+        params = request.query_params
+        return self.keyset_class.cursor_query_param in params or params.get('pagination') == 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        paginator_class = self.keyset_class if self.uses_keyset(request) else self.page_number_class
+        self.paginator = paginator_class()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+
+class AscendingKeysetPagination(KeysetPagination):
+    ordering = ('created_at', 'id')
+
+
+class CommentPagination(OptionalKeysetPagination):
+    keyset_class = AscendingKeysetPagination
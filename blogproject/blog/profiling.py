@@ -0,0 +1,227 @@
+"""Sampled per-request profiling.
+
+ProfilingMiddleware picks PROFILING['SAMPLE_RATE'] of the requests. For each
+one it records the total time, the ORM queries (count, time, and repeated
+statement fingerprints, the usual sign of an N+1) and named sections
+wrapped in ``timed()``: serialization, rendering and markdown/toc
+rendering. The numbers go out in a Server-Timing header and into
+per-endpoint totals, served to admins at /api/admin/profiling/.
+
+Requests that aren't sampled pay for one random() call; queries and timed
+sections outside a sampled request for a context variable lookup.
+Totals are kept per process.
+"""
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 0.01,  # share of requests profiled, 0-1
+    'SERVER_TIMING': True,
+    'DUPLICATE_THRESHOLD': 3,  # a fingerprint run this often in one request is reported
+    'WINDOW': 1000,  # latest sampled durations kept per endpoint, for percentiles
+    'MAX_FINGERPRINTS': 20,  # repeated statements kept per endpoint
+}
+
+# Literals and IN lists of any length are the same statement
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+IN_LIST_RE = re.compile(r'\bIN\s*\((?:\s*(?:%s|\?)\s*,?)+\)', re.IGNORECASE)
+
+current_profile = ContextVar('current_profile', default=None)
+
+
+def profiling_settings():
+    return {**DEFAULTS, **getattr(settings, 'PROFILING', {})}
+
+
+def fingerprint(sql):
+    return IN_LIST_RE.sub('IN (...)', LITERAL_RE.sub('?', sql))
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total_ms = 0.0
+        self.query_count = 0
+        self.query_ms = 0.0
+        self.fingerprints = Counter()
+        self.timers = {}
+        self.active = set()
+        # Parallel async reads record from several threads
+        self.lock = threading.Lock()
+
+    def record_query(self, sql, ms):
+        with self.lock:
+            self.query_count += 1
+            self.query_ms += ms
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def add_time(self, name, ms):
+        with self.lock:
+            self.timers[name] = self.timers.get(name, 0.0) + ms
+
+    def finish(self):
+        self.total_ms = (time.perf_counter() - self.started) * 1000
+
+    def duplicates(self, threshold):
+        return {sql: count for sql, count in self.fingerprints.items() if count >= threshold}
+
+    def server_timing(self):
+        metrics = [f'total;dur={self.total_ms:.1f}', f'db;dur={self.query_ms:.1f};desc="{self.query_count} queries"']
+        metrics += [f'{name};dur={ms:.1f}' for name, ms in self.timers.items()]
+        return ', '.join(metrics)
+
+
+@contextmanager
+def timed(name):
+    """Add the block's duration to the sampled request's ``name`` timer.
+
+    Nested or recursive blocks with the same name are counted once.
+    """
+    profile = current_profile.get()
+    if profile is None or name in profile.active:
+        yield
+        return
+    profile.active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.active.discard(name)
+        profile.add_time(name, (time.perf_counter() - started) * 1000)
+
+
+def record_queries(execute, sql, params, many, context):
+    """Execute wrapper installed on every connection, see blog/signals.py."""
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.record_query(sql, (time.perf_counter() - started) * 1000)
+
+
+class EndpointStats:
+    """Totals of the sampled requests, per endpoint, in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def add(self, endpoint, profile, config=None):
+        config = config or profiling_settings()
+        duplicates = profile.duplicates(config['DUPLICATE_THRESHOLD'])
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = {
+                    'requests': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'queries': 0, 'query_ms': 0.0,
+                    'requests_with_duplicates': 0, 'timers': Counter(), 'duplicates': Counter(),
+                    'window': deque(maxlen=config['WINDOW']),
+                }
+            stats['requests'] += 1
+            stats['total_ms'] += profile.total_ms
+            stats['max_ms'] = max(stats['max_ms'], profile.total_ms)
+            stats['queries'] += profile.query_count
+            stats['query_ms'] += profile.query_ms
+            stats['timers'].update(profile.timers)
+            stats['window'].append(profile.total_ms)
+            if duplicates:
+                stats['requests_with_duplicates'] += 1
+                stats['duplicates'].update(duplicates)
+                # Keep the most repeated statements only
+                if len(stats['duplicates']) > config['MAX_FINGERPRINTS']:
+                    stats['duplicates'] = Counter(dict(stats['duplicates'].most_common(config['MAX_FINGERPRINTS'])))
+
+    def snapshot(self):
+        """Per-endpoint averages, the endpoints taking the most time in total first."""
+        with self._lock:
+            endpoints = [(name, dict(stats, window=sorted(stats['window']))) for name, stats in self._endpoints.items()]
+
+        rows = []
+        for name, stats in sorted(endpoints, key=lambda item: -item[1]['total_ms']):
+            requests, window = stats['requests'], stats['window']
+            rows.append({
+                'endpoint': name,
+                'requests': requests,
+                'mean_ms': stats['total_ms'] / requests,
+                'p50_ms': window[len(window) // 2],
+                'p95_ms': window[min(len(window) - 1, int(len(window) * 0.95))],
+                'max_ms': stats['max_ms'],
+                'queries_mean': stats['queries'] / requests,
+                'query_ms_mean': stats['query_ms'] / requests,
+                'timers_mean_ms': {timer: ms / requests for timer, ms in stats['timers'].items()},
+                'requests_with_duplicates': stats['requests_with_duplicates'],
+                'duplicate_queries': [
+                    {'fingerprint': sql, 'executions': count} for sql, count in stats['duplicates'].most_common()
+                ],
+            })
+        return rows
+
+    def clear(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+endpoint_stats = EndpointStats()
+
+
+def endpoint_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return f'{request.method} {match.view_name if match else "unresolved"}'
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        config = profiling_settings()
+        if not self.sampled(config):
+            return self.get_response(request)
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.finish(request, response, profile, config)
+
+    async def __acall__(self, request):
+        config = profiling_settings()
+        if not self.sampled(config):
+            return await self.get_response(request)
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.finish(request, response, profile, config)
+
+    def sampled(self, config):
+        return config['ENABLED'] and random.random() < config['SAMPLE_RATE']
+
+    def finish(self, request, response, profile, config):
+        profile.finish()
+        endpoint_stats.add(endpoint_name(request), profile, config)
+        if config['SERVER_TIMING']:
+            response['Server-Timing'] = profile.server_timing()
+        return response
@@ -0,0 +1,50 @@
+"""orjson-backed JSON renderer and parser for DRF.
+
+Drop-in replacements for DRF's JSONRenderer/JSONParser, selected in
+REST_FRAMEWORK. Output is compact UTF-8, same as DRF's defaults. Types orjson
+doesn't know (Decimal, lazy translations, ...) go through DRF's own encoder.
+Without orjson installed, or when an indented response is asked for (the
+browsable API does), they behave exactly like the classes they extend.
+"""
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .profiling import timed
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+else:
+    # Dates keep DRF's format (ISO 8601, 'Z', milliseconds); int keys become strings like json.dumps
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+class ORJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('render'):
+            if orjson is None or self.get_indent(accepted_media_type or '', renderer_context or {}):
+                return super().render(data, accepted_media_type, renderer_context)
+            if data is None:
+                return b''
+            return orjson.dumps(data, default=JSONEncoder().default, option=ORJSON_OPTIONS)
+
+
+class ORJSONParser(JSONParser):
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            content = stream.read()
+            if encoding.lower().replace('-', '') != 'utf8':
+                content = content.decode(encoding).encode()
+            return orjson.loads(content)
+        except (ValueError, UnicodeError) as exc:
+            raise ParseError(f'JSON parse error - {exc}')
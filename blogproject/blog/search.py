@@ -0,0 +1,165 @@
+"""Full-text search over published posts.
+
+PostgreSQL uses the stored, GIN-indexed ``Post.search_vector`` (title,
+toc headings and body with decreasing weights), ranks with ts_rank and
+highlights with ts_headline. Other backends (SQLite test runs) use an
+in-process inverted index of all posts with BM25 ranking, rebuilt when the
+'search' cache version changes: when a title, toc or body is saved
+(PostQuerySet.update_search_vectors) or a post is deleted. Status and other
+filters are applied to the matches with one query per search.
+"""
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F
+from django.utils.html import escape
+
+from .cache import get_version
+from .models import SEARCH_CONFIG, Post
+
+# Snippets are raw body text with the matches between these control
+# characters; snippet_html() escapes the text and turns them into <mark>
+MATCH_START = '\x02'
+MATCH_STOP = '\x03'
+SNIPPET_RADIUS = 80
+WORD_RE = re.compile(r'\w+')
+
+
+def toc_text(toc):
+    return ' '.join(heading['text'] for heading in toc or [])
+
+
+def search_posts(queryset, query):
+    """Return the published posts in ``queryset`` matching ``query``, best
+    first, each with ``rank`` and ``snippet`` attributes. The result supports
+    len() and slicing, so it can be paginated directly."""
+    queryset = queryset.filter(status=Post.Status.PUBLISHED)
+    if connection.vendor == 'postgresql':
+        return postgres_search(queryset, query)
+    return inverted_index.search(queryset, query)
+
+
+def postgres_search(queryset, query):
+    search_query = SearchQuery(query, search_type='websearch', config=SEARCH_CONFIG)
+    return (
+        queryset.filter(search_vector=search_query)
+        .annotate(
+            rank=SearchRank(F('search_vector'), search_query),
+            snippet=SearchHeadline(
+                'body', search_query, config=SEARCH_CONFIG,
+                start_sel=MATCH_START, stop_sel=MATCH_STOP, max_fragments=2,
+            ),
+        )
+        .order_by('-rank', '-created_at')
+    )
+
+
+def tokenize(text):
+    return WORD_RE.findall(text.lower())
+
+
+def highlight(body, terms):
+    """A window of ``body`` around the first matching term, matches delimited like ts_headline's."""
+    pattern = re.compile(r'\b(' + '|'.join(re.escape(term) for term in terms) + r')\b', re.IGNORECASE)
+    match = pattern.search(body)
+    start = max(0, match.start() - SNIPPET_RADIUS) if match else 0
+    window = body[start:start + 2 * SNIPPET_RADIUS].replace(MATCH_START, '').replace(MATCH_STOP, '')
+    return pattern.sub(lambda m: f'{MATCH_START}{m.group(0)}{MATCH_STOP}', window)
+
+
+def snippet_html(snippet):
+    """The snippet's text HTML-escaped, its matches wrapped in <mark>."""
+    return escape(snippet).replace(MATCH_START, '<mark>').replace(MATCH_STOP, '</mark>')
+
+
+class SearchResults:
+    """Lazily loads the ranked posts: slicing fetches only that slice."""
+
+    def __init__(self, queryset, ranked, terms):
+        self.queryset = queryset
+        self.ranked = ranked
+        self.terms = terms
+
+    def __len__(self):
+        return len(self.ranked)
+
+    def count(self):
+        return len(self.ranked)
+
+    def __getitem__(self, index):
+        ranked = self.ranked[index] if isinstance(index, slice) else [self.ranked[index]]
+        posts = self.queryset.in_bulk([post_id for post_id, _ in ranked])
+        results = []
+        for post_id, rank in ranked:
+            post = posts.get(post_id)
+            if post is None:  # filtered out by the queryset
+                continue
+            post.rank = rank
+            post.snippet = highlight(post.body, self.terms)
+            results.append(post)
+        return results if isinstance(index, slice) else results[0]
+
+
+class InvertedIndex:
+    FIELD_WEIGHTS = {'title': 3.0, 'toc': 2.0, 'body': 1.0}
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+
+    def build(self):
+        postings = defaultdict(dict)
+        lengths = {}
+        rows = Post.objects.values_list('pk', 'title', 'toc', 'body')
+        for pk, title, toc, body in rows.iterator():
+            weighted = Counter()
+            length = 0
+            for field, text in (('title', title), ('toc', toc_text(toc)), ('body', body)):
+                tokens = tokenize(text)
+                length += len(tokens)
+                for token in tokens:
+                    weighted[token] += self.FIELD_WEIGHTS[field]
+            for token, frequency in weighted.items():
+                postings[token][pk] = frequency
+            lengths[pk] = length
+        self.postings = postings
+        self.lengths = lengths
+        self.average_length = sum(lengths.values()) / len(lengths) if lengths else 0
+
+    def ensure_current(self):
+        version = get_version('search')
+        with self.lock:
+            if version != self.version:
+                self.build()
+                self.version = version
+
+    def search(self, queryset, query):
+        self.ensure_current()
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or any(term not in self.postings for term in terms):
+            return SearchResults(queryset, [], terms)
+
+        # Every term must match, like websearch_to_tsquery
+        matches = set.intersection(*(set(self.postings[term]) for term in terms))
+        matches = set(queryset.filter(pk__in=matches).values_list('pk', flat=True))
+        total = len(self.lengths)
+        scores = Counter()
+        for term in terms:
+            documents = self.postings[term]
+            idf = math.log(1 + (total - len(documents) + 0.5) / (len(documents) + 0.5))
+            for pk in matches:
+                frequency = documents[pk]
+                norm = 1 - self.B + self.B * self.lengths[pk] / (self.average_length or 1)
+                scores[pk] += idf * frequency * (self.K1 + 1) / (frequency + self.K1 * norm)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        return SearchResults(queryset, ranked, terms)
+
+
+inverted_index = InvertedIndex()
@@ -0,0 +1,129 @@
+"""Deterministic fake blog data for benchmarks and local development.
+
+Records use the import_posts/export_posts format (see blog/transfer.py), so
+seeding goes through the same bulk import path. The same seed and volumes
+always produce the same data.
+"""
+from datetime import datetime, timedelta, timezone
+
+SEED_USER_PREFIX = 'seed-user-'
+SEED_PASSWORD = 'seed-password-123'
+
+WORDS = (
+    'django query index cache latency request response worker thread process database table row '
+    'column page token user post comment tag category render template markdown serializer view '
+    'model field migration transaction lock pool connection server client header body payload '
+    'benchmark profile trace metric counter queue signal event stream buffer batch bulk insert '
+    'update select join filter order limit offset cursor vector search rank snippet excerpt '
+    'fast slow simple careful small large stale fresh warm cold hot lazy eager async sync'
+).split()
+CATEGORIES = ('Engineering', 'Databases', 'Performance', 'Frontend', 'Operations', 'Security', 'Tutorials', 'News')
+LANGUAGES = ('python', 'sql', 'bash', 'json')
+STATUS_WEIGHTS = {'PUBLISHED': 90, 'DRAFT': 10}
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def seed_user_name(index):
+    return f'{SEED_USER_PREFIX}{index}'
+
+
+def numbered(count, names):
+    """``count`` distinct names, cycling through ``names`` with a suffix."""
+    return [names[i % len(names)] + (str(i // len(names)) if i >= len(names) else '') for i in range(count)]
+
+
+def tag_names(count):
+    return numbered(count, WORDS)
+
+
+def category_names(count):
+    return numbered(count, CATEGORIES)
+
+
+def words(rng, low, high):
+    return ' '.join(rng.choices(WORDS, k=rng.randint(low, high)))
+
+
+def sentence(rng):
+    text = words(rng, 6, 18)
+    # Some inline markup, as real posts have
+    roll = rng.random()
+    if roll < 0.15:
+        text += f' **{rng.choice(WORDS)}**'
+    elif roll < 0.3:
+        text += f' `{rng.choice(WORDS)}()`'
+    elif roll < 0.4:
+        text += f' [{rng.choice(WORDS)}](https://example.com/{rng.choice(WORDS)})'
+    return text[0].upper() + text[1:] + '.'
+
+
+def paragraph(rng):
+    return ' '.join(sentence(rng) for _ in range(rng.randint(2, 6)))
+
+
+def markdown_body(rng, sections):
+    """A post: an intro and ``sections`` headed sections of paragraphs, lists, code and quotes."""
+    blocks = [paragraph(rng)]
+    for _ in range(sections):
+        blocks.append(f'## {words(rng, 2, 5).capitalize()}')
+        for _ in range(rng.randint(1, 4)):
+            roll = rng.random()
+            if roll < 0.6:
+                blocks.append(paragraph(rng))
+            elif roll < 0.75:
+                blocks.append('\n'.join(f'- {words(rng, 3, 9)}' for _ in range(rng.randint(2, 6))))
+            elif roll < 0.9:
+                code = '\n'.join(f'    {words(rng, 2, 6)}' for _ in range(rng.randint(2, 8)))
+                blocks.append(f'```{rng.choice(LANGUAGES)}\n{code}\n```')
+            else:
+                blocks.append(f'> {sentence(rng)}')
+        if rng.random() < 0.3:
+            blocks.append(f'### {words(rng, 2, 4).capitalize()}\n\n{paragraph(rng)}')
+    return '\n\n'.join(blocks)
+
+
+def comment_records(rng, count, authors, max_depth, created_at):
+    """``count`` comments, replies nested at most ``max_depth`` levels deep."""
+    comments, depths = [], {}
+    for index in range(count):
+        parent_id = None
+        candidates = [comment['id'] for comment in comments if depths[comment['id']] < max_depth]
+        # About half of the comments are replies
+        if candidates and rng.random() < 0.5:
+            parent_id = rng.choice(candidates)
+        depths[index] = depths[parent_id] + 1 if parent_id is not None else 0
+        comments.append({
+            'id': index,
+            'parent_id': parent_id,
+            'author': rng.choice(authors),
+            'body': ' '.join(sentence(rng) for _ in range(rng.randint(1, 3))),
+            'status': 'APPROVED',
+            'created_at': (created_at + timedelta(minutes=10 * (index + 1))).isoformat(),
+        })
+    return comments
+
+
+def post_records(rng, count, authors, tags, categories, comments=8, sections=4, max_depth=3):
+    """Lazily yield ``count`` post records.
+
+    Comment counts and section counts vary around the given averages, and tag
+    popularity is skewed so some tags carry many more posts than others.
+    """
+    statuses, weights = zip(*STATUS_WEIGHTS.items())
+    tag_weights = [1 / (rank + 1) for rank in range(len(tags))]
+    for index in range(count):
+        created_at = EPOCH + timedelta(hours=6 * index, minutes=rng.randint(0, 300))
+        yield {
+            'title': f'{words(rng, 3, 8).capitalize()} {index}',
+            'slug': None,
+            'body': markdown_body(rng, max(1, round(rng.gauss(sections, sections / 3)))),
+            'status': rng.choices(statuses, weights)[0],
+            'author': rng.choice(authors),
+            'created_at': created_at.isoformat(),
+            'tags': sorted(set(rng.choices(tags, tag_weights, k=rng.randint(0, 4)))) if tags else [],
+            'categories': sorted(set(rng.sample(categories, min(len(categories), rng.randint(1, 2))))),
+            'comments': comment_records(
+                rng, max(0, round(rng.expovariate(1 / comments))) if comments else 0,
+                authors, max_depth, created_at,
+            ),
+        }
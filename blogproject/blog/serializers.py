@@ -1,17 +1,42 @@
 from rest_framework import serializers
 from .models import User, Comment, Post, PostTag, Tag, Category, PostCategory
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.validators import UniqueValidator
 from django.contrib.auth.password_validation import validate_password
-from .utility import generate_unique_slug
+from django.db import IntegrityError, transaction
+from .authentication import denylist
+from .images import sanitize_image, variant_urls
+from .profiling import timed
+from .search import snippet_html
+from .utility import allocate_unique_slugs
 
 
-class UserSerializer(serializers.ModelSerializer):
+class TimedRepresentationMixin:
+    # The 'serialize' section of a profiled request, see blog/profiling.py
+    def to_representation(self, instance):
+        with timed('serialize'):
+            return super().to_representation(instance)
+
+
+class UserSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
+    profile_image_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = User
-        fields = ['id', 'user_name', 'email', 'role', 'created_at', 'updated_at']
+        fields = [
+            'id', 'user_name', 'email', 'role', 'profile_image', 'profile_image_variants',
+            'created_at', 'updated_at',
+        ]
         read_only_fields = ['id', 'created_at', 'updated_at']
 
+    def validate_profile_image(self, value):
+        return sanitize_image(value) if value else value
+
+    def get_profile_image_variants(self, obj):
+        return variant_urls(obj.profile_image_variants, obj.profile_image, self.context.get('request'))
+
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
 
     @classmethod
@@ -20,8 +45,20 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
 
         # Add custom claims
         token['username'] = user.user_name
+        # Enough for blog.authentication to build request.user without a query
+        token['user_name'] = user.user_name
+        token['role'] = user.role
+        token['is_staff'] = user.is_staff
         return token
 
+
+class DenylistTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        # Otherwise a revoked user would get fresh access tokens with the old claims
+        if denylist.is_revoked(RefreshToken(attrs['refresh'])):
+            raise InvalidToken('Token has been revoked')
+        return super().validate(attrs)
+
 """
 
 🧪 In Simple Terms:
@@ -88,11 +125,53 @@ class RegisterSerializer(serializers.ModelSerializer):
 
 
 
-class PostSerializer(serializers.ModelSerializer):
+def include_body_html(request):
+    # body_html is opt-in: ?include=body_html
+    return request is not None and 'body_html' in request.query_params.get('include', '').split(',')
+
+
+def requested_fields(request):
+    """Field names from ?fields=a,b, or None without the parameter."""
+    if request is None or not request.query_params.get('fields'):
+        return None
+    return {name.strip() for name in request.query_params['fields'].split(',') if name.strip()}
+
+
+def rendered_fields(serializer):
+    return [name for name, field in serializer.fields.items() if not field.write_only]
+
+
+class SparseFieldsMixin:
+    """Renders only the fields named in ?fields= (write-only fields stay).
+
+    Without the parameter, ``Meta.default_fields`` are rendered, or every
+    field when it isn't set.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        names = self.rendered_field_names()
+        if names is not None:
+            for name in rendered_fields(self):
+                if name not in names:
+                    self.fields.pop(name)
+
+    def rendered_field_names(self):
+        requested = requested_fields(self.context.get('request'))
+        if requested is None:
+            return getattr(self.Meta, 'default_fields', None)
+        unknown = requested - set(rendered_fields(self))
+        if unknown:
+            raise serializers.ValidationError({'fields': f"Unknown field(s): {', '.join(sorted(unknown))}."})
+        return requested
+
+
+class PostSerializer(TimedRepresentationMixin, SparseFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
-    comments_count = serializers.SerializerMethodField()
     tags = serializers.SerializerMethodField()
     category_names = serializers.SerializerMethodField()
+    # {size: {format: url}} once the background worker has made them, else null
+    image_variants = serializers.SerializerMethodField()
 
     tag_names = serializers.ListField(
         child=serializers.CharField(), write_only=True, required=False
@@ -104,15 +183,28 @@ class PostSerializer(serializers.ModelSerializer):
     class Meta:
         model = Post
         fields = [
-            'id', 'title', 'body', 'toc', 'image', 'status',
-            'view_count', 'created_at', 'updated_at', 'user',
+            'id', 'title', 'body', 'body_html', 'toc', 'excerpt', 'reading_time', 'image', 'image_variants',
+            'status', 'view_count', 'created_at', 'updated_at', 'user',
             'comments_count', 'tag_names', 'category_names_input',
             'category_names', 'tags'
         ]
-        read_only_fields = ['id', 'view_count', 'slug', 'created_at', 'updated_at', 'category_names']
+        read_only_fields = ['id', 'view_count', 'comments_count', 'slug', 'created_at', 'updated_at', 'category_names']
+
+    def rendered_field_names(self):
+        names = super().rendered_field_names()
+        request = self.context.get('request')
+        if requested_fields(request) is None:
+            # Unless named in ?fields=, body_html is opt-in with ?include=body_html
+            names = set(rendered_fields(self) if names is None else names) - {'body_html'}
+            if include_body_html(request):
+                names.add('body_html')
+        return names
 
-    def get_comments_count(self, obj):
-        return obj.comments.filter(status='APPROVED').count()
+    def validate_image(self, value):
+        return sanitize_image(value) if value else value
+
+    def get_image_variants(self, obj):
+        return variant_urls(obj.image_variants, obj.image, self.context.get('request'))
 
     def get_slug(self, obj):
         return SlugSerializer(
@@ -130,25 +222,128 @@ class PostSerializer(serializers.ModelSerializer):
         return [pc.category.name for pc in obj.post_categories.all()]
 
     def create(self, validated_data):
-        tag_names = validated_data.pop('tag_names', [])
-        category_names = validated_data.pop('category_names_input', [])
-        post = Post.objects.create(**validated_data)
+        tag_names = validated_data.pop('tag_names', None)
+        category_names = validated_data.pop('category_names_input', None)
+
+        with transaction.atomic():
+            post = Post.objects.create(**validated_data)
+            if tag_names:
+                set_post_tags(post, tag_names, replace=False)
+            if category_names:
+                set_post_categories(post, category_names, replace=False)
+
+        return post
 
-        for name in tag_names:
-            slug = generate_unique_slug(Tag, name)
-            tag, _ = Tag.objects.get_or_create(name=name, defaults={'slug': slug})
-            PostTag.objects.get_or_create(post=post, tag=tag)
+    def update(self, instance, validated_data):
+        # Omitted lists leave the relations untouched, given ones replace them
+        tag_names = validated_data.pop('tag_names', None)
+        category_names = validated_data.pop('category_names_input', None)
 
-        for name in category_names:
-            category, _ = Category.objects.get_or_create(name=name)
-            PostCategory.objects.get_or_create(post=post, category=category)
+        with transaction.atomic():
+            post = super().update(instance, validated_data)
+            if tag_names is not None:
+                set_post_tags(post, tag_names)
+            if category_names is not None:
+                set_post_categories(post, category_names)
 
         return post
 
 
+class PostListSerializer(PostSerializer):
+    """Post lists: excerpt and reading time instead of body and toc."""
+
+    class Meta(PostSerializer.Meta):
+        default_fields = [
+            'id', 'title', 'excerpt', 'reading_time', 'image', 'image_variants', 'status',
+            'view_count', 'created_at', 'updated_at', 'user', 'comments_count', 'category_names', 'tags',
+        ]
+
+
+class PostSearchSerializer(PostSerializer):
+    rank = serializers.FloatField(read_only=True)
+    # Escaped body excerpt with the matched terms wrapped in <mark>
+    snippet = serializers.SerializerMethodField()
+
+    class Meta(PostSerializer.Meta):
+        fields = PostSerializer.Meta.fields + ['rank', 'snippet']
+
+    def get_snippet(self, obj):
+        return snippet_html(obj.snippet)
+
 
+def _unique_names(names):
+    return list(dict.fromkeys(name.strip() for name in names if name.strip()))
 
-class CommentSerializer(serializers.ModelSerializer):
+
+def set_post_tags(post, names, replace=True):
+    """Attach the tags called ``names`` to the post with a fixed number of
+    queries; with ``replace`` other tags of the post are detached.
+
+    Existing tags are resolved in one query, missing ones are bulk-created
+    (with slugs allocated in one query) and join rows are bulk-inserted.
+    """
+    names = _unique_names(names)
+    tags = resolve_tags(names)
+
+    tag_ids = [tags[name].pk for name in names]
+    if replace:
+        PostTag.objects.filter(post=post).exclude(tag_id__in=tag_ids).delete()
+    PostTag.objects.bulk_create(
+        [PostTag(post=post, tag_id=tag_id) for tag_id in tag_ids], ignore_conflicts=True
+    )
+
+
+def resolve_tags(names, attempts=3):
+    """Map each name to a Tag, bulk-creating the missing ones."""
+    for attempt in range(attempts):
+        tags = {}
+        for tag in Tag.objects.filter(name__in=names).order_by('-pk'):
+            tags[tag.name] = tag  # the oldest tag wins if a name is duplicated
+
+        missing = [name for name in names if name not in tags]
+        if not missing:
+            return tags
+        slugs = allocate_unique_slugs(Tag, missing)
+        try:
+            with transaction.atomic():
+                created = Tag.objects.bulk_create(Tag(name=name, slug=slug) for name, slug in zip(missing, slugs))
+        except IntegrityError:
+            # A concurrent request created one of these tags or took a slug
+            if attempt == attempts - 1:
+                raise
+            continue
+        tags.update((tag.name, tag) for tag in created)
+        return tags
+
+
+def resolve_categories(names):
+    """Map each name to a Category, bulk-creating the missing ones."""
+    categories = {}
+    for category in Category.objects.filter(name__in=names).order_by('-pk'):
+        categories[category.name] = category
+
+    missing = [name for name in names if name not in categories]
+    if missing:
+        created = Category.objects.bulk_create(Category(name=name) for name in missing)
+        categories.update((category.name, category) for category in created)
+    return categories
+
+
+def set_post_categories(post, names, replace=True):
+    """Same as set_post_tags, for categories."""
+    names = _unique_names(names)
+    categories = resolve_categories(names)
+
+    category_ids = [categories[name].pk for name in names]
+    if replace:
+        PostCategory.objects.filter(post=post).exclude(category_id__in=category_ids).delete()
+    PostCategory.objects.bulk_create(
+        [PostCategory(post=post, category_id=category_id) for category_id in category_ids],
+        ignore_conflicts=True,
+    )
+
+
+class CommentSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)  # Include user info
     replies = serializers.SerializerMethodField()
 
@@ -163,15 +358,23 @@ class CommentSerializer(serializers.ModelSerializer):
 
 
     def get_replies(self, obj):
-        replies = obj.replies.filter(status='APPROVED')
-        return CommentSerializer(replies, many=True).data
-
-class TagSerializer(serializers.ModelSerializer):
+        # Thread mode: the view has already loaded the whole tree in one query
+        children = self.context.get('comment_children')
+        if children is None:
+            replies = obj.replies.filter(status='APPROVED')
+            return CommentSerializer(replies, many=True, context=self.context).data
+
+        depth = self.context.get('depth')
+        if depth is not None and getattr(obj, 'thread_level', 0) >= depth:
+            return []
+        return CommentSerializer(children.get(obj.id, []), many=True, context=self.context).data
+
+class TagSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     class Meta:
         model = Tag
         fields = ['id', 'name']
 
-class SlugSerializer(serializers.ModelSerializer):
+class SlugSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     class Meta:
         model = Tag
         fields = ['id', 'name']
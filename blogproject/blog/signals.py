@@ -0,0 +1,103 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .authentication import denylist, forget_cached_user
+from .cache import bump_version, invalidate
+from .images import needs_variants, schedule_variants
+from .models import Category, Comment, Post, PostCategory, PostTag, Tag, User
+from .metrics import count_queries
+from .moderation import schedule_moderation
+from .profiling import record_queries
+
+# User fields that issued tokens carry as claims (is_active is implied)
+CLAIM_FIELDS = ('user_name', 'role', 'is_staff', 'is_active')
+
+
+# Deletes go through the collector (cascades from parent comments or users)
+# without calling Comment.delete(), so the counter is maintained here.
+@receiver(post_delete, sender=Comment)
+def decrement_comments_count(sender, instance, **kwargs):
+    if instance.status == Comment.Status.APPROVED:
+        Post.adjust_comments_count(instance.post_id, -1)
+
+
+# New comments, and edited ones (CommentViewSet.perform_update)
+@receiver(post_save, sender=Comment)
+def queue_pending_comment(sender, instance, **kwargs):
+    if instance.status == Comment.Status.PENDING:
+        schedule_moderation(instance.pk)
+
+
+# Everything a cached post list/detail response is built from
+@receiver([post_save, post_delete], sender=Post)
+@receiver([post_save, post_delete], sender=Comment)
+@receiver([post_save, post_delete], sender=PostTag)
+@receiver([post_save, post_delete], sender=PostCategory)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=User)  # posts embed their author
+def invalidate_cached_posts(sender, **kwargs):
+    invalidate('posts')
+
+
+# Saves that change what's searchable go through update_search_vectors()
+@receiver(post_delete, sender=Post)
+def invalidate_search_index(sender, **kwargs):
+    invalidate('search')
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_cached_tags(sender, **kwargs):
+    invalidate('tags', 'posts')
+
+
+@receiver(pre_save, sender=User)
+def revoke_stale_tokens(sender, instance, update_fields=None, **kwargs):
+    if instance._state.adding:
+        return
+    user_id = instance.pk
+    transaction.on_commit(lambda: forget_cached_user(user_id))
+
+    if update_fields is not None and not set(CLAIM_FIELDS) & set(update_fields):
+        return
+    previous = User.objects.filter(pk=user_id).values_list(*CLAIM_FIELDS).first()
+    if previous is not None and previous != tuple(getattr(instance, field) for field in CLAIM_FIELDS):
+        # Outstanding tokens would keep the old role/staff flag until they expire
+        transaction.on_commit(lambda: denylist.revoke_user(user_id))
+
+
+@receiver(post_delete, sender=User)
+def revoke_deleted_user_tokens(sender, instance, **kwargs):
+    user_id = instance.pk
+    transaction.on_commit(lambda: (forget_cached_user(user_id), denylist.revoke_user(user_id)))
+
+
+@receiver(post_save, sender=Post)
+def generate_post_image_variants(sender, instance, **kwargs):
+    if needs_variants(instance.image, instance.image_variants):
+        post_id = instance.pk
+
+        def done():
+            # New representation, so a new ETag as well
+            Post.objects.filter(pk=post_id).update(updated_at=timezone.now())
+            bump_version('posts')
+
+        schedule_variants(Post, post_id, 'image', 'image_variants', done)
+
+
+@receiver(post_save, sender=User)
+def generate_profile_image_variants(sender, instance, **kwargs):
+    if needs_variants(instance.profile_image, instance.profile_image_variants):
+        # Posts embed their author
+        schedule_variants(User, instance.pk, 'profile_image', 'profile_image_variants', lambda: bump_version('posts'))
+
+
+# Queries are counted per request for /metrics, and timed only inside sampled
+# (profiled) requests; outside a request both wrappers just execute
+@receiver(connection_created)
+def install_query_recorders(sender, connection, **kwargs):
+    for wrapper in (count_queries, record_queries):
+        if wrapper not in connection.execute_wrappers:
+            connection.execute_wrappers.append(wrapper)
@@ -1,3 +1,1786 @@
-from django.test import TestCase
+import datetime
+import gzip
+import json
+import os
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from decimal import Decimal
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import http_date
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from PIL import Image
+
+from blogproject.database import connection_settings
+from blogproject.utils import extract_toc, render_markdown_with_toc
+
+from .authentication import denylist
+from .counters import PostCounterBuffer, post_counters
+from .metrics import metrics_registry, moderation_queue_depth
+from .middleware import brotli, negotiate_encoding
+from .moderation import ModerationQueue, moderate, moderation_settings, spam_score
+from .profiling import RequestProfile, current_profile, endpoint_stats, fingerprint
+from .renderers import ORJSONParser, ORJSONRenderer
+from .search import InvertedIndex, highlight, snippet_html
+from .serializers import CommentSerializer, PostSerializer
+from .utility import build_comment_tree, generate_unique_slug
+from .models import User, Post, PostQuerySet, Comment, Tag, PostTag, Category, PostCategory, PostLike, PostView
+
+
+# No background counter flushes, image or moderation workers while the test database is in use
+@override_settings(
+    POST_COUNTERS={'ENABLED': True, 'FLUSH_INTERVAL': None, 'MAX_PENDING': 1000},
+    IMAGE_VARIANTS={'WORKERS': 0},
+    MODERATION={'WORKERS': 0},
+    ASYNC_READS={'PARALLEL_QUERIES': False},  # other connections can't see the test transaction
+    RATE_LIMITS={'ENABLED': False},  # RateLimitTests turn them on
+)
+class BlogTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        # Cached responses would otherwise leak between tests
+        cache.clear()
+        # Buffered views refer to rows that are rolled back
+        self.addCleanup(post_counters.clear)
+
+
+def make_user(user_name='author'):
+    return User.objects.create_user(
+        email=f'{user_name}@example.com', user_name=user_name, password='pass12345'
+    )
+
+
+def make_post(user, title, tags=0, categories=0, comments=0, status=Post.Status.PUBLISHED):
+    post = Post.objects.create(user=user, title=title, body=f'# {title}\n\nbody', status=status)
+    for i in range(tags):
+        tag, _ = Tag.objects.get_or_create(name=f'tag{i}', defaults={'slug': f'tag{i}'})
+        PostTag.objects.create(post=post, tag=tag)
+    for i in range(categories):
+        category, _ = Category.objects.get_or_create(name=f'category{i}')
+        PostCategory.objects.create(post=post, category=category)
+    for i in range(comments):
+        Comment.objects.create(post=post, user=user, comment_body=f'comment {i}')
+    return post
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class PostListQueryCountTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def assert_constant_queries(self, url):
+        make_post(self.user, 'first', tags=1, categories=1, comments=1)
+        small = self.count_queries(url)
+
+        for i in range(10):
+            make_post(self.user, f'post {i}', tags=5, categories=3, comments=2)
+        large = self.count_queries(url)
+
+        self.assertEqual(small, large)
+
+    def test_post_list_query_count_is_constant(self):
+        self.assert_constant_queries(reverse('post-list'))
+
+    def test_posts_by_category_query_count_is_constant(self):
+        self.assert_constant_queries(reverse('posts-by-category') + '?category=CATEGORY0')
+
+    def test_posts_by_tag_query_count_is_constant(self):
+        self.assert_constant_queries(reverse('post-list-by-slug') + '?tag=tag0')
+
+    def test_comments_count_only_counts_approved(self):
+        post = make_post(self.user, 'counted', tags=2, comments=3)
+        Comment.objects.create(
+            post=post, user=self.user, comment_body='spam', status=Comment.Status.SPAM
+        )
+
+        response = self.client.get(reverse('post-detail', args=[post.pk]))
+
+        self.assertEqual(response.data['comments_count'], 3)
+        self.assertEqual(len(response.data['tags']), 2)
+
+
+class CommentThreadTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.post = make_post(self.user, 'thread')
+        self.url = reverse('post-comments-list', kwargs={'post_pk': self.post.pk})
+
+    def add_chain(self, length, parent=None):
+        for i in range(length):
+            parent = Comment.objects.create(
+                post=self.post, user=self.user, parent_comment=parent, comment_body=f'reply {i}'
+            )
+        return parent
+
+    def test_replies_are_nested_not_listed_at_top_level(self):
+        self.add_chain(3)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.data['count'], 1)
+        root = response.data['results'][0]
+        self.assertEqual(len(root['replies']), 1)
+        self.assertEqual(len(root['replies'][0]['replies']), 1)
+
+    def test_query_count_does_not_grow_with_nesting(self):
+        self.add_chain(2)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(self.url)
+
+        self.add_chain(20)
+        self.add_chain(5, parent=Comment.objects.filter(parent_comment=None).first())
+        with CaptureQueriesContext(connection) as large:
+            self.client.get(self.url)
+
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+    def test_depth_limits_nesting(self):
+        self.add_chain(4)
+
+        response = self.client.get(self.url, {'depth': 1})
+
+        root = response.data['results'][0]
+        self.assertEqual(len(root['replies']), 1)
+        self.assertEqual(root['replies'][0]['replies'], [])
+
+    def test_unapproved_reply_hides_its_subtree(self):
+        root = self.add_chain(1)
+        hidden = Comment.objects.create(
+            post=self.post, user=self.user, parent_comment=root,
+            comment_body='pending', status=Comment.Status.PENDING
+        )
+        self.add_chain(2, parent=hidden)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['results'][0]['replies'], [])
+
+
+class CommentsCountTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.post = make_post(self.user, 'counted')
+
+    def stored_count(self):
+        return Post.objects.get(pk=self.post.pk).comments_count
+
+    def test_counter_follows_create_status_change_and_delete(self):
+        comment = Comment.objects.create(post=self.post, user=self.user, comment_body='hi')
+        Comment.objects.create(
+            post=self.post, user=self.user, comment_body='wait', status=Comment.Status.PENDING
+        )
+        self.assertEqual(self.stored_count(), 1)
+
+        comment.status = Comment.Status.SPAM
+        comment.save()
+        self.assertEqual(self.stored_count(), 0)
+
+        comment.status = Comment.Status.APPROVED
+        comment.save()
+        comment.comment_body = 'edited'
+        comment.save()
+        self.assertEqual(self.stored_count(), 1)
+
+        comment.delete()
+        self.assertEqual(self.stored_count(), 0)
+
+    def test_moved_comments_are_counted_on_their_new_post(self):
+        comment = Comment.objects.create(post=self.post, user=self.user, comment_body='hi')
+        other = make_post(self.user, 'other')
+
+        comment.post = other
+        comment.save()
+
+        self.assertEqual(self.stored_count(), 0)
+        self.assertEqual(Post.objects.get(pk=other.pk).comments_count, 1)
+
+    def test_cascaded_reply_deletes_are_counted(self):
+        root = Comment.objects.create(post=self.post, user=self.user, comment_body='root')
+        Comment.objects.create(post=self.post, user=self.user, parent_comment=root, comment_body='reply')
+        self.assertEqual(self.stored_count(), 2)
+
+        root.delete()
+        self.assertEqual(self.stored_count(), 0)
+
+    def test_post_save_does_not_overwrite_counter(self):
+        Comment.objects.create(post=self.post, user=self.user, comment_body='hi')
+        self.post.title = 'renamed'
+        self.post.save()
+        self.assertEqual(self.stored_count(), 1)
+
+    def test_repair_command_fixes_drift(self):
+        Comment.objects.create(post=self.post, user=self.user, comment_body='hi')
+        Post.objects.filter(pk=self.post.pk).update(comments_count=42)
+
+        call_command('repair_comment_counts', batch_size=1, stdout=StringIO())
+
+        self.assertEqual(self.stored_count(), 1)
+
+
+class PostCounterTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.post = make_post(self.user, 'viewed')
+        self.buffer = PostCounterBuffer()
+
+    def test_increments_are_buffered_until_flush(self):
+        for _ in range(3):
+            self.buffer.increment_view(self.post.pk)
+        self.buffer.increment_like(self.post.pk)
+
+        self.assertEqual(Post.objects.get(pk=self.post.pk).view_count, 0)
+        self.assertEqual(self.buffer.flush(), 1)
+
+        self.assertEqual(Post.objects.get(pk=self.post.pk).view_count, 3)
+        post_view = PostView.objects.get(post=self.post)
+        self.assertEqual((post_view.view_count, post_view.like_count), (3, 1))
+        self.assertEqual(self.buffer.pending(), ({}, {}))
+
+    def test_likes_count_once_per_user(self):
+        url = reverse('post-like', args=[self.post.pk])
+        self.client.force_authenticate(self.user)
+
+        self.assertEqual(self.client.post(url).status_code, 202)
+        self.assertEqual(self.client.post(url).status_code, 200)
+        self.client.force_authenticate(make_user('other'))
+        self.assertEqual(self.client.post(url).status_code, 202)
+
+        self.assertEqual(post_counters.pending(), ({}, {self.post.pk: 2}))
+        self.assertEqual(PostLike.objects.filter(post=self.post).count(), 2)
+
+    def test_failed_flush_keeps_increments(self):
+        self.buffer.increment_view(self.post.pk)
+
+        with mock.patch.object(PostCounterBuffer, '_write', side_effect=DatabaseError), \
+                self.assertLogs('blog.counters', level='ERROR'):
+            self.buffer.flush()
+        self.assertEqual(self.buffer.pending(), ({self.post.pk: 1}, {}))
+
+        self.buffer.flush()
+        self.assertEqual(Post.objects.get(pk=self.post.pk).view_count, 1)
+
+    def test_retrieve_buffers_a_view(self):
+        with mock.patch('blog.views.post_counters', self.buffer):
+            self.client.get(reverse('post-detail', args=[self.post.pk]))
+
+        self.assertEqual(self.buffer.pending(), ({self.post.pk: 1}, {}))
+
+    def test_exit_flush_skips_increments_of_another_database(self):
+        self.buffer.increment_view(self.post.pk)
+
+        with mock.patch.dict(connection.settings_dict, NAME='other'), \
+                mock.patch.object(PostCounterBuffer, 'flush') as flush:
+            self.buffer.flush_at_exit()
+        flush.assert_not_called()
+
+        self.buffer.flush_at_exit()
+        self.assertEqual(Post.objects.get(pk=self.post.pk).view_count, 1)
+
+    def test_periodic_flush_closes_its_connection(self):
+        self.buffer.increment_view(self.post.pk)
+
+        with mock.patch('blog.counters.close_old_connections') as close:
+            self.buffer._flush_periodically()
+
+        close.assert_called_once()
+        self.assertEqual(self.buffer.pending(), ({}, {}))
+
+    @override_settings(POST_COUNTERS={'ENABLED': False})
+    def test_disabled_counting_is_a_no_op(self):
+        self.buffer.increment_view(self.post.pk)
+
+        self.assertEqual(self.buffer.pending(), ({}, {}))
+
+
+TOC_CORPUS = [
+    '',
+    '# Title\n\ntext\n\n## Sub *emph* and **bold**\n\n### `code` & <stuff>\n',
+    'Setext\n======\n\nSecond\n------\n',
+    '    # indented code\n\n```\n# inside backticks\n```\n',
+    '<h2 class="raw">Raw &amp; HTML</h2>\n\n# After raw\n',
+    '<!-- <h1>hidden</h1> -->\n\n# Visible\n',
+    '<div>\n<h3>In a div</h3>\n</div>\n\nPara with <h4>inline heading</h4> inside.\n',
+    '# Link [here](http://example.com), [ref][r] and ![img](a.png)\n\n[r]: http://example.com\n',
+    '## Ünïcödé — ‘quotes’ 日本語\n',
+    '#    Spaces   around   #\n\n# a&nbsp;b &copy; &#169; 2 < 3\n',
+    '> # Quoted\n> > ## Nested <em>quote</em>\n\n- # In a list\n1. ### Numbered\n',
+    '#NoSpace\n\n####### seven\n\n# Escaped \\*star\\* and snake_case_name\n',
+    '`<h2>in a code span</h2>`\n\n# auto <http://example.com> link\n',
+    '<h1>outer <h2>inner</h2></h1>\n',
+    '# a <h2>nested</h2> b\n',
+    '<script>document.write("<h1>s</h1>")</script>\n\n# After script\n',
+    '<h1 title="a>b">attr gt</h1>\n',
+    '<h2 id="kept">Own id</h2>\n\n<h3/>\n\n<h4>unclosed\n\ntext after\n',
+    '\n\n'.join(f'## Section {i} with *emphasis*\n\n' + 'lorem ipsum dolor ' * 50 for i in range(100)),
+]
+
+
+class TocExtractionTests(BlogTestCase):
+    def test_toc_matches_extract_toc(self):
+        for markdown_text in TOC_CORPUS:
+            with self.subTest(markdown_text=markdown_text[:40]):
+                self.assertEqual(render_markdown_with_toc(markdown_text)[1], extract_toc(markdown_text))
+
+    def test_heading_ids_are_added_inside_the_start_tag(self):
+        html, _ = render_markdown_with_toc('<h1 title="a>b">attr gt</h1>\n\n<h2 id="kept">Own id</h2>\n')
+
+        self.assertIn('<h1 title="a&gt;b" id="attr-gt">attr gt</h1>', html)
+        self.assertIn('<h2 id="kept">Own id</h2>', html)
+
+    def test_toc_is_only_extracted_when_body_changes(self):
+        post = make_post(make_user(), 'toc')
+        self.assertEqual(post.toc[0]['slug'], 'toc')
+
+        with mock.patch('blog.models.render_markdown_with_toc', return_value=('', [])) as render:
+            post.status = Post.Status.DRAFT
+            post.save()
+            render.assert_not_called()
+
+            post.body = '# Changed'
+            post.save(update_fields=['body'])
+            render.assert_called_once_with('# Changed')
+
+
+class BodyHtmlTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = make_post(make_user(), 'Rendered Title')
+
+    def test_heading_ids_match_toc_slugs(self):
+        html, toc = render_markdown_with_toc('# Intro\n\ntext\n\n## Next *step*\n')
+
+        self.assertEqual(toc, extract_toc('# Intro\n\ntext\n\n## Next *step*\n'))
+        self.assertIn('<h1 id="intro">Intro</h1>', html)
+        self.assertIn(f'<h2 id="{toc[1]["slug"]}">Next <em>step</em></h2>', html)
+
+    def test_body_html_is_opt_in(self):
+        url = reverse('post-detail', args=[self.post.pk])
+
+        self.assertNotIn('body_html', self.client.get(url).data)
+        response = self.client.get(url, {'include': 'body_html'})
+        self.assertIn('<h1 id="rendered-title">', response.data['body_html'])
+
+    def test_html_endpoint_serves_rendered_body(self):
+        response = self.client.get(reverse('post-html', args=[self.post.pk]))
+
+        self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+        self.assertEqual(response.content.decode(), self.post.body_html)
+        self.assertEqual(response['Content-Security-Policy'], 'sandbox')
+        self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+
+    def test_raw_html_is_sanitized(self):
+        html, toc = render_markdown_with_toc(
+            '# Title\n\n<script>alert(1)</script>\n\n<img src=x onerror=alert(1)> '
+            '[link](javascript:alert(1)) <a href="/ok" onclick="alert(1)">ok</a>\n\n<h2 id="own">Own</h2>\n'
+        )
+
+        self.assertNotIn('<script', html)
+        self.assertNotIn('onerror', html)
+        self.assertNotIn('onclick', html)
+        self.assertNotIn('javascript:', html)
+        self.assertIn('<img src="x">', html)
+        self.assertIn('<h1 id="title">Title</h1>', html)
+        self.assertIn('<h2 id="own">Own</h2>', html)
+        self.assertEqual([entry['slug'] for entry in toc], ['title', 'own'])
+
+
+class SlugAllocationTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+
+    def test_suffix_continues_after_highest_existing(self):
+        slugs = [make_post(self.user, 'Weekly update').slug for _ in range(12)]
+
+        self.assertEqual(slugs[:3], ['weekly-update', 'weekly-update-1', 'weekly-update-2'])
+        self.assertEqual(slugs[-1], 'weekly-update-11')
+        self.assertEqual(make_post(self.user, 'Weekly update notes').slug, 'weekly-update-notes')
+
+    def test_slug_allocation_is_a_single_query(self):
+        for _ in range(5):
+            make_post(self.user, 'Same title')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(generate_unique_slug(Post, 'Same title'), 'same-title-5')
+
+    def test_suffixed_slugs_respect_max_length(self):
+        title = 'long ' * 40
+        slugs = [make_post(self.user, title).slug for _ in range(3)]
+
+        self.assertEqual(len(set(slugs)), 3)
+        self.assertTrue(all(len(slug) <= 100 for slug in slugs))
+
+    def test_save_retries_when_slug_is_taken_concurrently(self):
+        make_post(self.user, 'Raced')
+        real = generate_unique_slug
+        calls = iter(['raced', None])
+
+        def stale_then_real(model, value):
+            return next(calls) or real(model, value)
+
+        with mock.patch('blog.utility.generate_unique_slug', side_effect=stale_then_real):
+            post = make_post(self.user, 'Raced')
+
+        self.assertEqual(post.slug, 'raced-1')
+
+
+@skipIf(connection.vendor == 'sqlite', 'SQLite locks whole tables for concurrent writers')
+class ConcurrentSlugTests(TransactionTestCase):
+    def test_parallel_posts_with_the_same_title_get_unique_slugs(self):
+        user = make_user()
+
+        def create(_):
+            try:
+                return make_post(user, 'Parallel').slug
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            slugs = list(pool.map(create, range(24)))
+
+        self.assertEqual(len(set(slugs)), 24)
+
+
+class PostTagAttachmentTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.client.force_authenticate(self.user)
+
+    def create_post(self, tags, categories):
+        data = {'title': 'Tagged', 'body': '# Tagged', 'tag_names': tags, 'category_names_input': categories}
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('post-list'), data)
+        self.assertEqual(response.status_code, 201, response.data)
+        return Post.objects.get(pk=response.data['id']), len(ctx.captured_queries)
+
+    def test_query_count_does_not_depend_on_tag_count(self):
+        _, few = self.create_post(['a'], ['x'])
+        _, many = self.create_post([f'tag {i}' for i in range(10)] + ['a'], ['x', 'y', 'z'])
+
+        self.assertEqual(few, many)
+
+    def test_existing_tags_are_reused_and_slugs_stay_unique(self):
+        Tag.objects.create(name='Other', slug='python')
+        post, _ = self.create_post(['Python', 'Python', 'django'], ['Web'])
+        second, _ = self.create_post(['Python'], ['Web'])
+
+        self.assertEqual(sorted(Tag.objects.values_list('slug', flat=True)), ['django', 'python', 'python-1'])
+        self.assertEqual(post.post_tags.count(), 2)
+        self.assertEqual(second.post_tags.get().tag.slug, 'python-1')
+        self.assertEqual(Category.objects.count(), 1)
+
+    def test_update_replaces_tags_and_categories(self):
+        post, _ = self.create_post(['keep', 'drop'], ['old'])
+        url = reverse('post-detail', args=[post.pk])
+
+        self.client.patch(url, {'title': 'Renamed'})
+        self.assertEqual(post.post_tags.count(), 2)
+
+        self.client.patch(url, {'tag_names': ['keep', 'new'], 'category_names_input': ['fresh']})
+        self.assertEqual(
+            sorted(post.post_tags.values_list('tag__name', flat=True)), ['keep', 'new']
+        )
+        self.assertEqual(list(post.post_categories.values_list('category__name', flat=True)), ['fresh'])
+
+    def test_failed_attachment_rolls_back_the_post(self):
+        with mock.patch('blog.serializers.set_post_categories', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.client.post(
+                    reverse('post-list'),
+                    {'title': 'Broken', 'body': 'x', 'tag_names': ['a'], 'category_names_input': ['b']},
+                )
+
+        self.assertFalse(Post.objects.filter(title='Broken').exists())
+        self.assertFalse(PostTag.objects.exists())
+
+
+class PostTransferTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        post = make_post(self.user, 'Exported', tags=2, categories=1)
+        root = Comment.objects.create(post=post, user=self.user, comment_body='root')
+        Comment.objects.create(post=post, user=self.user, parent_comment=root, comment_body='reply')
+        Comment.objects.create(
+            post=post, user=self.user, comment_body='spam', status=Comment.Status.SPAM
+        )
+        make_post(self.user, 'Second', tags=1)
+
+    def round_trip(self, fmt):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), f'posts.{fmt}')
+        call_command('export_posts', path, stderr=StringIO())
+        call_command('import_posts', path, workers=0, batch_size=1, stderr=StringIO())
+        return Post.objects.get(slug='exported-1')
+
+    def assert_copied(self, copy):
+        original = Post.objects.get(slug='exported')
+        self.assertEqual(copy.toc, original.toc)
+        self.assertEqual(copy.body_html, original.body_html)
+        self.assertEqual(copy.created_at, original.created_at)
+        self.assertEqual(copy.comments_count, 2)
+        self.assertEqual(
+            sorted(copy.post_tags.values_list('tag__name', flat=True)), ['tag0', 'tag1']
+        )
+        self.assertEqual(copy.post_categories.get().category.name, 'category0')
+        reply = copy.comments.get(comment_body='reply')
+        self.assertEqual(reply.parent_comment.comment_body, 'root')
+        self.assertEqual(Tag.objects.count(), 2)
+
+    def test_jsonl_round_trip(self):
+        self.assert_copied(self.round_trip('jsonl'))
+
+    def test_csv_round_trip(self):
+        self.assert_copied(self.round_trip('csv'))
+
+    def test_unknown_author_needs_a_default(self):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'posts.jsonl')
+        with open(path, 'w') as stream:
+            stream.write('{"title": "Legacy", "body": "# Legacy", "author": "ghost"}\n')
+
+        with self.assertRaises(CommandError):
+            call_command('import_posts', path, workers=0, stderr=StringIO())
+        call_command('import_posts', path, workers=0, default_author='author', stderr=StringIO())
+
+        self.assertEqual(Post.objects.get(slug='legacy').user, self.user)
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class KeysetPaginationTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+
+    def walk(self, url, params):
+        seen, queries = [], []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            seen.extend(item['id'] for item in response.data['results'])
+            if not response.data['next']:
+                return seen, queries
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(response.data['next'])
+            queries.append([query['sql'] for query in ctx.captured_queries])
+
+    def test_post_pages_cover_every_post_with_constant_queries(self):
+        posts = [make_post(self.user, f'post {i}', tags=2) for i in range(11)]
+        # Identical timestamps must still be paged by id
+        Post.objects.filter(pk__in=[p.pk for p in posts[:4]]).update(created_at=posts[0].created_at)
+
+        seen, queries = self.walk(reverse('post-list'), {'pagination': 'cursor', 'page_size': 2})
+
+        expected = Post.objects.order_by('-created_at', '-id').values_list('id', flat=True)
+        self.assertEqual(seen, list(expected))
+        self.assertEqual(len({len(page_queries) for page_queries in queries}), 1)
+        self.assertFalse(any('COUNT(' in sql for page_queries in queries for sql in page_queries))
+
+    def test_page_numbers_stay_the_default(self):
+        make_post(self.user, 'only')
+
+        response = self.client.get(reverse('posts-by-category'))
+
+        self.assertEqual(response.data['count'], 1)
+
+    def test_comment_threads_page_by_cursor(self):
+        post = make_post(self.user, 'thread')
+        roots = [Comment.objects.create(post=post, user=self.user, comment_body=f'root {i}') for i in range(5)]
+        reply = Comment.objects.create(post=post, user=self.user, parent_comment=roots[0], comment_body='late reply')
+        nested = Comment.objects.create(post=post, user=self.user, parent_comment=reply, comment_body='nested')
+        url = reverse('post-comments-list', kwargs={'post_pk': post.pk})
+        # Newer than the first page's threads, but in another thread
+        other = Comment.objects.create(post=post, user=self.user, parent_comment=roots[4], comment_body='other')
+
+        with mock.patch('blog.views.build_comment_tree', wraps=build_comment_tree) as build:
+            response = self.client.get(url, {'pagination': 'cursor', 'page_size': 2})
+        self.assertEqual([c['id'] for c in response.data['results']], [roots[0].pk, roots[1].pk])
+        self.assertEqual(response.data['results'][0]['replies'][0]['replies'][0]['id'], nested.pk)
+        loaded = {comment.pk for comment in build.call_args.args[0]}
+        self.assertIn(nested.pk, loaded)
+        self.assertNotIn(other.pk, loaded)
+
+        response = self.client.get(url, {'pagination': 'cursor', 'page_size': 2, 'depth': 1})
+        self.assertEqual(response.data['results'][0]['replies'][0]['replies'], [])
+
+        seen, _ = self.walk(url, {'pagination': 'cursor', 'page_size': 2})
+        self.assertEqual(seen, [root.pk for root in roots])
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get(reverse('post-list'), {'cursor': 'garbage'})
+
+        self.assertEqual(response.status_code, 404)
+
+
+class ResponseCacheTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.post = make_post(self.user, 'Cached', tags=1, categories=1)
+
+    def assert_served_from_cache(self, url, params=None):
+        first = self.client.get(url, params)
+        with self.assertNumQueries(0):
+            second = self.client.get(url, params)
+        self.assertEqual(first.data, second.data)
+        return first
+
+    def test_anonymous_reads_are_cached(self):
+        self.assert_served_from_cache(reverse('post-list'))
+        self.assert_served_from_cache(reverse('tag-list'))
+        self.assert_served_from_cache(reverse('posts-by-category'), {'category': 'category0'})
+        self.assert_served_from_cache(reverse('post-list-by-slug'), {'tag': 'tag0'})
+
+    def test_cached_responses_keep_their_validators(self):
+        url = reverse('post-detail', args=[self.post.pk])
+        etag = self.assert_served_from_cache(url)['ETag']
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url)['ETag'], etag)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_query_parameters_are_part_of_the_key(self):
+        make_post(self.user, 'Draft', status=Post.Status.DRAFT)
+        url = reverse('post-list')
+
+        self.client.get(url, {'ordering': 'created_at'})
+        newest_first = self.client.get(url, {'ordering': '-created_at'})
+
+        self.assertEqual(newest_first.data['results'][0]['title'], 'Draft')
+
+    def test_comment_invalidates_post_responses(self):
+        url = reverse('post-detail', args=[self.post.pk])
+        self.assertEqual(self.client.get(url).data['comments_count'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(post=self.post, user=self.user, comment_body='hi')
+
+        self.assertEqual(self.client.get(url).data['comments_count'], 1)
+
+    def test_post_tag_change_invalidates_tag_filtered_lists(self):
+        url = reverse('post-list-by-slug')
+        self.assertEqual(self.client.get(url, {'tag': 'tag0'}).data['count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PostTag.objects.filter(post=self.post).delete()
+
+        self.assertEqual(self.client.get(url, {'tag': 'tag0'}).data['count'], 0)
+
+    def test_authenticated_reads_bypass_the_cache(self):
+        url = reverse('post-list')
+        self.client.get(url)
+        self.client.force_authenticate(self.user)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(url)
+
+        self.assertTrue(ctx.captured_queries)
+
+    def test_file_backend(self):
+        location = self.enterContext(tempfile.TemporaryDirectory())
+        file_cache = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}}
+
+        with override_settings(CACHES=file_cache):
+            self.assert_served_from_cache(reverse('post-detail', args=[self.post.pk]))
+            self.assertTrue(os.listdir(location))
+
+
+class ConditionalGetTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.post = make_post(self.user, 'Validated')
+        self.detail = reverse('post-detail', args=[self.post.pk])
+        self.comments = reverse('post-comments-list', kwargs={'post_pk': self.post.pk})
+
+    def assert_revalidates(self, url):
+        response = self.client.get(url)
+        self.assertIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+
+        with mock.patch.object(PostSerializer, 'to_representation') as serialize, \
+                mock.patch.object(CommentSerializer, 'to_representation') as serialize_comment:
+            revalidated = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            serialize.assert_not_called()
+            serialize_comment.assert_not_called()
+        self.assertEqual(revalidated.status_code, 304)
+
+        return response['ETag']
+
+    def test_post_detail_list_and_comments_answer_304(self):
+        Comment.objects.create(post=self.post, user=self.user, comment_body='hi')
+        for url in (self.detail, reverse('post-list'), self.comments):
+            with self.subTest(url=url):
+                self.assert_revalidates(url)
+
+    def test_deleting_a_comment_is_not_hidden_by_if_modified_since(self):
+        comment = Comment.objects.create(post=self.post, user=self.user, comment_body='hi')
+        self.client.get(self.detail)
+        with self.captureOnCommitCallbacks(execute=True):
+            comment.delete()
+
+        response = self.client.get(self.detail, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['comments_count'], 0)
+
+    def test_new_comment_changes_the_etag(self):
+        etag = self.assert_revalidates(self.detail)
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(post=self.post, user=self.user, comment_body='hi')
+
+        response = self.client.get(self.detail, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['comments_count'], 1)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_edited_comment_changes_the_comment_list_etag(self):
+        comment = Comment.objects.create(post=self.post, user=self.user, comment_body='hi')
+        etag = self.assert_revalidates(self.comments)
+        comment.comment_body = 'edited'
+        comment.save()
+
+        response = self.client.get(self.comments, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['comment_body'], 'edited')
+
+    def test_changes_to_embedded_objects_change_the_etag(self):
+        tag = Tag.objects.create(name='old', slug='old')
+        PostTag.objects.create(post=self.post, tag=tag)
+
+        def rename_tag():
+            tag.name = 'new'
+            tag.save()
+
+        def rename_author():
+            self.user.user_name = 'renamed'
+            self.user.save()
+
+        for change in (rename_tag, rename_author):
+            with self.subTest(change=change.__name__):
+                etag = self.assert_revalidates(self.detail)
+                with self.captureOnCommitCallbacks(execute=True):
+                    change()
+
+                self.assertEqual(self.client.get(self.detail, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    @override_settings(RESPONSE_CACHE={'ENABLED': False})
+    def test_flushed_views_change_the_etag(self):
+        etag = self.assert_revalidates(self.detail)
+        post_counters.flush()
+
+        response = self.client.get(self.detail, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(response.data['view_count'], 0)
+
+    def test_query_parameters_change_the_etag(self):
+        etag = self.client.get(self.detail)['ETag']
+
+        response = self.client.get(self.detail, {'include': 'body_html'}, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_post_is_still_404(self):
+        self.assertEqual(self.client.get(reverse('post-detail', args=[999])).status_code, 404)
+        self.assertEqual(self.client.get('/api/posts/abc/').status_code, 404)
+
+
+class PostSearchTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.url = reverse('post-search')
+        self.title_match = Post.objects.create(
+            user=self.user, title='Tuning Postgres', body='Notes on indexes.', status=Post.Status.PUBLISHED
+        )
+        self.heading_match = Post.objects.create(
+            user=self.user, title='Databases', body='# Postgres setup\n\nInstall it.', status=Post.Status.PUBLISHED
+        )
+        self.body_match = Post.objects.create(
+            user=self.user, title='Misc', body='We also tried postgres once, among other things.',
+            status=Post.Status.PUBLISHED,
+        )
+        Post.objects.create(user=self.user, title='Postgres draft', body='postgres', status=Post.Status.DRAFT)
+
+    def search(self, query):
+        response = self.client.get(self.url, {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_ranks_title_over_headings_over_body(self):
+        data = self.search('postgres')
+
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(
+            [post['id'] for post in data['results']],
+            [self.title_match.pk, self.heading_match.pk, self.body_match.pk],
+        )
+        ranks = [post['rank'] for post in data['results']]
+        self.assertEqual(ranks, sorted(ranks, reverse=True))
+
+    def test_snippet_highlights_matches(self):
+        data = self.search('Postgres')
+
+        snippets = {post['id']: post['snippet'] for post in data['results']}
+        self.assertIn('tried <mark>postgres</mark> once', snippets[self.body_match.pk])
+
+    def test_snippet_text_is_escaped(self):
+        snippet = snippet_html(highlight('<img src=x onerror=alert(1)> foo &amp', ['foo', 'amp']))
+
+        self.assertEqual(snippet, '&lt;img src=x onerror=alert(1)&gt; <mark>foo</mark> &amp;<mark>amp</mark>')
+
+    def test_search_vector_is_only_recomputed_for_title_or_body_changes(self):
+        post = Post.objects.get(pk=self.body_match.pk)
+        with mock.patch.object(PostQuerySet, 'update_search_vectors') as update:
+            post.status = Post.Status.DRAFT
+            post.save()
+            post.title = 'Misc'
+            post.save()
+            update.assert_not_called()
+
+            post.title = 'Renamed'
+            post.save()
+            post.body = 'Changed body'
+            post.save(update_fields=['body'])
+            self.assertEqual(update.call_count, 2)
+
+    def test_every_term_must_match(self):
+        data = self.search('postgres install')
+
+        self.assertEqual([post['id'] for post in data['results']], [self.heading_match.pk])
+        self.assertEqual(self.search('postgres mysql')['count'], 0)
+
+    def test_new_posts_are_found_after_commit(self):
+        self.assertEqual(self.search('sqlite')['count'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post = make_post(self.user, 'Sqlite tricks')
+
+        self.assertEqual([result['id'] for result in self.search('sqlite')['results']], [post.pk])
+
+    def test_query_is_required(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+
+    def test_fallback_index_is_only_rebuilt_for_searchable_changes(self):
+        self.search('postgres')
+        post = Post.objects.get(pk=self.body_match.pk)
+
+        with mock.patch.object(InvertedIndex, 'build', autospec=True, side_effect=InvertedIndex.build) as build:
+            with self.captureOnCommitCallbacks(execute=True):
+                post.status = Post.Status.DRAFT
+                post.save()
+            self.assertEqual(self.search('postgres')['count'], 2)
+            build.assert_not_called()
+
+            with self.captureOnCommitCallbacks(execute=True):
+                post.title = 'Postgres notes'
+                post.status = Post.Status.PUBLISHED
+                post.save()
+            self.assertEqual(self.search('postgres')['count'], 3)
+            build.assert_called_once()
+
+
+class TokenAuthenticationTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        denylist.clear()
+        self.addCleanup(denylist.clear)
+        self.user = make_user()
+
+    def login(self, url_name='custom_token_obtain'):
+        response = self.client.post(reverse(url_name), {'user_name': 'author', 'password': 'pass12345'})
+        self.assertEqual(response.status_code, 200)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        return response.data
+
+    def user_lookups(self, method, url, data=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url, data)
+        self.assertLess(response.status_code, 300, response.data)
+        return sum('FROM "blog_user"' in query['sql'] for query in ctx.captured_queries)
+
+    def test_claims_authenticate_without_a_user_query(self):
+        self.login()
+
+        self.assertEqual(self.user_lookups('get', reverse('post-list')), 0)
+        self.user_lookups('post', reverse('post-list'), {'title': 'First', 'body': 'x'})
+        # Assigning the author uses the cached instance from the first write
+        self.assertEqual(self.user_lookups('post', reverse('post-list'), {'title': 'Second', 'body': 'x'}), 0)
+        self.assertEqual(Post.objects.filter(user=self.user).count(), 2)
+
+    def test_tokens_without_claims_use_the_cached_lookup(self):
+        self.login('token_obtain_pair')
+
+        self.assertEqual(self.user_lookups('get', reverse('post-list')), 1)
+        self.assertEqual(self.user_lookups('get', reverse('post-list')), 0)
+
+    def test_logout_revokes_the_tokens(self):
+        tokens = self.login()
+
+        response = self.client.post(reverse('auth_logout'), {'refresh': tokens['refresh']})
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get(reverse('post-list')).status_code, 401)
+        self.client.credentials()
+        refreshed = self.client.post(reverse('custom_token_refresh'), {'refresh': tokens['refresh']})
+        self.assertEqual(refreshed.status_code, 401)
+
+    def test_claim_changes_revoke_outstanding_tokens(self):
+        issued_at = AccessToken(self.login()['access'])['iat']
+        # Later in the second the token was issued
+        with mock.patch('blog.authentication.time.time', return_value=issued_at + 0.9), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.user.role = User.Role.ADMIN
+            self.user.save()
+
+        self.assertEqual(self.client.get(reverse('post-list')).status_code, 401)
+
+
+class ImageVariantTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.user = make_user()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, size=(1200, 800), name='photo.jpg'):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # orientation: rotate 90 degrees
+        exif[0x010F] = 'Camera maker'
+        output = BytesIO()
+        Image.new('RGB', size, 'red').save(output, format='JPEG', exif=exif)
+        return SimpleUploadedFile(name, output.getvalue(), content_type='image/jpeg')
+
+    def create_post(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('post-list'), {'title': 'Photo', 'body': 'x', 'image': image})
+        return response
+
+    def test_upload_is_stripped_and_variants_are_exposed(self):
+        response = self.create_post(self.upload())
+        self.assertEqual(response.status_code, 201, response.data)
+        post = Post.objects.get(pk=response.data['id'])
+
+        with default_storage.open(post.image.name) as stored, Image.open(stored) as image:
+            self.assertEqual(len(image.getexif()), 0)
+            self.assertEqual(image.size, (800, 1200))  # orientation applied
+
+        variants = self.client.get(reverse('post-detail', args=[post.pk])).data['image_variants']
+        self.assertEqual(set(variants), {'thumb', 'medium'})
+        self.assertEqual(set(variants['thumb']), {'webp', 'avif'})
+        name = post.image_variants['variants']['thumb']['webp']
+        with default_storage.open(name) as stored, Image.open(stored) as thumb:
+            self.assertEqual(thumb.format, 'WEBP')
+            self.assertEqual(max(thumb.size), 320)
+
+    def test_oversized_originals_are_scaled_down(self):
+        with override_settings(IMAGE_VARIANTS={'WORKERS': 0, 'MAX_DIMENSION': 500}):
+            response = self.create_post(self.upload())
+
+        with default_storage.open(Post.objects.get(pk=response.data['id']).image.name) as stored:
+            self.assertEqual(max(Image.open(stored).size), 500)
+
+    def test_animated_uploads_are_stripped_and_scaled_frame_by_frame(self):
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera maker'
+        frames = [Image.new('RGB', (1200, 800), color) for color in ('red', 'green', 'blue')]
+        output = BytesIO()
+        frames[0].save(output, format='WEBP', save_all=True, append_images=frames[1:], duration=100, exif=exif)
+        upload = SimpleUploadedFile('animation.webp', output.getvalue(), content_type='image/webp')
+
+        with override_settings(IMAGE_VARIANTS={'WORKERS': 0, 'MAX_DIMENSION': 500}):
+            response = self.create_post(upload)
+
+        self.assertEqual(response.status_code, 201, response.data)
+        with default_storage.open(Post.objects.get(pk=response.data['id']).image.name) as stored:
+            image = Image.open(stored)
+            self.assertEqual(image.n_frames, 3)
+            self.assertEqual(image.size, (500, 333))
+            self.assertEqual(len(image.getexif()), 0)
+
+    def test_animation_frame_cap(self):
+        frames = [Image.new('RGB', (10, 10), color) for color in ('red', 'green', 'blue')]
+        output = BytesIO()
+        frames[0].save(output, format='GIF', save_all=True, append_images=frames[1:])
+        upload = SimpleUploadedFile('animation.gif', output.getvalue(), content_type='image/gif')
+
+        with override_settings(IMAGE_VARIANTS={'WORKERS': 0, 'MAX_FRAMES': 2}):
+            response = self.create_post(upload)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+
+    def test_decompression_bombs_are_rejected(self):
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 1000):
+            response = self.create_post(self.upload())
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+
+    def test_truncated_uploads_are_rejected(self):
+        image = self.upload()
+        truncated = SimpleUploadedFile('photo.jpg', image.read()[:2000], content_type='image/jpeg')
+
+        response = self.create_post(truncated)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+
+    def test_upload_size_cap(self):
+        with override_settings(IMAGE_VARIANTS={'WORKERS': 0, 'MAX_UPLOAD_BYTES': 100}):
+            response = self.create_post(self.upload())
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+
+    def test_replaced_image_hides_old_variants(self):
+        post = Post.objects.get(pk=self.create_post(self.upload()).data['id'])
+
+        post.image = self.upload(name='other.jpg')
+        post.save()  # variants are generated on commit, which never comes here
+
+        self.assertIsNone(self.client.get(reverse('post-detail', args=[post.pk])).data['image_variants'])
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class AsyncReadTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.posts = [make_post(self.user, f'Post {i}', tags=2, categories=1, comments=2) for i in range(8)]
+        root = Comment.objects.filter(post=self.posts[0]).first()
+        Comment.objects.create(post=self.posts[0], user=self.user, parent_comment=root, comment_body='reply')
+
+    def assert_same_response(self, sync_url, async_url, params=None):
+        expected = self.client.get(sync_url, params)
+        response = self.client.get(async_url, params)
+        self.assertEqual(response.status_code, expected.status_code)
+        # Pagination links point at the endpoint itself
+        self.assertEqual(json.loads(response.content.decode().replace('/api/async/', '/api/')), expected.json())
+        return response
+
+    def test_responses_match_the_sync_endpoints(self):
+        post = self.posts[0]
+        cases = [
+            ('post-list', 'async-post-list', {}, {}),
+            ('post-list', 'async-post-list', {}, {'page': 2, 'ordering': 'comments_count'}),
+            ('post-detail', 'async-post-detail', {'pk': post.pk}, {'include': 'body_html'}),
+            ('post-comments-list', 'async-post-comments', {'post_pk': post.pk}, {'depth': 0}),
+            ('tag-list', 'async-tag-list', {}, {'page_size': 1, 'page': 2}),
+        ]
+        for sync_name, async_name, kwargs, params in cases:
+            with self.subTest(async_name, params=params):
+                self.assert_same_response(
+                    reverse(sync_name, kwargs=kwargs), reverse(async_name, kwargs=kwargs), params
+                )
+
+    def test_errors_match_the_sync_endpoints(self):
+        self.assert_same_response(reverse('post-detail', args=[999]), reverse('async-post-detail', args=[999]))
+        self.assert_same_response(reverse('post-list'), reverse('async-post-list'), {'page': 9})
+        comments = {'post_pk': self.posts[0].pk}
+        self.assert_same_response(
+            reverse('post-comments-list', kwargs=comments), reverse('async-post-comments', kwargs=comments),
+            {'depth': -1},
+        )
+
+    def test_list_queries_do_not_grow_with_the_page(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('async-post-list'))
+        # count, page, user join included, tags, categories
+        self.assertEqual(len(ctx.captured_queries), 4)
+
+    def test_detail_counts_the_view(self):
+        post = self.posts[0]
+        with mock.patch.object(post_counters, 'increment_view') as increment_view:
+            self.client.get(reverse('async-post-detail', args=[post.pk]))
+
+        increment_view.assert_called_once_with(post.pk)
+
+
+class ConnectionSettingsTests(SimpleTestCase):
+    def test_modes(self):
+        self.assertEqual(connection_settings('none'), {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False})
+        self.assertEqual(
+            connection_settings('persistent', max_age=30), {'CONN_MAX_AGE': 30, 'CONN_HEALTH_CHECKS': True}
+        )
+        with self.assertRaises(ImproperlyConfigured):
+            connection_settings('sometimes')
+
+    def test_pool_is_sized_per_worker(self):
+        try:
+            config = connection_settings('pool', pool_min_size=1, pool_max_size=8)
+        except ImproperlyConfigured:
+            self.skipTest('psycopg 3 is not installed')
+        self.assertEqual(config['CONN_MAX_AGE'], 0)
+        self.assertEqual((config['OPTIONS']['pool']['min_size'], config['OPTIONS']['pool']['max_size']), (1, 8))
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class SparseFieldsetTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        body = '# Long read\n\n' + ' '.join(f'word{i}' for i in range(998))
+        self.post = Post.objects.create(user=self.user, title='Long read', body=body, status=Post.Status.PUBLISHED)
+
+    def test_excerpt_and_reading_time_are_stored(self):
+        self.assertEqual(self.post.reading_time, 5)
+        self.assertTrue(self.post.excerpt.startswith('Long read word0 word1'))
+        self.assertLessEqual(len(self.post.excerpt), 281)
+        self.assertTrue(self.post.excerpt.endswith('…'))
+
+        self.post.body = 'Short'
+        self.post.save(update_fields=['body'])
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.excerpt, self.post.reading_time), ('Short', 1))
+
+    def test_lists_render_the_lean_representation(self):
+        item = self.client.get(reverse('post-list')).data['results'][0]
+        detail = self.client.get(reverse('post-detail', args=[self.post.pk])).data
+
+        self.assertNotIn('body', item)
+        self.assertNotIn('toc', item)
+        self.assertEqual(item['excerpt'], self.post.excerpt)
+        self.assertEqual(item['reading_time'], 5)
+        self.assertIn('body', detail)
+
+    def test_fields_limit_the_response_and_the_loaded_columns(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('post-list'), {'fields': 'id,title'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [{'id': self.post.pk, 'title': 'Long read'}])
+        page_query = ctx.captured_queries[-1]['sql']
+        self.assertNotIn('"body"', page_query)
+        self.assertNotIn('"blog_user"', page_query)
+
+    def test_fields_can_ask_for_the_body(self):
+        response = self.client.get(reverse('post-list'), {'fields': 'id,body,body_html'})
+
+        self.assertEqual(set(response.data['results'][0]), {'id', 'body', 'body_html'})
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get(reverse('post-detail', args=[self.post.pk]), {'fields': 'title,password'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('password', str(response.data['fields']))
+
+
+class JSONRenderingTests(SimpleTestCase):
+    data = {
+        'title': 'Ünïcode ✓', 'rank': Decimal('1.50'), 'ids': [1, 2], 3: None,
+        'created_at': datetime.datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+    }
+
+    def test_renders_what_the_drf_renderer_renders(self):
+        self.assertEqual(
+            json.loads(ORJSONRenderer().render(self.data)), json.loads(JSONRenderer().render(self.data))
+        )
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+    def test_indented_responses_fall_back_to_drf(self):
+        rendered = ORJSONRenderer().render(self.data, 'application/json; indent=4')
+
+        self.assertEqual(rendered, JSONRenderer().render(self.data, 'application/json; indent=4'))
+
+    def test_parses_what_the_drf_parser_parses(self):
+        body = '{"title": "Ünïcode", "ids": [1, 2.5, null]}'.encode()
+
+        self.assertEqual(ORJSONParser().parse(BytesIO(body)), JSONParser().parse(BytesIO(body)))
+        with self.assertRaises(ParseError):
+            ORJSONParser().parse(BytesIO(b'{"title": '))
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class ResponseCompressionTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        for i in range(6):
+            make_post(self.user, f'Post {i}', tags=2, categories=1)
+        body = '\n\n'.join(f'## Section {i}\n\nSome *markdown* paragraph number {i}.' for i in range(40))
+        self.post = Post.objects.create(user=self.user, title='Long', body=body, status=Post.Status.PUBLISHED)
+
+    def test_negotiation(self):
+        cases = [
+            ('', None),
+            ('identity', None),
+            ('gzip', 'gzip'),
+            ('gzip;q=0', None),
+            ('deflate, gzip;q=0.5', 'gzip'),
+            ('*', 'br' if brotli else 'gzip'),
+            ('gzip, br', 'br' if brotli else 'gzip'),
+            ('gzip, br;q=0.5', 'gzip'),
+        ]
+        for header, expected in cases:
+            with self.subTest(header):
+                self.assertEqual(negotiate_encoding(header), expected)
+
+    def test_large_responses_are_gzipped(self):
+        url = reverse('post-detail', args=[self.post.pk])
+        plain = self.client.get(url)
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertLess(len(response.content), len(plain.content) / 2)
+        self.assertEqual(json.loads(gzip.decompress(response.content)), plain.json())
+        # Still answers a conditional request made with the weakened validator
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+        again = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+    @skipUnless(brotli, 'brotli is not installed')
+    def test_brotli_is_preferred(self):
+        response = self.client.get(reverse('post-list'), HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertIn('results', json.loads(brotli.decompress(response.content)))
+
+    def test_small_responses_are_left_alone(self):
+        response = self.client.get(reverse('tag-list'), {'page_size': 1}, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.json()['count'], Tag.objects.count())
+
+    @override_settings(RESPONSE_COMPRESSION={'ENABLED': False})
+    def test_can_be_turned_off(self):
+        response = self.client.get(reverse('post-list'), HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class BenchmarkSuiteTests(BlogTestCase):
+    def seed(self, **options):
+        call_command('seed_blog', users=3, posts=12, comments=4, depth=2, tags=5, categories=3, stderr=StringIO(), **options)
+
+    def test_seeding_is_reproducible(self):
+        self.seed()
+        first = list(Post.objects.order_by('pk').values_list('title', 'body', 'comments_count'))
+        self.assertEqual(len(first), 12)
+        with self.assertRaises(CommandError):
+            self.seed()
+
+        self.seed(clear=True)
+
+        self.assertEqual(list(Post.objects.order_by('pk').values_list('title', 'body', 'comments_count')), first)
+        self.assertEqual(User.objects.count(), 3)
+
+    def test_seeded_data_is_consistent(self):
+        self.seed()
+
+        for post in Post.objects.all():
+            self.assertEqual(post.comments_count, post.comments.filter(status=Comment.Status.APPROVED).count())
+            self.assertTrue(post.body_html and post.excerpt)
+        # Replies nest, but never deeper than --depth
+        self.assertTrue(Comment.objects.filter(parent_comment__isnull=False).exists())
+        self.assertFalse(Comment.objects.filter(parent_comment__parent_comment__parent_comment__isnull=False).exists())
+        self.assertTrue(self.client.login(user_name='seed-user-0', password='seed-password-123'))
+
+    def test_scenarios_run_and_roll_back_their_writes(self):
+        self.seed()
+        posts = Post.objects.count()
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        first, second = os.path.join(directory, 'first.json'), os.path.join(directory, 'second.json')
+
+        call_command('benchmark_scenarios', requests=2, warmup=0, output=first, stdout=StringIO(), stderr=StringIO())
+        stdout = StringIO()
+        call_command(
+            'benchmark_scenarios', requests=2, warmup=0, output=second, compare=first,
+            scenarios=['post-list'], stdout=stdout, stderr=StringIO(),
+        )
+
+        with open(first) as stream:
+            results = json.load(stream)
+        self.assertEqual(results['data']['posts'], posts)
+        self.assertEqual(set(results['scenarios']), {
+            'post-list', 'post-detail', 'comment-thread', 'by-tag', 'by-category', 'register', 'login', 'post-create',
+        })
+        for name, summary in results['scenarios'].items():
+            with self.subTest(name):
+                self.assertEqual((summary['requests'], summary['errors']), (2, 0))
+                self.assertGreater(summary['queries_mean'], 0)
+        self.assertIn('post-list: rps', stdout.getvalue())
+        self.assertEqual(Post.objects.count(), posts)
+        self.assertFalse(User.objects.filter(user_name__startswith='bench-').exists())
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False}, PROFILING={'ENABLED': True, 'SAMPLE_RATE': 1})
+class ProfilingTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        endpoint_stats.clear()
+        self.addCleanup(endpoint_stats.clear)
+        self.user = make_user()
+        for i in range(3):
+            make_post(self.user, f'Post {i}', tags=2, categories=1, comments=2)
+
+    def timings(self, response):
+        return {metric.split(';')[0]: metric for metric in response['Server-Timing'].split(', ')}
+
+    def test_sampled_requests_get_server_timing(self):
+        response = self.client.get(reverse('post-list'))
+
+        timings = self.timings(response)
+        self.assertEqual(set(timings), {'total', 'db', 'serialize', 'render'})
+        self.assertRegex(timings['db'], r'^db;dur=[\d.]+;desc="5 queries"$')
+
+    def test_toc_rendering_is_timed(self):
+        self.client.force_authenticate(self.user)
+
+        response = self.client.post(reverse('post-list'), {'title': 'New', 'body': '# Heading'})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('toc', self.timings(response))
+
+    def test_async_reads_are_profiled(self):
+        response = self.client.get(reverse('async-post-list'))
+
+        self.assertIn('desc="4 queries"', self.timings(response)['db'])
+
+    @override_settings(PROFILING={'ENABLED': True, 'SAMPLE_RATE': 0})
+    def test_unsampled_requests_are_untouched(self):
+        response = self.client.get(reverse('post-list'))
+
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(endpoint_stats.snapshot(), [])
+
+    def test_fingerprints_ignore_literals_and_in_list_lengths(self):
+        self.assertEqual(
+            fingerprint('SELECT * FROM "t" WHERE "a" IN (%s, %s, %s) AND "b" = 1'),
+            fingerprint('SELECT * FROM "t" WHERE "a" IN (%s) AND "b" = 22'),
+        )
+
+    def test_repeated_queries_are_reported(self):
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            for post in Post.objects.all():
+                list(post.comments.all())
+        finally:
+            current_profile.reset(token)
+        profile.finish()
+        endpoint_stats.add('GET n-plus-one', profile)
+
+        row = endpoint_stats.snapshot()[0]
+        self.assertEqual(row['queries_mean'], 4)
+        self.assertEqual(row['requests_with_duplicates'], 1)
+        [duplicate] = row['duplicate_queries']
+        self.assertEqual(duplicate['executions'], 3)
+        self.assertIn('blog_comment', duplicate['fingerprint'])
+
+    def test_stats_are_aggregated_per_endpoint_for_admins(self):
+        url = reverse('profiling-stats')
+        for _ in range(3):
+            self.client.get(reverse('post-list'))
+        self.client.get(reverse('post-detail', args=[Post.objects.first().pk]))
+
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        admin = make_user('admin')
+        admin.is_staff = True
+        admin.save()
+        self.client.force_authenticate(admin)
+        rows = {row['endpoint']: row for row in self.client.get(url).data['endpoints']}
+        self.assertEqual(rows['GET post-list']['requests'], 3)
+        self.assertEqual(rows['GET post-list']['queries_mean'], 5)
+        self.assertIn('serialize', rows['GET post-list']['timers_mean_ms'])
+        self.assertEqual(rows['GET post-detail']['requests'], 1)
+
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        # Only the DELETE itself, recorded once it had responded
+        self.assertEqual([row['endpoint'] for row in endpoint_stats.snapshot()], ['DELETE profiling-stats'])
+
+
+@override_settings(METRICS={'ENABLED': True})
+class MetricsTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics_registry.reset()
+        self.addCleanup(metrics_registry.reset)
+        self.user = make_user()
+        make_post(self.user, 'Post', tags=1, categories=1)
+
+    def scrape(self, **headers):
+        response = self.client.get(reverse('metrics'), **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def test_requests_are_recorded_per_route(self):
+        self.client.get(reverse('post-list'))
+        self.client.get(reverse('posts-by-category'), {'category': 'category0'})
+        self.client.get(reverse('post-detail', args=[0]))
+
+        metrics = self.scrape()
+
+        self.assertIn('http_requests_total{route="post-list",method="GET",status="200"} 1', metrics)
+        self.assertIn('http_requests_total{route="post-detail",method="GET",status="404"} 1', metrics)
+        self.assertIn('http_request_duration_seconds_count{route="posts-by-category",method="GET"} 1', metrics)
+        self.assertIn('http_request_duration_seconds_bucket{route="post-list",method="GET",le="+Inf"} 1', metrics)
+        # post-list: conditional GET validators, count, page, tags, categories
+        self.assertIn('db_queries_per_request_bucket{route="post-list",le="3.0"} 0', metrics)
+        self.assertIn('db_queries_per_request_bucket{route="post-list",le="10.0"} 1', metrics)
+
+    def test_cache_lookups_and_issued_tokens_are_counted(self):
+        with override_settings(RESPONSE_CACHE={'ENABLED': True}):
+            self.client.get(reverse('tag-list'))
+            self.client.get(reverse('tag-list'))
+        self.client.post(reverse('custom_token_obtain'), {'user_name': 'author', 'password': 'pass12345'})
+        self.client.post(reverse('custom_token_obtain'), {'user_name': 'author', 'password': 'wrong'})
+
+        metrics = self.scrape()
+
+        self.assertIn('cache_requests_total{cache="response",result="hit"} 1', metrics)
+        self.assertIn('cache_requests_total{cache="response",result="miss"} 1', metrics)
+        self.assertIn('auth_tokens_issued_total{kind="obtain"} 1', metrics)
+
+    def test_worker_processes_are_added_up(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        with override_settings(METRICS={'ENABLED': True, 'DIRECTORY': directory}):
+            self.client.get(reverse('tag-list'))
+            metrics_registry.flush(directory)
+            # Another worker's file, with the same values
+            [path] = os.listdir(directory)
+            with open(os.path.join(directory, path)) as stream:
+                state = stream.read()
+            with open(os.path.join(directory, 'metrics-1-other.json'), 'w') as stream:
+                stream.write(state)
+
+            metrics = self.scrape()
+
+        self.assertIn('http_requests_total{route="tag-list",method="GET",status="200"} 2', metrics)
+
+    def test_values_are_written_by_a_timer_not_while_responding(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        with override_settings(METRICS={'ENABLED': True, 'DIRECTORY': directory, 'FLUSH_INTERVAL': 60}):
+            self.client.get(reverse('tag-list'))
+            self.client.get(reverse('tag-list'))
+
+        self.assertEqual(os.listdir(directory), [])
+        timer = metrics_registry._timer
+        timer.cancel()
+        timer.function(*timer.args)
+        self.assertEqual(len(os.listdir(directory)), 1)
+        self.assertIsNone(metrics_registry._timer)
+
+    def test_gauges_of_stopped_workers_are_left_out(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        with open(os.path.join(directory, 'metrics-1-other.json'), 'w') as stream:
+            json.dump({'moderation_queue_depth': {'': 5}, 'comments_moderated_total': {'SPAM': 1}}, stream)
+
+        with override_settings(METRICS={'ENABLED': True, 'DIRECTORY': directory}):
+            with mock.patch('blog.metrics.process_alive', return_value=True):
+                running = self.scrape()
+            with mock.patch('blog.metrics.process_alive', return_value=False):
+                stopped = self.scrape()
+
+        self.assertIn('moderation_queue_depth 5', running)
+        self.assertIn('moderation_queue_depth 0', stopped)
+        self.assertIn('comments_moderated_total{status="SPAM"} 1', stopped)
+
+    def test_files_of_stopped_workers_are_folded_together(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        for pid in (1, 2):
+            with open(os.path.join(directory, f'metrics-{pid}-other.json'), 'w') as stream:
+                json.dump({'comments_moderated_total': {'SPAM': pid}}, stream)
+
+        with override_settings(METRICS={'ENABLED': True, 'DIRECTORY': directory}):
+            with mock.patch('blog.metrics.process_alive', return_value=False):
+                first = self.scrape()
+                self.assertNotIn('metrics-1-other.json', os.listdir(directory))
+                self.assertIn('metrics-stopped.json', os.listdir(directory))
+                second = self.scrape()
+
+        self.assertIn('comments_moderated_total{status="SPAM"} 3', first)
+        self.assertIn('comments_moderated_total{status="SPAM"} 3', second)
+        self.assertEqual(len([name for name in os.listdir(directory) if name.endswith('.json')]), 2)
+
+    @override_settings(METRICS={'ENABLED': True, 'TOKEN': 'secret'})
+    def test_scrapes_can_require_a_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        self.assertIn('# TYPE http_requests_total counter', self.scrape(HTTP_AUTHORIZATION='Bearer secret'))
+
+
+TEST_BUDGETS = {
+    'login': {'rate': '3/min', 'burst': 3},
+    'login-account': {'rate': '2/min', 'burst': 2},
+    'login-account-all': {'rate': '3/min', 'burst': 3},
+    'register': {'rate': '1/hour', 'burst': 1},
+    'comment': {'rate': '2/min', 'burst': 2},
+    'post': {'rate': '1/hour', 'burst': 1},
+    'like': {'rate': '2/min', 'burst': 2},
+}
+
+
+@override_settings(RATE_LIMITS={'ENABLED': True, 'BUDGETS': TEST_BUDGETS})
+class RateLimitTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics_registry.reset()
+        self.addCleanup(metrics_registry.reset)
+        self.user = make_user()
+
+    def login(self, user_name, address='198.51.100.1', password='wrong'):
+        return self.client.post(
+            reverse('custom_token_obtain'), {'user_name': user_name, 'password': password}, REMOTE_ADDR=address,
+        )
+
+    def test_login_flood_is_rejected_before_any_password_is_checked(self):
+        # Authenticating is what hashes the password
+        with mock.patch('django.contrib.auth.backends.ModelBackend.authenticate', return_value=None) as authenticate:
+            statuses = [self.login(f'user{i}').status_code for i in range(5)]
+
+        self.assertEqual(statuses, [401, 401, 401, 429, 429])
+        self.assertEqual(authenticate.call_count, 3)
+        self.assertGreater(int(self.login('user9')['Retry-After']), 0)
+
+    def test_one_account_is_limited_per_address(self):
+        statuses = [self.login('Author').status_code for _ in range(3)]
+
+        self.assertEqual(statuses, [401, 401, 429])
+        # Someone hammering an account doesn't lock its owner out elsewhere
+        self.assertEqual(self.login('author', '203.0.113.1', 'pass12345').status_code, 200)
+        # Other accounts from the same address still get through
+        self.assertEqual(self.login('someone-else').status_code, 401)
+
+    def test_one_account_is_limited_across_addresses(self):
+        statuses = [self.login('Author', f'198.51.100.{i}').status_code for i in range(5)]
+
+        self.assertEqual(statuses, [401, 401, 401, 429, 429])
+        self.assertEqual(self.login('someone-else', '198.51.100.4').status_code, 401)
+
+    @override_settings(RATE_LIMITS={'ENABLED': True, 'BUDGETS': {**TEST_BUDGETS, 'login': {'rate': '10/min', 'burst': 10}}})
+    def test_successful_logins_are_not_counted_against_the_account(self):
+        for _ in range(3):
+            self.assertEqual(self.login('author', password='pass12345').status_code, 200)
+
+        self.assertEqual([self.login('author').status_code for _ in range(3)], [401, 401, 429])
+
+    def test_buckets_refill(self):
+        now = time.time()
+        with mock.patch('blog.throttling.time.time', return_value=now):
+            self.login('author')
+            self.login('author')
+            self.assertEqual(self.login('author').status_code, 429)
+        with mock.patch('blog.throttling.time.time', return_value=now + 30):
+            self.assertEqual(self.login('author').status_code, 401)
+
+    def test_registration_is_limited_per_address(self):
+        def register(user_name):
+            return self.client.post(reverse('auth_register'), {
+                'user_name': user_name, 'email': f'{user_name}@example.com',
+                'password': 'Sup3r-secret!', 'password2': 'Sup3r-secret!',
+            })
+
+        self.assertEqual(register('first').status_code, 201)
+        self.assertEqual(register('second').status_code, 429)
+        self.assertFalse(User.objects.filter(user_name='second').exists())
+
+    def test_comment_writes_are_limited_per_user_and_reads_are_not(self):
+        post = make_post(self.user, 'Post')
+        url = reverse('post-comments-list', kwargs={'post_pk': post.pk})
+        self.client.force_authenticate(self.user)
+
+        statuses = [self.client.post(url, {'post': post.pk, 'comment_body': f'comment {i}'}).status_code for i in range(3)]
+
+        self.assertEqual(statuses, [201, 201, 429])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.client.force_authenticate(make_user('other'))
+        self.assertEqual(self.client.post(url, {'post': post.pk, 'comment_body': 'other'}).status_code, 201)
+
+    def test_likes_have_their_own_budget(self):
+        post = make_post(self.user, 'Post')
+        url = reverse('post-like', args=[post.pk])
+        self.client.force_authenticate(self.user)
+
+        self.assertEqual([self.client.post(url).status_code for _ in range(3)], [202, 200, 429])
+        response = self.client.post(reverse('post-list'), {'title': 'New', 'body': 'x'})
+        self.assertEqual(response.status_code, 201)
+
+    def test_rejections_are_counted(self):
+        for _ in range(4):
+            self.login('author')
+
+        metrics = self.client.get(reverse('metrics')).content.decode()
+
+        self.assertIn('rate_limited_requests_total{budget="login-account"} 2', metrics)
+        self.assertIn('http_requests_total{route="custom_token_obtain",method="POST",status="429"} 2', metrics)
+
+
+class ModerationTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics_registry.reset()
+        self.addCleanup(metrics_registry.reset)
+        self.user = make_user()
+        self.post = make_post(self.user, 'Post')
+        self.url = reverse('post-comments-list', kwargs={'post_pk': self.post.pk})
+
+    def comment(self, body, post=None, user=None):
+        return Comment.objects.create(
+            post=post or self.post, user=user or self.user, comment_body=body, status=Comment.Status.PENDING,
+        )
+
+    def comments_count(self, post=None):
+        return Post.objects.get(pk=(post or self.post).pk).comments_count
+
+    def test_new_comments_wait_for_moderation(self):
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(self.url, {'post': self.post.pk, 'comment_body': 'Nice write-up'})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['status'], Comment.Status.PENDING)
+        self.assertEqual(self.client.get(self.url).data['count'], 0)
+        self.assertEqual(self.comments_count(), 0)
+
+        # The worker runs inline with WORKERS = 0
+        with self.captureOnCommitCallbacks(execute=True):
+            for callback in callbacks:
+                callback()
+
+        self.assertEqual(Comment.objects.get().status, Comment.Status.APPROVED)
+        self.assertEqual(self.client.get(self.url).data['count'], 1)
+        self.assertEqual(self.comments_count(), 1)
+
+    def test_edited_comments_are_moderated_again(self):
+        comment = Comment.objects.create(post=self.post, user=self.user, comment_body='Nice write-up')
+        url = reverse('post-comments-detail', kwargs={'post_pk': self.post.pk, 'pk': comment.pk})
+        self.client.force_authenticate(self.user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(url, {'comment_body': 'Cheap viagra and casino loans, buy now'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Comment.objects.get().status, Comment.Status.SPAM)
+        self.assertEqual(self.client.get(self.url).data['count'], 0)
+        self.assertEqual(self.comments_count(), 0)
+
+    @override_settings(MODERATION={'ENABLED': False})
+    def test_comments_are_approved_right_away_when_disabled(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post(self.url, {'post': self.post.pk, 'comment_body': 'Nice write-up'})
+
+        self.assertEqual(response.data['status'], Comment.Status.APPROVED)
+        self.assertEqual(self.comments_count(), 1)
+
+    def test_spam_is_kept_out(self):
+        self.comment('Cheap viagra and casino bonus: https://a.example https://b.example https://c.example')
+        self.comment('Thanks, the index section helped.')
+
+        totals = moderate(Comment.objects.values_list('pk', flat=True))
+
+        self.assertEqual(totals, {Comment.Status.APPROVED: 1, Comment.Status.SPAM: 1})
+        self.assertEqual(self.comments_count(), 1)
+        metrics = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('comments_moderated_total{status="SPAM"} 1', metrics)
+        self.assertIn('comments_moderated_total{status="APPROVED"} 1', metrics)
+
+    def test_batches_are_written_in_bulk(self):
+        other = make_post(self.user, 'Other')
+
+        def queries(count):
+            pks = [self.comment(f'comment {i}', post=(self.post, other)[i % 2]).pk for i in range(count)]
+            cache.clear()  # author histories
+            with CaptureQueriesContext(connection) as captured:
+                moderate(pks)
+            return len(captured)
+
+        self.assertEqual(queries(2), queries(20))
+        self.assertEqual(self.comments_count(), 11)
+        self.assertEqual(self.comments_count(other), 11)
+
+    def test_comments_decided_meanwhile_are_left_alone(self):
+        comment = self.comment('Nice write-up')
+        comment.status = Comment.Status.APPROVED
+        comment.save()
+
+        self.assertEqual(moderate([comment.pk]), {})
+        self.assertEqual(self.comments_count(), 1)
+
+    def test_author_history_moves_the_score(self):
+        config = moderation_settings()
+        borderline = 'Is bitcoin any good for this?'
+
+        self.assertLess(spam_score(borderline, (5, 0), config), config['SPAM_THRESHOLD'])
+        self.assertGreaterEqual(spam_score(borderline, (0, 2), config), config['SPAM_THRESHOLD'])
+
+    def test_histories_are_cached_and_updated(self):
+        spammer = make_user('spammer')
+        self.comment('Cheap viagra, casino bonus', user=spammer)
+        moderate(Comment.objects.values_list('pk', flat=True))
+        borderline = self.comment('Is bitcoin any good for this?', user=spammer)
+
+        with CaptureQueriesContext(connection) as captured:
+            moderate([borderline.pk])
+
+        self.assertEqual(Comment.objects.get(pk=borderline.pk).status, Comment.Status.SPAM)
+        self.assertFalse(any('COUNT' in query['sql'] for query in captured))
+
+    @override_settings(MODERATION={'WORKERS': 1, 'BATCH_SIZE': 2})
+    def test_workers_take_queued_comments_in_batches(self):
+        pks = [self.comment(f'comment {i}').pk for i in range(5)]
+        queue = ModerationQueue()
+        with mock.patch('blog.moderation.ThreadPoolExecutor') as executor, \
+                mock.patch('blog.moderation.close_old_connections'):
+            queue.submit(pks[:3])
+            queue.submit(pks[3:])
+
+            # One worker, started by the first submit
+            executor.return_value.submit.assert_called_once()
+            with mock.patch.object(moderation_queue_depth, 'function', queue.depth):
+                metrics = self.client.get(reverse('metrics')).content.decode()
+            self.assertIn('moderation_queue_depth 5', metrics)
+
+            job, *args = executor.return_value.submit.call_args.args
+            with mock.patch('blog.moderation.moderate', wraps=moderate) as batches:
+                job(*args)
+
+        self.assertEqual([len(call.args[0]) for call in batches.call_args_list], [2, 2, 1])
+        self.assertEqual(queue.depth(), 0)
+        self.assertEqual(self.comments_count(), 5)
+
+    def test_command_classifies_leftover_pending_comments(self):
+        for i in range(3):
+            self.comment(f'comment {i}')
+        out = StringIO()
+
+        call_command('moderate_comments', batch_size=2, stdout=out)
+
+        self.assertIn('Approved 3 comments, marked 0 as spam.', out.getvalue())
+        self.assertEqual(self.comments_count(), 3)
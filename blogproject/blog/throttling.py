@@ -0,0 +1,176 @@
+"""Token bucket rate limits for the auth and write endpoints.
+
+Each budget ("login", "register", ...) is a bucket of ``burst`` tokens that
+refills at ``rate``; a request takes one token from the bucket of every
+identity it is keyed by (client IP, account name, user). Successful logins
+get their account tokens back, so only failed attempts count against an
+account: anyone can try a known user name, and counting every attempt
+would let them keep its owner from logging in. Buckets live in
+the Django cache, so with a shared cache (CACHE_URL=rediscache://...) the
+budgets hold across worker processes; with the default local memory cache
+they are per process.
+
+The throttles run in DRF's ``initial()``, after authentication and before
+the handler, so a rejected login or registration never reaches password
+hashing or the password validators. Reading and writing a bucket isn't
+atomic: concurrent requests on one identity can get a token more than once,
+which only makes the limit a little lenient.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+from .metrics import rate_limited
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'ratelimit',
+    'BUDGETS': {
+        # Per client IP; failed attempts per account name and IP, and per
+        # account name from all IPs together, looser so that locking an
+        # account takes several addresses
+        'login': {'rate': '10/min', 'burst': 10},
+        'login-account': {'rate': '5/min', 'burst': 5},
+        'login-account-all': {'rate': '30/min', 'burst': 30},
+        'refresh': {'rate': '30/min', 'burst': 10},
+        'register': {'rate': '5/hour', 'burst': 3},
+        # Per user
+        'comment': {'rate': '10/min', 'burst': 5},
+        'post': {'rate': '30/hour', 'burst': 10},
+        'like': {'rate': '60/min', 'burst': 20},
+    },
+}
+
+PERIODS = {'s': 1, 'sec': 1, 'min': 60, 'hour': 3600, 'day': 86400}
+
+
+def rate_limit_settings():
+    config = {**DEFAULTS, **getattr(settings, 'RATE_LIMITS', {})}
+    config['BUDGETS'] = {**DEFAULTS['BUDGETS'], **config['BUDGETS']}
+    return config
+
+
+def parse_rate(rate):
+    """'5/min' -> tokens added per second."""
+    count, period = rate.split('/')
+    return int(count) / PERIODS[period]
+
+
+def refill(state, burst, rate, now):
+    """Tokens in a bucket stored as ``(tokens, updated)``, ``None`` for a new, full one."""
+    tokens, updated = state or (burst, now)
+    return min(burst, tokens + (now - updated) * rate)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Checks the bucket of every ``(budget, identity)`` from ``get_identities()``."""
+
+    # Budgets whose tokens RefundOnSuccessMixin gives back
+    refundable = ()
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        config = rate_limit_settings()
+        if not config['ENABLED']:
+            return True
+        cache = caches[config['CACHE_ALIAS']]
+        now = time.time()
+        buckets = {
+            f"{config['KEY_PREFIX']}:{budget}:{identity}": (budget, config['BUDGETS'][budget])
+            for budget, identity in self.get_identities(request, view)
+        }
+        if not buckets:
+            return True
+        states = cache.get_many(buckets)
+
+        # A token from every bucket, or none: a rejected request doesn't use up the others
+        updates, timeout = {}, 1
+        for key, (budget, limits) in buckets.items():
+            burst, rate = limits['burst'], parse_rate(limits['rate'])
+            tokens = refill(states.get(key), burst, rate, now)
+            if tokens < 1:
+                rate_limited.inc(budget)
+                self.wait_seconds = (1 - tokens) / rate
+                return False
+            updates[key] = (tokens - 1, now)
+            # Kept until the bucket would be full again
+            timeout = max(timeout, int((burst - tokens + 1) / rate) + 1)
+        cache.set_many(updates, timeout)
+        # For refund(), once the view knows how the request went
+        request.rate_limit_refunds = {
+            key: budget for key, (budget, _) in buckets.items() if budget in self.refundable
+        }
+        return True
+
+    def get_identities(self, request, view):
+        raise NotImplementedError
+
+    def wait(self):
+        return self.wait_seconds
+
+    def client(self, request):
+        # REMOTE_ADDR, or X-Forwarded-For as set by REST_FRAMEWORK['NUM_PROXIES'] proxies
+        return f'ip:{self.get_ident(request)}'
+
+
+class LoginThrottle(TokenBucketThrottle):
+    refundable = ('login-account', 'login-account-all')
+
+    def get_identities(self, request, view):
+        client = self.client(request)
+        yield 'login', client
+        # Credential stuffing spreads one account's attempts over many addresses
+        user_name = request.data.get('user_name') if hasattr(request.data, 'get') else None
+        if isinstance(user_name, str) and user_name:
+            account = f'user_name:{user_name.lower()}'
+            yield 'login-account', f'{account}:{client}'
+            yield 'login-account-all', account
+
+
+class RefreshThrottle(TokenBucketThrottle):
+    def get_identities(self, request, view):
+        yield 'refresh', self.client(request)
+
+
+class RegisterThrottle(TokenBucketThrottle):
+    def get_identities(self, request, view):
+        yield 'register', self.client(request)
+
+
+class WriteThrottle(TokenBucketThrottle):
+    """Limits unsafe methods by user (by IP for anonymous requests) with the view's ``write_budget``."""
+
+    def get_identities(self, request, view):
+        if request.method in SAFE_METHODS:
+            return
+        user = request.user
+        yield view.write_budget, f'user:{user.pk}' if user and user.is_authenticated else self.client(request)
+
+
+def refund(request):
+    """Give back the refundable tokens the request took."""
+    charged = getattr(request, 'rate_limit_refunds', None)
+    if not charged:
+        return
+    config = rate_limit_settings()
+    cache = caches[config['CACHE_ALIAS']]
+    updates, timeout = {}, 1
+    for key, state in cache.get_many(charged).items():
+        limits = config['BUDGETS'][charged[key]]
+        tokens, updated = state
+        updates[key] = (min(limits['burst'], tokens + 1), updated)
+        timeout = max(timeout, int(limits['burst'] / parse_rate(limits['rate'])) + 1)
+    cache.set_many(updates, timeout)
+
+
+class RefundOnSuccessMixin:
+    """Refunds the throttles' refundable tokens when the view responds with 200."""
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if response.status_code == 200:
+            refund(request)
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,63 @@
+"""Record formats used by the import_posts/export_posts commands.
+
+One record per post: its fields plus the names of its tags and categories
+and its comments. In CSV the list columns hold JSON.
+"""
+import csv
+import json
+import sys
+from contextlib import contextmanager
+
+FORMATS = ('jsonl', 'csv')
+FIELDS = ['title', 'slug', 'body', 'status', 'author', 'created_at', 'tags', 'categories', 'comments']
+LIST_FIELDS = ('tags', 'categories', 'comments')
+
+# Long posts are far bigger than csv's default 128 KB field limit
+csv.field_size_limit(2 ** 31 - 1)
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return 'csv' if str(path).endswith('.csv') else 'jsonl'
+
+
+@contextmanager
+def open_stream(path, mode):
+    if path == '-':
+        yield sys.stdin if mode == 'r' else sys.stdout
+        return
+    with open(path, mode, encoding='utf-8', newline='') as stream:
+        yield stream
+
+
+def read_records(stream, fmt):
+    """Lazily yield records from a JSON Lines or CSV stream."""
+    if fmt == 'csv':
+        for row in csv.DictReader(stream):
+            for field in LIST_FIELDS:
+                row[field] = json.loads(row[field]) if row.get(field) else []
+            yield row
+        return
+
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+class RecordWriter:
+    def __init__(self, stream, fmt):
+        self.stream = stream
+        self.fmt = fmt
+        if fmt == 'csv':
+            self.csv_writer = csv.DictWriter(stream, fieldnames=FIELDS)
+            self.csv_writer.writeheader()
+
+    def write(self, record):
+        if self.fmt == 'csv':
+            row = dict(record)
+            for field in LIST_FIELDS:
+                row[field] = json.dumps(row[field], ensure_ascii=False)
+            self.csv_writer.writerow(row)
+        else:
+            self.stream.write(json.dumps(record, ensure_ascii=False) + '\n')
@@ -1,12 +1,112 @@
+import re
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.functions import Length
 from django.utils.text import slugify
 
+# Room kept for a "-<counter>" suffix when the base slug is cut to max_length
+SLUG_SUFFIX_RESERVE = 11
+
+
+def _slug_base_and_stem(model, value):
+    max_length = model._meta.get_field('slug').max_length
+    base_slug = slugify(value)[:max_length].strip('-') or model._meta.model_name
+    return base_slug, base_slug[:max_length - SLUG_SUFFIX_RESERVE].strip('-')
+
+
 def generate_unique_slug(model, value):
-    base_slug = slugify(value)
-    slug = base_slug
-    counter = 1
+    """Return a free slug for ``value``, appending ``-<n>`` when it is taken.
+
+    Looks up the highest existing suffix in a single query and keeps the
+    result within the slug field's ``max_length``.
+    """
+    base_slug, stem = _slug_base_and_stem(model, value)
+
+    # Sort the bare slug last and the highest numeric suffix first
+    taken = (
+        model.objects.filter(Q(slug=base_slug) | Q(slug__regex=rf'^{re.escape(stem)}-[0-9]+$'))
+        .annotate(
+            is_base=Case(When(slug=base_slug, then=Value(1)), default=Value(0), output_field=IntegerField()),
+            slug_length=Length('slug'),
+        )
+        .order_by('is_base', '-slug_length', '-slug')
+        .values_list('slug', flat=True)
+        .first()
+    )
+
+    if taken is None:
+        return base_slug
+    if taken == base_slug:
+        return f'{stem}-1'
+    return f'{stem}-{int(taken.rsplit("-", 1)[1]) + 1}'
+
+
+def allocate_unique_slugs(model, values):
+    """Bulk version of generate_unique_slug: one free slug per value, also
+    unique among each other, using a single query for all of them."""
+    bases_and_stems = [_slug_base_and_stem(model, value) for value in values]
+    if not bases_and_stems:
+        return []
+
+    stems = '|'.join(sorted({re.escape(stem) for _, stem in bases_and_stems}))
+    taken = set(
+        model.objects.filter(
+            Q(slug__in={base for base, _ in bases_and_stems}) | Q(slug__regex=rf'^({stems})-[0-9]+$')
+        ).values_list('slug', flat=True)
+    )
+    highest = {}
+    for slug in taken:
+        stem, _, suffix = slug.rpartition('-')
+        if suffix.isdigit():
+            highest[stem] = max(highest.get(stem, 0), int(suffix))
+
+    slugs = []
+    for base_slug, stem in bases_and_stems:
+        slug = base_slug
+        if slug in taken:
+            highest[stem] = highest.get(stem, 0) + 1
+            slug = f'{stem}-{highest[stem]}'
+        taken.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+def save_with_unique_slug(instance, value, save, attempts=5):
+    """Allocate a slug for ``instance`` and call ``save()``.
+
+    A concurrent insert can take the slug between allocation and insert; in
+    that case the unique constraint fails and a new slug is allocated.
+    """
+    model = type(instance)
+    for attempt in range(attempts):
+        instance.slug = generate_unique_slug(model, value)
+        try:
+            with transaction.atomic():
+                return save()
+        except IntegrityError:
+            slug_was_taken = model.objects.filter(slug=instance.slug).exists()
+            if not slug_was_taken or attempt == attempts - 1:
+                raise
+
+
+def build_comment_tree(comments):
+    """Group an already-loaded flat list of comments into threads.
+
+    Returns the top-level comments and a mapping of comment id -> direct
+    replies. Every comment gets a ``thread_level`` attribute (0 for roots).
+    Replies whose parent is not in ``comments`` are dropped together with
+    their subtree.
+    """
+    children = {}
+    for comment in comments:
+        children.setdefault(comment.parent_comment_id, []).append(comment)
 
-    while model.objects.filter(slug=slug).exists():
-        slug = f"{base_slug}-{counter}"
-        counter += 1
+    roots = children.get(None, [])
+    stack = [(root, 0) for root in roots]
+    while stack:
+        comment, level = stack.pop()
+        comment.thread_level = level
+        stack.extend((reply, level + 1) for reply in children.get(comment.id, []))
 
-    return slug
+    return roots, children
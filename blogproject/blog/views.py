@@ -1,16 +1,37 @@
 from rest_framework import viewsets
-from .models import User, Post, Comment, Tag
+from .models import User, Post, Comment, Tag, Category, PostLike
 from .serializers import UserSerializer, CommentSerializer, MyTokenObtainPairSerializer, PostSerializer, TagSerializer
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.permissions import AllowAny
-from .serializers import RegisterSerializer
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.views import APIView
+from .serializers import PostListSerializer, PostSearchSerializer, RegisterSerializer
+from .serializers import include_body_html, rendered_fields
 from rest_framework import generics
 from rest_framework_simplejwt.views import TokenObtainPairView
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.parsers import MultiPartParser, FormParser
-from .pagination import SmallResultsSetPagination
+from .pagination import SmallResultsSetPagination, OptionalKeysetPagination, CommentPagination
 from rest_framework import viewsets, filters
-from django.db.models import QuerySet
+from django.db.models import QuerySet, Value
+from django.db.models.functions import Lower
 from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
+from .utility import build_comment_tree
+from .counters import post_counters
+from .authentication import denylist, model_user
+from .cache import CachedReadMixin
+from .search import search_posts
+from .profiling import endpoint_stats, profiling_settings
+from .throttling import LoginThrottle, RefundOnSuccessMixin, RegisterThrottle, WriteThrottle
+from .moderation import edited_comment_status, new_comment_status
+from .conditional import ConditionalGetMixin, comment_list_validators, post_list_validators, post_validators
+from rest_framework.decorators import action
+from rest_framework import status
+from django.http import HttpResponse
+from typing import cast
+import os
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -20,49 +41,203 @@ class UserViewSet(viewsets.ModelViewSet):
 
 
 
-class MyObtainTokenPairView(TokenObtainPairView):
+class ThrottledTokenObtainPairView(RefundOnSuccessMixin, TokenObtainPairView):
+    # Rejects floods before any password is hashed; successful logins don't
+    # count against the account, see blog/throttling.py
+    throttle_classes = (LoginThrottle,)
+
+
+class MyObtainTokenPairView(ThrottledTokenObtainPairView):
     permission_classes = (AllowAny,)
     serializer_class = MyTokenObtainPairSerializer
 
+class LogoutView(generics.GenericAPIView):
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        # Access tokens are otherwise trusted until they expire
+        denylist.revoke_token(request.auth)
+        refresh = request.data.get('refresh')
+        if refresh:
+            try:
+                denylist.revoke_token(RefreshToken(refresh))
+            except TokenError:
+                raise ValidationError({'refresh': 'Invalid refresh token.'})
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 class RegisterView(generics.CreateAPIView):
     # Defines the set of objects this view works with
     queryset = User.objects.all()
     # Allows anyone (even unauthenticated users) to access this endpoint
     permission_classes = (AllowAny,)
+    throttle_classes = (RegisterThrottle,)
     serializer_class = RegisterSerializer
 
-class PostViewSet(viewsets.ModelViewSet):
-    queryset = Post.objects.all()
+class PostViewSet(CachedReadMixin, ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = Post.objects.for_serialization()
     serializer_class = PostSerializer
     parser_classes = [MultiPartParser, FormParser]
+    throttle_classes = (WriteThrottle,)
+    write_budget = 'post'
     filter_backends = [filters.OrderingFilter]
-    ordering_fields = ['created_at']  # allow ordering by created_at field
+    pagination_class = OptionalKeysetPagination  # ?pagination=cursor ignores ?ordering
+    ordering_fields = ['created_at', 'comments_count']  # allow ordering by creation date or comment count
     ordering = ['-created_at']  # default ordering newest first
 
 
+    def get_serializer_class(self):
+        return PostListSerializer if self.action == 'list' else PostSerializer
+
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve'):
+            # Only the columns of the fields that will be rendered (?fields=)
+            return Post.objects.for_serialization(fields=rendered_fields(self.get_serializer()))
+        body_html = self.action == 'html' or include_body_html(self.request)
+        return Post.objects.for_serialization(body_html=body_html)
+
+    def get_list_validators(self):
+        return post_list_validators(Post.objects.all())
+
+    def get_object_validators(self):
+        return post_validators(self.kwargs['pk'])
+
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        serializer.save(user=model_user(self.request.user))
+        self.reload_for_response(serializer)
+
+    def perform_update(self, serializer):
+        serializer.save()
+        self.reload_for_response(serializer)
+
+    def reload_for_response(self, serializer):
+        # Reload with the batched relations so the response has no N+1
+        serializer.instance = self.get_queryset().get(pk=serializer.instance.pk)
+
+    @action(detail=True, methods=['get'])
+    def html(self, request, pk=None):
+        # Pre-rendered body, ready to be cached by a CDN
+        post = self.get_object()
+        response = HttpResponse(post.body_html, content_type='text/html; charset=utf-8')
+        # body_html is sanitized when saved; should anything slip through, it
+        # still runs in an opaque origin without scripts
+        response['Content-Security-Policy'] = 'sandbox'
+        response['X-Content-Type-Options'] = 'nosniff'
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        # Buffered, written to Post/PostView by the periodic flush. 304s count too.
+        if response.status_code in (200, 304):
+            post_counters.increment_view(int(kwargs['pk']))
+        return response
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': 'This query parameter is required.'})
+        return self.cached_response(request, lambda: self.search_response(request, query))
+
+    def search_response(self, request, query):
+        # Best match first, so page numbers rather than the created_at keyset
+        paginator = SmallResultsSetPagination()
+        page = paginator.paginate_queryset(search_posts(self.get_queryset(), query), request, view=self)
+        serializer = PostSearchSerializer(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+
+    # Its own budget, so liking doesn't use up the user's post creations
+    @action(detail=True, methods=['post'], write_budget='like')
+    def like(self, request, pk=None):
+        post = self.get_object()
+        # Liking again changes nothing; only a new like is counted
+        _, created = PostLike.objects.get_or_create(post_id=post.pk, user_id=request.user.pk)
+        if not created:
+            return Response(status=status.HTTP_200_OK)
+        post_counters.increment_like(post.pk)
+        return Response(status=status.HTTP_202_ACCEPTED)
 
     def get_permissions(self):
             # Allow anyone to read (GET), but require auth for create/update/delete
-            if self.action in ['list', 'retrieve']:
+            if self.action in ['list', 'retrieve', 'html', 'search']:
                 return [AllowAny()]
             return [IsAuthenticated()]
 
 
-class CommentViewSet(viewsets.ModelViewSet):
+def parse_thread_depth(request):
+    depth = request.query_params.get('depth')
+    if depth is None:
+        return None
+    try:
+        depth = int(depth)
+    except ValueError:
+        raise ValidationError({'depth': 'Must be a non-negative integer.'})
+    if depth < 0:
+        raise ValidationError({'depth': 'Must be a non-negative integer.'})
+    return depth
+
+
+class CommentViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Comment.objects.all()
     permission_classes = (AllowAny,)
     serializer_class = CommentSerializer
+    pagination_class = CommentPagination
+    throttle_classes = (WriteThrottle,)
+    write_budget = 'comment'
 
 
     def get_queryset(self):
         post_id = self.kwargs['post_pk']  # Or however you get post id from URL
-        return Comment.objects.filter(post_id=post_id, status='APPROVED').order_by('created_at')
+        return Comment.objects.filter(post_id=post_id, status='APPROVED').select_related('user').order_by('created_at')
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, self.get_list_validators(), lambda: self.list_threads(request))
+
+    def get_list_validators(self):
+        return comment_list_validators(self.get_queryset())
+
+    def list_threads(self, request):
+        if self.paginator.uses_keyset(request):
+            page = self.paginate_queryset(self.get_queryset().filter(parent_comment=None))
+            roots, children = build_comment_tree(page + self.load_replies(page))
+        else:
+            # Load every approved comment of the post in one query, build the reply
+            # tree in memory and paginate by top-level threads.
+            roots, children = build_comment_tree(list(self.get_queryset()))
+            page = self.paginate_queryset(roots)
+
+        context = self.get_serializer_context()
+        context['comment_children'] = children
+        context['depth'] = self.get_thread_depth()
+
+        serializer = CommentSerializer(page if page is not None else roots, many=True, context=context)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
+    def get_thread_depth(self):
+        return parse_thread_depth(self.request)
+
+    def load_replies(self, comments):
+        """Replies of ``comments`` down to the requested depth, one query per level."""
+        replies, levels = [], self.get_thread_depth()
+        while comments and levels != 0:
+            comments = list(self.get_queryset().filter(parent_comment__in=[comment.id for comment in comments]))
+            replies.extend(comments)
+            levels = None if levels is None else levels - 1
+        return replies
 
     def perform_create(self, serializer):
         post_id = self.kwargs['post_pk']
-        serializer.save(user=self.request.user, post_id=post_id)
+        # Listed once a moderation worker approves it, see blog/moderation.py
+        serializer.save(user=model_user(self.request.user), post_id=post_id, status=new_comment_status())
+
+    def perform_update(self, serializer):
+        comment = serializer.instance
+        if serializer.validated_data.get('comment_body', comment.comment_body) != comment.comment_body:
+            # Checked again, or an approved comment could be edited into spam
+            serializer.save(status=edited_comment_status(comment))
+        else:
+            serializer.save()
 
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
@@ -71,41 +246,45 @@ class CommentViewSet(viewsets.ModelViewSet):
 
 
     def get_comment_count(self, post_id):
-        count = Comment.objects.filter(post_id=post_id, status='APPROVED').count()
-        return count
+        return Post.objects.filter(pk=post_id).values_list('comments_count', flat=True).first() or 0
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(CachedReadMixin, viewsets.ReadOnlyModelViewSet):
+    cache_resource = 'tags'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [AllowAny]  #
     pagination_class = SmallResultsSetPagination
 
 
-class PostListByCategoryView(generics.ListAPIView):
-    serializer_class = PostSerializer
+class PostListByCategoryView(CachedReadMixin, generics.ListAPIView):
+    serializer_class = PostListSerializer
+    pagination_class = OptionalKeysetPagination
 
     def get_queryset(self) -> QuerySet[Post]:
         request = cast(Request, self.request)
 
         category_name = request.query_params.get('category')
-        queryset = Post.objects.all()
+        queryset = Post.objects.for_serialization(fields=rendered_fields(self.get_serializer()))
 
         if category_name:
+            # Compared as LOWER(name) so category_name_lower_idx can be used
+            categories = Category.objects.alias(name_lower=Lower('name')).filter(name_lower=Lower(Value(category_name)))
             queryset = queryset.filter(
-                post_categories__category__name__iexact=category_name,
+                post_categories__category__in=categories,
                 status=Post.Status.PUBLISHED
             ).distinct()
 
         return queryset
 
 
-class PostListByTagSlugView(generics.ListAPIView):
-    serializer_class = PostSerializer
+class PostListByTagSlugView(CachedReadMixin, generics.ListAPIView):
+    serializer_class = PostListSerializer
+    pagination_class = OptionalKeysetPagination
     permission_classes = [AllowAny]
 
     def get_queryset(self):
         tag_slug = self.request.query_params.get('tag')
-        queryset = Post.objects.all()
+        queryset = Post.objects.for_serialization(fields=rendered_fields(self.get_serializer()))
 
         if tag_slug:
             queryset = queryset.filter(
@@ -114,3 +293,21 @@ class PostListByTagSlugView(generics.ListAPIView):
             ).distinct()
 
         return queryset
+
+
+class ProfilingStatsView(APIView):
+    """Per-endpoint totals of the profiled requests, for this worker process."""
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        config = profiling_settings()
+        return Response({
+            'pid': os.getpid(),
+            'enabled': config['ENABLED'],
+            'sample_rate': config['SAMPLE_RATE'],
+            'endpoints': endpoint_stats.snapshot(),
+        })
+
+    def delete(self, request):
+        endpoint_stats.clear()
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,40 @@
+"""Connection reuse settings for DATABASES, selected with DB_CONNECTION_MODE.
+
+none        a new connection for every request (Django's default)
+persistent  each worker thread keeps its connection for CONN_MAX_AGE seconds;
+            it is pinged before being reused after an error or a restart
+pool        a psycopg 3 connection pool per worker process (needs
+            ``psycopg[pool]``), checked before every checkout. Size it to the
+            worker's threads: workers x max_size must stay below Postgres'
+            max_connections.
+"""
+from django.core.exceptions import ImproperlyConfigured
+
+CONNECTION_MODES = ('none', 'persistent', 'pool')
+
+
+def connection_settings(mode, max_age=60, pool_min_size=2, pool_max_size=4, pool_timeout=10):
+    """Keys to merge into a DATABASES entry for ``mode``."""
+    if mode == 'none':
+        return {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False}
+    if mode == 'persistent':
+        return {'CONN_MAX_AGE': max_age, 'CONN_HEALTH_CHECKS': True}
+    if mode == 'pool':
+        try:
+            from psycopg_pool import ConnectionPool
+        except ImportError:
+            raise ImproperlyConfigured("DB_CONNECTION_MODE=pool needs psycopg 3: pip install 'psycopg[binary,pool]'")
+        return {
+            # The pool owns the connections; Django must not keep them as well
+            'CONN_MAX_AGE': 0,
+            'CONN_HEALTH_CHECKS': False,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': pool_min_size,
+                    'max_size': pool_max_size,
+                    'timeout': pool_timeout,  # seconds to wait for a free connection
+                    'check': ConnectionPool.check_connection,
+                },
+            },
+        }
+    raise ImproperlyConfigured(f'DB_CONNECTION_MODE must be one of {", ".join(CONNECTION_MODES)}, not {mode!r}.')
@@ -15,6 +15,8 @@ import environ
 import os
 from datetime import timedelta
 
+from .database import connection_settings
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -30,7 +32,9 @@ environ.Env.read_env(os.path.join(BASE_DIR, '.env'))  # read from .env file
 DEBUG = env('DEBUG')
 POSTGRES_USER = env('POSTGRES_USER')
 POSTGRES_PASSWORD = env('POSTGRES_PASSWORD')
-POSTGRES_DB = env('POSTGRES_DB')
+# postgresql, or sqlite for running and benchmarking locally without a server
+DB_ENGINE = env.str('DB_ENGINE', default='postgresql')
+POSTGRES_DB = env('POSTGRES_DB') if DB_ENGINE == 'postgresql' else None
 
 
 
@@ -66,6 +70,12 @@ MIDDLEWARE = [
     # My settings
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Outside compression and profiling so latency covers them, see blog/metrics.py
+    'blog.metrics.MetricsMiddleware',
+    # Before anything that reads the response body, see blog/middleware.py
+    'blog.middleware.CompressionMiddleware',
+    # Opt-in and sampled, see PROFILING below
+    'blog.profiling.ProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -101,16 +111,36 @@ WSGI_APPLICATION = 'blogproject.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': POSTGRES_DB,
-        'USER': POSTGRES_USER,
-        'PASSWORD': POSTGRES_PASSWORD,
-        'HOST': 'localhost',
-        'PORT': 5432,
+# Connection reuse: none, persistent or pool, see blogproject/database.py
+DATABASE_CONNECTION = connection_settings(
+    env.str('DB_CONNECTION_MODE', default='persistent'),
+    max_age=env.int('DB_CONN_MAX_AGE', default=60),
+    # Per worker process
+    pool_min_size=env.int('DB_POOL_MIN_SIZE', default=2),
+    pool_max_size=env.int('DB_POOL_MAX_SIZE', default=4),
+    pool_timeout=env.int('DB_POOL_TIMEOUT', default=10),
+)
+
+if DB_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': env.str('SQLITE_PATH', default=str(BASE_DIR / 'db.sqlite3')),
+            **DATABASE_CONNECTION,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': POSTGRES_DB,
+            'USER': POSTGRES_USER,
+            'PASSWORD': POSTGRES_PASSWORD,
+            'HOST': 'localhost',
+            'PORT': 5432,
+            **DATABASE_CONNECTION,
+        }
     }
-}
 
 
 # Password validation
@@ -156,8 +186,22 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # request.user from token claims, see blog/authentication.py
+        'blog.authentication.ClaimsJWTAuthentication',
+    ],
+    # orjson when installed, see blog/renderers.py
+    'DEFAULT_RENDERER_CLASSES': [
+        'blog.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
+    'DEFAULT_PARSER_CLASSES': [
+        'blog.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    # Proxies in front of the app; the client IP the rate limits key on is taken
+    # from X-Forwarded-For only when this is set
+    'NUM_PROXIES': env.int('NUM_PROXIES', default=0),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
         'PAGE_SIZE': 6,  # or any number of posts per page
     # 'DEFAULT_PERMISSION_CLASSES': [
@@ -173,9 +217,76 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=1),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=15),
     'ROTATE_REFRESH_TOKENS': True,
+    'TOKEN_REFRESH_SERIALIZER': 'blog.serializers.DenylistTokenRefreshSerializer',
+}
+
+TOKEN_AUTH = {
+    'CLAIMS_USER': env.bool('TOKEN_AUTH_CLAIMS_USER', default=True),
+    'USER_CACHE_TIMEOUT': env.int('TOKEN_AUTH_USER_CACHE_TIMEOUT', default=60),
 }
 AUTH_USER_MODEL = 'blog.User'
 
+CACHES = {
+    # e.g. CACHE_URL=filecache:///var/tmp/django_cache or rediscache://localhost:6379/1
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+# Anonymous post/tag read cache, see blog/cache.py
+RESPONSE_CACHE = {
+    'ENABLED': env.bool('RESPONSE_CACHE_ENABLED', default=True),
+    'ALIAS': 'default',
+    'TIMEOUT': env.int('RESPONSE_CACHE_TIMEOUT', default=300),  # seconds
+}
+
+# Write-behind view/like counters, see blog/counters.py
+POST_COUNTERS = {
+    'ENABLED': env.bool('POST_COUNTERS_ENABLED', default=True),
+    'FLUSH_INTERVAL': env.int('POST_COUNTERS_FLUSH_INTERVAL', default=10),  # seconds
+    'MAX_PENDING': 1000,
+}
+
+# blog/async_views.py: run a page and its count on separate connections
+ASYNC_READS = {
+    'PARALLEL_QUERIES': env.bool('ASYNC_READS_PARALLEL_QUERIES', default=True),
+}
+
+# Prometheus metrics at /metrics, see blog/metrics.py. Under gunicorn, point
+# METRICS_DIR at a directory shared by the workers and empty it on start.
+METRICS = {
+    'ENABLED': env.bool('METRICS', default=True),
+    'DIRECTORY': env.str('METRICS_DIR', default=''),
+    'TOKEN': env.str('METRICS_TOKEN', default=''),
+}
+
+# Token bucket limits on login, registration and writes, see blog/throttling.py
+RATE_LIMITS = {
+    'ENABLED': env.bool('RATE_LIMITS', default=True),
+}
+
+# New comments wait for background spam classification, see blog/moderation.py
+MODERATION = {
+    'ENABLED': env.bool('COMMENT_MODERATION', default=True),
+    'WORKERS': env.int('MODERATION_WORKERS', default=2),
+}
+
+# Sampled per-request timings (Server-Timing, /api/admin/profiling/), see blog/profiling.py
+PROFILING = {
+    'ENABLED': env.bool('PROFILING', default=False),
+    'SAMPLE_RATE': env.float('PROFILING_SAMPLE_RATE', default=0.01),
+}
+
+# gzip/brotli for large JSON responses, see blog/middleware.py
+RESPONSE_COMPRESSION = {
+    'ENABLED': env.bool('RESPONSE_COMPRESSION', default=True),
+    'MIN_SIZE': env.int('RESPONSE_COMPRESSION_MIN_SIZE', default=1024),
+}
+
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Upload sanitizing and WebP/AVIF thumbnails, see blog/images.py
+IMAGE_VARIANTS = {
+    'MAX_UPLOAD_BYTES': env.int('IMAGE_MAX_UPLOAD_BYTES', default=10 * 1024 * 1024),
+    'WORKERS': env.int('IMAGE_VARIANT_WORKERS', default=2),
+}
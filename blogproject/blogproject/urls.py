@@ -4,11 +4,14 @@ from rest_framework.routers import DefaultRouter
 from rest_framework_nested import routers
 from django.conf import settings
 from django.conf.urls.static import static
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.views import TokenRefreshView
+from blog import async_views
+from blog.metrics import metrics_view
+from blog.throttling import RefreshThrottle
 from blog.views import (
-    MyObtainTokenPairView, RegisterView,
+    MyObtainTokenPairView, ThrottledTokenObtainPairView, RegisterView, LogoutView,
     UserViewSet, PostViewSet, CommentViewSet, TagViewSet,
-    PostListByTagSlugView, PostListByCategoryView
+    PostListByTagSlugView, PostListByCategoryView, ProfilingStatsView
 )
 
 # Main router
@@ -28,14 +31,29 @@ urlpatterns = [
     path('api/posts/by-category/', PostListByCategoryView.as_view(), name='posts-by-category'),
     path('api/posts/by-slug/', PostListByTagSlugView.as_view(), name='post-list-by-slug'),
 
+    # Async (ASGI) read paths, same responses as their counterparts below
+    path('api/async/posts/', async_views.post_list, name='async-post-list'),
+    path('api/async/posts/<int:pk>/', async_views.post_detail, name='async-post-detail'),
+    path('api/async/posts/<int:post_pk>/comments/', async_views.comment_thread, name='async-post-comments'),
+    path('api/async/tags/', async_views.tag_list, name='async-tag-list'),
+
     # API routers
     path('api/', include(router.urls)),
     path('api/', include(posts_router.urls)),
 
     # Auth endpoints
-    path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('api/token/', ThrottledTokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('api/token/refresh/', TokenRefreshView.as_view(throttle_classes=[RefreshThrottle]), name='token_refresh'),
     path('api/login/', MyObtainTokenPairView.as_view(), name='custom_token_obtain'),
-    path('api/login/refresh/', TokenRefreshView.as_view(), name='custom_token_refresh'),
+    path(
+        'api/login/refresh/', TokenRefreshView.as_view(throttle_classes=[RefreshThrottle]),
+        name='custom_token_refresh',
+    ),
+    path('api/logout/', LogoutView.as_view(), name='auth_logout'),
     path('api/register/', RegisterView.as_view(), name='auth_register'),
+
+    path('metrics', metrics_view, name='metrics'),
+
+    # Sampled request profiles, see blog/profiling.py
+    path('api/admin/profiling/', ProfilingStatsView.as_view(), name='profiling-stats'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
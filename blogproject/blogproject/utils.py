@@ -1,6 +1,11 @@
+import math
+
 import markdown
+import nh3
 from bs4 import BeautifulSoup, Tag
 import re
+from html import escape, unescape
+from html.parser import HTMLParser
 
 def extract_toc(markdown_text):
     html = markdown.markdown(markdown_text)
@@ -23,3 +28,130 @@ def extract_toc(markdown_text):
             'slug': slug,
         })
     return toc
+
+
+HEADING_TAGS = {f'h{level}' for level in range(1, 7)}
+HTML_COMMENT_RE = re.compile(r'<!--.*?-->', re.DOTALL)
+TAG_RE = re.compile(r'<[^>]*>')
+WHITESPACE_RE = re.compile(r'\s+')
+
+# Markdown passes raw HTML through and body_html is served as text/html, so
+# only these tags and attributes are kept: nh3's defaults, link/image titles
+# and heading anchors
+HTML_TAGS = nh3.ALLOWED_TAGS
+HTML_ATTRIBUTES = {
+    **nh3.ALLOWED_ATTRIBUTES,
+    'a': {'href', 'hreflang', 'title'},
+    'img': {'src', 'alt', 'title', 'width', 'height'},
+    **{f'h{level}': {'id'} for level in range(1, 7)},
+}
+URL_SCHEMES = {'http', 'https', 'mailto'}
+
+EXCERPT_LENGTH = 280
+WORDS_PER_MINUTE = 200
+
+
+class HeadingParser(HTMLParser):
+    """Collects the headings of an HTML document as extract_toc sees them.
+
+    BeautifulSoup's "html.parser" tree is built from this same tokenizer, so
+    comments, script contents, quoted ``>`` and nested headings come out
+    the same, without building the tree. Each heading is a dict with its
+    level, text nodes, the offset and text of its start tag and whether it
+    declares an id.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.headings = []
+        self._open = []
+        self._in_script = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.CDATA_CONTENT_ELEMENTS:
+            self._in_script = True
+        if tag not in HEADING_TAGS:
+            return
+        heading = {
+            'level': int(tag[1]),
+            'strings': [],
+            'position': self.getpos(),
+            'start_tag': self.get_starttag_text(),
+            'has_id': any(name == 'id' for name, _ in attrs),
+        }
+        self.headings.append(heading)
+        self._open.append((tag, heading))
+
+    def handle_endtag(self, tag):
+        if tag in self.CDATA_CONTENT_ELEMENTS:
+            self._in_script = False
+        # Closes the innermost open heading of that name, and everything in it
+        for index in range(len(self._open) - 1, -1, -1):
+            if self._open[index][0] == tag:
+                del self._open[index:]
+                break
+
+    def handle_data(self, data):
+        # get_text() leaves out script and style contents
+        if not self._in_script:
+            for _, heading in self._open:
+                heading['strings'].append(data)
+
+
+def toc_entry(heading):
+    # Mirrors get_text(strip=True): every text node is stripped, then joined
+    text = ''.join(piece for piece in (string.strip() for string in heading['strings']) if piece)
+    slug = re.sub(r'[^\w\s-]', '', text).strip().lower().replace(' ', '-')
+
+    return {
+        'level': heading['level'],
+        'text': text,
+        'slug': slug,
+    }
+
+
+def sanitize_html(html):
+    """Drop scripts, event handlers, ``javascript:`` URLs and every tag or
+    attribute outside the allowlist."""
+    return nh3.clean(html, tags=HTML_TAGS, attributes=HTML_ATTRIBUTES, url_schemes=URL_SCHEMES)
+
+
+def render_markdown_with_toc(markdown_text):
+    """Render markdown to sanitized HTML and extract the toc in the same pass.
+
+    Every heading in the returned HTML gets an ``id`` equal to its toc slug,
+    unless it already declares one (raw HTML headings).
+    """
+    html = markdown.markdown(markdown_text)
+    parser = HeadingParser()
+    parser.feed(html)
+    parser.close()
+
+    line_starts = [0] + [match.end() for match in re.finditer('\n', html)]
+    toc, pieces, copied = [], [], 0
+    for heading in parser.headings:
+        entry = toc_entry(heading)
+        toc.append(entry)
+        if heading['has_id']:
+            continue
+        line, column = heading['position']
+        start_tag = heading['start_tag']
+        # Before the start tag's closing '>' (or '/>')
+        end = line_starts[line - 1] + column + len(start_tag) - (2 if start_tag.endswith('/>') else 1)
+        pieces += [html[copied:end], f' id="{escape(entry["slug"])}"']
+        copied = end
+    pieces.append(html[copied:])
+    return sanitize_html(''.join(pieces)), toc
+
+
+def summarize_html(html, length=EXCERPT_LENGTH):
+    """Plain-text excerpt of rendered HTML, cut at a word boundary, and the
+    reading time in whole minutes."""
+    text = unescape(TAG_RE.sub(' ', HTML_COMMENT_RE.sub('', html)))
+    text = WHITESPACE_RE.sub(' ', text).strip()
+    words = len(text.split())
+    minutes = math.ceil(words / WORDS_PER_MINUTE)
+    if len(text) > length:
+        text = text[:length].rsplit(' ', 1)[0] + '…'
+    return text, minutes
+